@@ -3,5 +3,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backends.settings')
+# Views that run on the event loop instead of a thread per request
+os.environ.setdefault('ASYNC_VIEWS', 'true')
 
 application = get_asgi_application()
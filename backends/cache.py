@@ -0,0 +1,251 @@
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django_redis.client import DefaultClient
+
+from .instrumentation import record_cache_lookup, timed
+
+# Django hands each thread its own backend instance, so the local tier is
+# kept per process here, like LocMemCache does, and shared by all threads.
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class _LocalTier:
+    def __init__(self):
+        self.entries = OrderedDict()  # key -> (value, expires_at, size)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+
+class TieredCache(BaseCache):
+    """Bounded in-process LRU in front of another cache alias
+
+    Reads are served from memory when possible and fill it from the remote
+    cache on a miss; writes go to both. Local entries live at most
+    LOCAL_TIMEOUT seconds, which bounds how long another process's write or
+    delete can go unseen. Values handed out from memory are shared objects,
+    so callers must not mutate them. Keys ending in one of REMOTE_ONLY
+    (single-flight lock tokens) are never kept in memory, so whoever checks
+    a lock sees its current holder.
+
+        'search': {
+            'BACKEND': 'backends.cache.TieredCache',
+            'OPTIONS': {
+                'REMOTE': 'default',
+                'LOCAL_TIMEOUT': 5,
+                'MAX_ENTRIES': 10000,
+                'MAX_SIZE': 64 * 1024 * 1024,  # bytes, pickled size
+            },
+        }
+    """
+
+    REMOTE_ONLY = (':lock',)
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        self._remote_alias = options.get('REMOTE', 'default')
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self._max_entries = options.get('MAX_ENTRIES', 10000)
+        self._max_size = options.get('MAX_SIZE', 64 * 1024 * 1024)
+        super().__init__(params)
+        with _tiers_lock:
+            tier = _tiers.setdefault((location, self._remote_alias), _LocalTier())
+        self._local = tier.entries
+        self._lock = tier.lock
+        self._stats = tier.stats
+        self._tier = tier
+
+    @property
+    def remote(self):
+        return caches[self._remote_alias]
+
+    def stats(self):
+        """Hit/miss counters per tier plus current local usage"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(local_entries=len(self._local), local_size=self._tier.size)
+        return stats
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    # Local tier
+
+    def _local_get(self, key):
+        if key.endswith(self.REMOTE_ONLY):
+            return None, False
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                self._stats['local_misses'] += 1
+                return None, False
+            value, expires_at, size = item
+            if expires_at <= time.monotonic():
+                self._pop(key)
+                self._stats['local_misses'] += 1
+                return None, False
+            self._local.move_to_end(key)
+            self._stats['local_hits'] += 1
+        record_cache_lookup(hit=True)
+        return value, True
+
+    def _local_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        timeout = self._local_ttl(timeout)
+        if timeout <= 0 or key.endswith(self.REMOTE_ONLY):
+            self._local_delete(key)
+            return
+        try:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            self._local_delete(key)
+            return
+        if size > self._max_size:
+            self._local_delete(key)
+            return
+        with self._lock:
+            self._pop(key)
+            self._local[key] = (value, time.monotonic() + timeout, size)
+            self._tier.size += size
+            while len(self._local) > self._max_entries or self._tier.size > self._max_size:
+                self._pop(next(iter(self._local)))
+                self._stats['local_evictions'] += 1
+
+    def _local_delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        item = self._local.pop(key, None)
+        if item is not None:
+            self._tier.size -= item[2]
+
+    def _local_ttl(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self._local_timeout
+        return min(timeout, self._local_timeout)
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value, found = self._local_get(local_key)
+        if found:
+            return value
+        value = self.remote.get(key, self, version=version)
+        if value is self:
+            self._count('remote_misses')
+            return default
+        self._count('remote_hits')
+        self._local_set(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            value, hit = self._local_get(self.make_and_validate_key(key, version=version))
+            if hit:
+                found[key] = value
+            else:
+                missing.append(key)
+        if missing:
+            remote = self.remote.get_many(missing, version=version)
+            self._count('remote_hits', len(remote))
+            self._count('remote_misses', len(missing) - len(remote))
+            for key, value in remote.items():
+                self._local_set(self.make_and_validate_key(key, version=version), value)
+            found.update(remote)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.remote.set(key, value, timeout, version=version)
+        self._local_set(self.make_and_validate_key(key, version=version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.remote.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            self._local_set(self.make_and_validate_key(key, version=version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Only the remote tier can tell whether the key is taken
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.remote.add(key, value, timeout, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.remote.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.remote.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local_delete(self.make_and_validate_key(key, version=version))
+        self.remote.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        value, found = self._local_get(self.make_and_validate_key(key, version=version))
+        return found or self.remote.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.remote.incr(key, delta, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            self._tier.size = 0
+        self.remote.clear()
+
+
+def _timed(name):
+    method = getattr(DefaultClient, name)
+
+    def wrapper(self, *args, **kwargs):
+        with timed('cache'):
+            return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+_missing = object()
+
+
+class InstrumentedRedisClient(DefaultClient):
+    """django-redis client that reports call time and hits to instrumentation
+
+        'OPTIONS': {'CLIENT_CLASS': 'backends.cache.InstrumentedRedisClient'}
+    """
+
+    def get(self, key, default=None, version=None, client=None):
+        with timed('cache'):
+            value = super().get(key, default=_missing, version=version, client=client)
+        record_cache_lookup(hit=value is not _missing)
+        return default if value is _missing else value
+
+    def get_many(self, keys, version=None, client=None):
+        keys = list(keys)
+        with timed('cache'):
+            found = super().get_many(keys, version=version, client=client)
+        for key in keys:
+            record_cache_lookup(hit=key in found)
+        return found
+
+    # add() and set_many() go through set()
+    set = _timed('set')
+    delete = _timed('delete')
+    delete_many = _timed('delete_many')
+    touch = _timed('touch')
+    incr = _timed('incr')
+    has_key = _timed('has_key')
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.checks import Tags, register
+from django.core.checks.security import base, csrf
+
+# Subclasses in backends.middleware and the Django middleware they extend
+STOCK_MIDDLEWARE = {
+    'backends.middleware.SecurityMiddleware': 'django.middleware.security.SecurityMiddleware',
+    'backends.middleware.CsrfViewMiddleware': 'django.middleware.csrf.CsrfViewMiddleware',
+    'backends.middleware.XFrameOptionsMiddleware': 'django.middleware.clickjacking.XFrameOptionsMiddleware',
+}
+
+# Django's deploy checks that only run when MIDDLEWARE names the stock class
+MIDDLEWARE_CHECKS = [
+    base.check_security_middleware,
+    base.check_xframe_options_middleware,
+    base.check_sts,
+    base.check_sts_include_subdomains,
+    base.check_sts_preload,
+    base.check_content_type_nosniff,
+    base.check_ssl_redirect,
+    base.check_xframe_deny,
+    base.check_referrer_policy,
+    base.check_cross_origin_opener_policy,
+    csrf.check_csrf_middleware,
+    csrf.check_csrf_cookie_secure,
+]
+
+
+@register(Tags.security, deploy=True)
+def check_middleware_subclasses(app_configs, **kwargs):
+    """Django's middleware security checks, counting our subclasses as the stock classes
+
+    Django looks for the stock class paths only, so on their own its checks
+    report security.W001-W003 and skip HSTS, SSL redirect, X-Frame-Options
+    and CSRF cookie settings. Those three ids are silenced in settings and
+    the checks run here instead.
+    """
+    from django.test.utils import override_settings
+
+    middleware = [STOCK_MIDDLEWARE.get(path, path) for path in settings.MIDDLEWARE]
+    with override_settings(MIDDLEWARE=middleware):
+        return [message for check in MIDDLEWARE_CHECKS for message in check(app_configs)]
@@ -0,0 +1,29 @@
+from django.db import connections
+
+
+def pool_stats():
+    """Connection pool counters of this process, per database alias
+
+    Aliases without a psycopg pool are reported as None. Besides the raw
+    psycopg_pool counters (since the pool opened) this adds:
+
+    checkouts: connections handed out
+    avg_wait_ms: mean time a checkout waited for a free connection
+    saturation: share of max_size currently checked out
+    """
+    stats = {}
+    for alias in connections:
+        pool = getattr(connections[alias], 'pool', None)
+        if pool is None:
+            stats[alias] = None
+            continue
+        raw = pool.get_stats()
+        in_use = raw.get('pool_size', 0) - raw.get('pool_available', 0)
+        queued = raw.get('requests_queued', 0)
+        stats[alias] = {
+            **raw,
+            'checkouts': raw.get('requests_num', 0),
+            'avg_wait_ms': round(raw.get('requests_wait_ms', 0) / queued, 3) if queued else 0,
+            'saturation': round(in_use / pool.max_size, 3),
+        }
+    return stats
@@ -0,0 +1,32 @@
+"""Environment-backed configuration checked on first use
+
+backends/settings.py reads variables with os.environ.get() so that
+importing the settings never fails: a worker that only drains the outbox
+must not need S3 credentials, nor a one-off command SMTP ones. Code that
+needs a setting calls require() where it first uses it, which names the
+missing variables instead of failing later with an obscure error.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+def load_dotenv(path):
+    """Load variables from path if it exists; the environment takes precedence
+
+    python-dotenv is only imported when there is a file, so containers that
+    set the environment directly skip it.
+    """
+    if os.path.exists(path):
+        from dotenv import load_dotenv
+
+        load_dotenv(path)
+
+
+def require(*names):
+    """Raise ImproperlyConfigured unless the settings names are all set"""
+    from django.conf import settings
+
+    missing = [name for name in names if not getattr(settings, name, None)]
+    if missing:
+        raise ImproperlyConfigured(f"Set {', '.join(missing)} in the environment or .env")
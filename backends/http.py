@@ -0,0 +1,193 @@
+import gzip
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import parse_etags
+from django.utils.module_loading import import_string
+
+from .middleware import InlineHooksMixin
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def get_config():
+    """Return the response ETag and compression settings with defaults filled in"""
+    config = {
+        'ETAGS': {},
+        'COMPRESS_MIN_SIZE': 860,
+        'COMPRESS_CONTENT_TYPES': ('application/json',),
+        'GZIP_LEVEL': 6,
+        'BROTLI': True,
+        'BROTLI_QUALITY': 4,
+    }
+    config.update(getattr(settings, 'HTTP_RESPONSES', {}))
+    return config
+
+
+def _encodings():
+    """Content encodings this process can produce, most preferred first"""
+    if brotli is not None and get_config()['BROTLI']:
+        return ('br', 'gzip')
+    return ('gzip',)
+
+
+def compress(encoding, body):
+    config = get_config()
+    if encoding == 'br':
+        return brotli.compress(body, quality=config['BROTLI_QUALITY'])
+    # mtime=0 keeps the output the same for the same body
+    return gzip.compress(body, compresslevel=config['GZIP_LEVEL'], mtime=0)
+
+
+def encode(body):
+    """Return body and its compressed variants worth sending, by content encoding
+
+    Bodies under COMPRESS_MIN_SIZE are not compressed; the result can be
+    stored and served later with encoded_response() without compressing again.
+    """
+    variants = {'identity': body}
+    if len(body) < get_config()['COMPRESS_MIN_SIZE']:
+        return variants
+    for encoding in _encodings():
+        compressed = compress(encoding, body)
+        if len(compressed) < len(body):
+            variants[encoding] = compressed
+    return variants
+
+
+def accepted_encoding(request, available):
+    """The best encoding in available that request's Accept-Encoding allows"""
+    accepted = {}
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        accepted[name.strip().lower()] = quality
+    for encoding in ('br', 'gzip'):
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return 'identity'
+
+
+def _weak(etag):
+    return etag.removeprefix('W/')
+
+
+def not_modified(request, etag):
+    """A 304 for a GET or HEAD whose If-None-Match matches etag, else None"""
+    if not etag or request.method not in ('GET', 'HEAD'):
+        return None
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if '*' not in etags and _weak(etag) not in {_weak(tag) for tag in etags}:
+        return None
+    response = HttpResponseNotModified()
+    response.headers['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def encoded_response(request, variants, etag=None, status=200, content_type='application/json'):
+    """HttpResponse with the variant of encode() that request accepts"""
+    encoding = accepted_encoding(request, variants)
+    response = HttpResponse(variants[encoding], status=status, content_type=content_type)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.headers['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+class ETagMiddleware:
+    """Answer If-None-Match for GETs of views with a cheap ETag, before they run
+
+    HTTP_RESPONSES['ETAGS'] maps URL names to functions that return the
+    ETag of the view's current response for a request, or None, without
+    building it: from a cache key or version counter, never by hashing
+    the body. A matching If-None-Match gets a 304 and the view does not
+    run; other 200 responses carry the ETag.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.etags = {name: import_string(path) for name, path in get_config()['ETAGS'].items()}
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def etag_function(self, request):
+        if not self.etags or request.method not in ('GET', 'HEAD'):
+            return None
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return None
+        return self.etags.get(match.url_name)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        etag_function = self.etag_function(request)
+        etag = etag_function(request) if etag_function else None
+        return not_modified(request, etag) or self.tag(self.get_response(request), etag)
+
+    async def __acall__(self, request):
+        etag_function = self.etag_function(request)
+        # ETag functions may load request.user, which can block
+        etag = await sync_to_async(etag_function)(request) if etag_function else None
+        return not_modified(request, etag) or self.tag(await self.get_response(request), etag)
+
+    def tag(self, response, etag):
+        if etag and response.status_code == 200 and not response.has_header('ETag'):
+            response.headers['ETag'] = etag
+        return response
+
+
+class CompressionMiddleware(InlineHooksMixin, MiddlewareMixin):
+    """gzip, or brotli when installed, for responses of COMPRESS_CONTENT_TYPES
+
+    Responses under COMPRESS_MIN_SIZE, streaming ones and ones that are
+    already encoded (see encoded_response()) pass through untouched.
+    Only JSON is compressed by default: API responses here reflect no
+    secrets next to request input, which keeps BREACH out of reach.
+    """
+
+    def process_response(self, request, response):
+        config = get_config()
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or content_type not in config['COMPRESS_CONTENT_TYPES']
+            or len(response.content) < config['COMPRESS_MIN_SIZE']
+        ):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = accepted_encoding(request, _encodings())
+        if encoding == 'identity':
+            return response
+        compressed = compress(encoding, response.content)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Content-Length'] = str(len(compressed))
+        # The compressed body is a different representation of the same resource
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
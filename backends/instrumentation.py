@@ -0,0 +1,289 @@
+import bisect
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger('backends.requests')
+
+_timings = ContextVar('request_timings', default=None)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def get_config():
+    """Return the instrumentation settings with defaults filled in"""
+    config = {
+        'SERVER_TIMING': True,
+        'LOG_SAMPLE_RATE': 0.01,
+        'SLOW_REQUEST_MS': 1000,
+        'METRICS_TOKEN': None,
+    }
+    config.update(getattr(settings, 'INSTRUMENTATION', {}))
+    return config
+
+
+class _Metric:
+    def __init__(self, name, help_text, kind):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def _labels(self, labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            samples = dict(self.samples)
+        for labels, value in sorted(samples.items()):
+            lines.extend(self._render_sample(labels, value))
+        return lines
+
+
+class Counter(_Metric):
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text, 'counter')
+
+    def inc(self, labels=(), value=1):
+        with self.lock:
+            self.samples[labels] = self.samples.get(labels, 0) + value
+
+    def _render_sample(self, labels, value):
+        return [f"{self.name}{self._labels(labels)} {value}"]
+
+
+class Histogram(_Metric):
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, 'histogram')
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        with self.lock:
+            sample = self.samples.get(labels)
+            if sample is None:
+                # Per-bucket counts, then sum and count
+                sample = self.samples[labels] = [0] * (len(self.buckets) + 2)
+            sample[bisect.bisect_left(self.buckets, value)] += 1
+            sample[-2] += value
+            sample[-1] += 1
+
+    def _render_sample(self, labels, sample):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), sample):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._labels(labels)} {sample[-2]}")
+        lines.append(f"{self.name}_count{self._labels(labels)} {sample[-1]}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', "Request latency by view")
+RESPONSES = Counter('http_responses_total', "Responses by view and status")
+COMPONENT_SECONDS = Histogram(
+    'http_request_component_seconds', "Time one request spent in db, cache, ml, smtp or hash calls")
+COMPONENT_CALLS = Counter('http_request_component_calls_total', "Calls to db, cache, ml, smtp and hash by view")
+CACHE_LOOKUPS = Counter('cache_lookups_total', "Cache reads by view and result")
+BACKGROUND_SECONDS = Histogram(
+    'background_component_seconds', "Time in db, cache, ml, smtp or hash calls made outside requests")
+
+METRICS = [REQUEST_SECONDS, RESPONSES, COMPONENT_SECONDS, COMPONENT_CALLS, CACHE_LOOKUPS, BACKGROUND_SECONDS]
+
+
+class RequestTimings:
+    """Time and call counts per component for the request being served"""
+
+    def __init__(self):
+        self.components = {}  # name -> [calls, seconds]
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, component, seconds, calls=1):
+        entry = self.components.setdefault(component, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+
+
+def record(component, seconds, calls=1):
+    """Charge time to component in the current request, or to background metrics"""
+    timings = _timings.get()
+    if timings is None:
+        BACKGROUND_SECONDS.observe((('component', component),), seconds)
+    else:
+        timings.add(component, seconds, calls)
+
+
+def record_cache_lookup(hit):
+    timings = _timings.get()
+    if timings is not None:
+        if hit:
+            timings.cache_hits += 1
+        else:
+            timings.cache_misses += 1
+
+
+@contextmanager
+def timed(component):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(component, time.perf_counter() - start)
+
+
+def _time_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', time.perf_counter() - start)
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    # Installed on every connection rather than around each request:
+    # connections are per thread, and async views query from worker threads
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(_install_query_timer)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route or match._func_path
+
+
+class InstrumentationMiddleware:
+    """Per-view latency with a breakdown into db, cache, ml, smtp and hash time
+
+    Adds a Server-Timing header, feeds the histograms served at /metrics
+    and logs a sample of requests, plus every slow or failed one, as one
+    JSON line each. Code that calls other services reports its time with
+    timed() or record(); database queries are timed by a wrapper installed
+    on every connection.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_config()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        total = time.perf_counter() - start
+        self.report(request, response, timings, total)
+        return response
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        total = time.perf_counter() - start
+        self.report(request, response, timings, total)
+        return response
+
+    def report(self, request, response, timings, total):
+        view = _view_name(request)
+        REQUEST_SECONDS.observe((('view', view), ('method', request.method)), total)
+        RESPONSES.inc((('view', view), ('method', request.method), ('status', response.status_code)))
+        for component, (calls, seconds) in timings.components.items():
+            labels = (('view', view), ('component', component))
+            COMPONENT_SECONDS.observe(labels, seconds)
+            COMPONENT_CALLS.inc(labels, calls)
+        if timings.cache_hits:
+            CACHE_LOOKUPS.inc((('view', view), ('result', 'hit')), timings.cache_hits)
+        if timings.cache_misses:
+            CACHE_LOOKUPS.inc((('view', view), ('result', 'miss')), timings.cache_misses)
+
+        if self.config['SERVER_TIMING']:
+            entries = [
+                f'{component};dur={seconds * 1000:.1f};desc="{calls} calls"'
+                for component, (calls, seconds) in timings.components.items()
+            ]
+            entries.append(f"total;dur={total * 1000:.1f}")
+            response['Server-Timing'] = ', '.join(entries)
+
+        slow = total * 1000 >= self.config['SLOW_REQUEST_MS']
+        if slow or response.status_code >= 500 or random.random() < self.config['LOG_SAMPLE_RATE']:
+            logger.info(json.dumps({
+                "event": "request",
+                "view": view,
+                "method": request.method,
+                "status": response.status_code,
+                "ms": round(total * 1000, 1),
+                "slow": slow,
+                **{
+                    f"{component}_ms": round(seconds * 1000, 1)
+                    for component, (calls, seconds) in timings.components.items()
+                },
+                **{
+                    f"{component}_calls": calls
+                    for component, (calls, seconds) in timings.components.items()
+                },
+                "cache_hits": timings.cache_hits,
+                "cache_misses": timings.cache_misses,
+            }))
+
+
+def _may_read_metrics(request):
+    # Staff sessions, as for the search stats, or scrapers with METRICS_TOKEN;
+    # without a token set, nobody else
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    token = get_config()['METRICS_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+
+
+def metrics(request):
+    """Prometheus text exposition of this process's metrics"""
+    if not _may_read_metrics(request):
+        return HttpResponseForbidden()
+    from customer import singleflight
+
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.append("# HELP singleflight_events_total Search request coalescing counters")
+    lines.append("# TYPE singleflight_events_total counter")
+    for event, value in sorted(singleflight.stats().items()):
+        lines.append(f'singleflight_events_total{{event="{event}"}} {value}')
+    return HttpResponse("\n".join(lines) + "\n", content_type='text/plain; version=0.0.4')
@@ -0,0 +1,13 @@
+from django.core.mail.backends import smtp
+
+from .env import require
+
+
+class EmailBackend(smtp.EmailBackend):
+    """SMTP backend that checks its settings when it first connects"""
+
+    def open(self):
+        if self.connection is None:
+            # The outbox and newsletters send from EMAIL_HOST_USER
+            require('EMAIL_HOST', 'EMAIL_HOST_USER')
+        return super().open()
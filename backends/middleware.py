@@ -0,0 +1,107 @@
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.contrib.auth import aget_user
+from django.contrib.auth import middleware as auth
+from django.contrib.messages import middleware as messages
+from django.contrib.sessions import middleware as sessions
+from django.middleware import clickjacking, common, csrf, security
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """WhiteNoise that also runs natively in an async middleware chain
+
+    WhiteNoise is sync-only, which under ASGI would move every request
+    into a worker thread and back just to check for a static file.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class InlineHooksMixin:
+    """Run a MiddlewareMixin's non-blocking hooks on the event loop
+
+    Under ASGI, MiddlewareMixin calls every process_request and
+    process_response in a worker thread, two thread hops per middleware
+    per request. Hooks listed in inline_hooks never touch the database,
+    cache or files and are called directly; the others still hop.
+    """
+    inline_hooks = ('process_request', 'process_response')
+
+    async def __acall__(self, request):
+        response = None
+        if hasattr(self, 'process_request'):
+            response = await self._call_hook('process_request', request)
+        response = response or await self.get_response(request)
+        if hasattr(self, 'process_response'):
+            response = await self._call_hook('process_response', request, response)
+        return response
+
+    async def _call_hook(self, name, *args):
+        hook = getattr(self, name)
+        if name in self.inline_hooks:
+            return hook(*args)
+        return await sync_to_async(hook, thread_sensitive=True)(*args)
+
+
+class SecurityMiddleware(InlineHooksMixin, security.SecurityMiddleware):
+    pass
+
+
+class SessionMiddleware(InlineHooksMixin, sessions.SessionMiddleware):
+    # Saving the session writes to the cache and database
+    inline_hooks = ('process_request',)
+
+
+class CommonMiddleware(InlineHooksMixin, common.CommonMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(InlineHooksMixin, csrf.CsrfViewMiddleware):
+    # Only reads and sets the cookie, as long as CSRF_USE_SESSIONS is off
+    pass
+
+
+async def _auser(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = await aget_user(request)
+    return request._cached_user
+
+
+class AuthenticationMiddleware(InlineHooksMixin, auth.AuthenticationMiddleware):
+    # Sets up request.user lazily; the user is loaded on first access
+
+    def process_request(self, request):
+        super().process_request(request)
+        # request.user and request.auser() share one lookup, so a user loaded
+        # by an ETag function is not loaded again by an async view
+        request.auser = partial(_auser, request)
+
+
+class MessageMiddleware(InlineHooksMixin, messages.MessageMiddleware):
+    # Storing messages may load the session
+    inline_hooks = ('process_request',)
+
+
+class XFrameOptionsMiddleware(InlineHooksMixin, clickjacking.XFrameOptionsMiddleware):
+    pass
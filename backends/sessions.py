@@ -0,0 +1,67 @@
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+logger = logging.getLogger('django.contrib.sessions')
+
+# Session data key holding when the database copy of the session expires
+DB_EXPIRY_KEY = '_session_db_expiry'
+
+
+class SessionStore(CachedDBStore):
+    """Cache-first sessions that write to the database only when needed
+
+    Sessions are read from the cache and fall back to django_session, so
+    sessions created by the db engine keep working after switching. An
+    unchanged session only has its cache TTL extended; the database row is
+    rewritten when the data changed or when its expiry is less than
+    SESSION_DB_REFRESH_THRESHOLD seconds away. With
+    SESSION_SAVE_EVERY_REQUEST this turns a SELECT and UPDATE per request
+    into one cache read and one cache touch.
+    """
+
+    def _db_refresh_due(self):
+        db_expiry = self._get_session().get(DB_EXPIRY_KEY)
+        if db_expiry is None:
+            return True
+        return db_expiry - time.time() < settings.SESSION_DB_REFRESH_THRESHOLD
+
+    async def _adb_refresh_due(self):
+        db_expiry = (await self._aget_session()).get(DB_EXPIRY_KEY)
+        if db_expiry is None:
+            return True
+        return db_expiry - time.time() < settings.SESSION_DB_REFRESH_THRESHOLD
+
+    def _mark_db_expiry(self):
+        self._get_session()[DB_EXPIRY_KEY] = int(time.time()) + self.get_expiry_age()
+
+    async def _amark_db_expiry(self):
+        (await self._aget_session())[DB_EXPIRY_KEY] = int(time.time()) + await self.aget_expiry_age()
+
+    def save(self, must_create=False):
+        if must_create or self.modified or self.session_key is None or self._db_refresh_due():
+            self._mark_db_expiry()
+            return super().save(must_create)
+        # Unchanged session: extend the cache entry only; fall back to a full
+        # save if the cache lost it or cannot be reached
+        try:
+            touched = self._cache.touch(self.cache_key, self.get_expiry_age())
+        except Exception:
+            logger.exception("Error touching session in cache (%s)", self._cache)
+            touched = False
+        if not touched:
+            super().save()
+
+    async def asave(self, must_create=False):
+        if must_create or self.modified or self.session_key is None or await self._adb_refresh_due():
+            await self._amark_db_expiry()
+            return await super().asave(must_create)
+        try:
+            touched = await self._cache.atouch(await self.acache_key(), await self.aget_expiry_age())
+        except Exception:
+            logger.exception("Error touching session in cache (%s)", self._cache)
+            touched = False
+        if not touched:
+            await super().asave()
@@ -1,16 +1,22 @@
 from pathlib import Path
 import os
-from dotenv import load_dotenv
-load_dotenv()
+
+from . import env
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Variables only some processes use are read with os.environ.get and
+# checked where they are used (backends.env.require), so a missing one
+# fails the code that needs it instead of every process at startup
+env.load_dotenv(BASE_DIR / '.env')
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = os.environ['SECRET_KEY']
+# Django refuses an empty key when it is first used
+SECRET_KEY = os.environ.get('SECRET_KEY', '')
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -33,30 +39,58 @@ INSTALLED_APPS = [
 ]
 
 WSGI_APPLICATION = 'backends.wsgi.application'
+ASGI_APPLICATION = 'backends.asgi.application'
+
+# Serve login, registration, email verification, users/me and search with
+# async views; backends/asgi.py turns this on unless set to false
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'false').lower() == 'true'
 
 SESSION_SAVE_EVERY_REQUEST = True
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# Cache-first sessions; see backends.sessions. Run `manage.py warm_session_cache`
+# once after switching from the db engine.
+SESSION_ENGINE = 'backends.sessions'
+SESSION_CACHE_ALIAS = 'default'
+SESSION_DB_REFRESH_THRESHOLD = 15 * 60
 SESSION_COOKIE_AGE = 3600
 SESSION_COOKIE_SAMESITE = 'None'
 SESSION_COOKIE_SECURE = True
 
 
 MIDDLEWARE = [
+    # Outermost, so its latency covers the rest of the stack
+    'backends.instrumentation.InstrumentationMiddleware',
     "corsheaders.middleware.CorsMiddleware",
-    'whitenoise.middleware.WhiteNoiseMiddleware',
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Compresses what the rest of the stack returns
+    'backends.http.CompressionMiddleware',
+    # Django's middleware and WhiteNoise, with the hooks that never block
+    # run on the event loop under ASGI; see backends/middleware.py
+    'backends.middleware.WhiteNoiseMiddleware',
+    'backends.middleware.SecurityMiddleware',
+    # Before sessions and auth, which may read the database
+    'backends.replicas.ReadYourWritesMiddleware',
+    'backends.middleware.SessionMiddleware',
+    'backends.middleware.CommonMiddleware',
+    'backends.middleware.CsrfViewMiddleware',
+    'backends.middleware.AuthenticationMiddleware',
+    'backends.middleware.MessageMiddleware',
+    'backends.middleware.XFrameOptionsMiddleware',
+    # Innermost, so its 304s still pass through sessions, CORS and compression
+    'backends.http.ETagMiddleware',
 ]
 
+# Django only recognises its own class paths for these; backends.checks runs
+# the same checks with the backends.middleware subclasses in their place
+SILENCED_SYSTEM_CHECKS = ['security.W001', 'security.W002', 'security.W003']
+
 AUTHENTICATION_BACKENDS = [
+    # Serves request.user from a cached snapshot instead of users_user
+    "users.auth.CachedModelBackend",
+    # Kept so sessions created before the cached backend stay logged in
     "django.contrib.auth.backends.ModelBackend",
 ]
+USER_CACHE_ALIAS = 'default'
+USER_CACHE_TIMEOUT = 60 * 60
 
 CSRF_COOKIE_SECURE= True
 CSRF_COOKIE_SAMESITE = 'None'
@@ -92,6 +126,7 @@ INTERNAL_IPS = [
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
 if os.getenv("DB_NAME") and not DEBUG:  # use postgres if env variables are configured
+    DB_POOL = os.environ.get("DB_POOL", "true").lower() == "true"
     DATABASES = {
         "default": {
             "ENGINE": "django.db.backends.postgresql",
@@ -100,8 +135,27 @@ if os.getenv("DB_NAME") and not DEBUG:  # use postgres if env variables are conf
             "PASSWORD": os.environ["DB_PASSWORD"],
             "HOST": os.environ["DB_HOST"],
             "PORT": os.environ["DB_PORT"],  # 5432 by default
+            "OPTIONS": {
+                # Server-side cap on any single statement, in milliseconds
+                "options": f"-c statement_timeout={int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))}",
+                # psycopg 3 connection pool per process; pool counters at /api/db/stats/
+                "pool": {
+                    "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 2)),
+                    "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+                    "timeout": float(os.environ.get("DB_POOL_TIMEOUT", 10)),  # seconds to wait for a connection
+                    "max_idle": 300,
+                    "max_lifetime": 1800,
+                } if DB_POOL else False,
+            },
+            # Pooled connections are reused by the pool; otherwise keep one per thread
+            "CONN_MAX_AGE": 0 if DB_POOL else int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+            # Check a reused connection before handing it out
+            "CONN_HEALTH_CHECKS": True,
         }
     }
+    # Streaming replicas of the primary, e.g. DB_REPLICA_HOSTS=replica-1,replica-2
+    for i, host in enumerate(filter(None, os.environ.get("DB_REPLICA_HOSTS", "").split(","))):
+        DATABASES[f"replica_{i}"] = {**DATABASES["default"], "HOST": host.strip(), "TEST": {"MIRROR": "default"}}
 
 else:
     DATABASES = {
@@ -110,6 +164,20 @@ else:
             "NAME": BASE_DIR / "db.sqlite3",
         }
     }
+    # Local stand-in for a replica: a copy of db.sqlite3 that only changes
+    # when it is copied again (see README)
+    if os.getenv("DB_SQLITE_REPLICA"):
+        DATABASES["replica_0"] = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / os.environ["DB_SQLITE_REPLICA"],
+            "TEST": {"MIRROR": "default"},
+        }
+
+# Reads inside requests go to these aliases; writes and reads shortly after
+# a client's write go to default
+DATABASE_ROUTERS = ['backends.replicas.PrimaryReplicaRouter']
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith("replica_")]
+REPLICA_PIN_SECONDS = 5
 
 
 # Password validation
@@ -130,6 +198,37 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing; `manage.py calibrate_hasher` suggests cost parameters.
+# Hashes made with another hasher or other costs are upgraded on login.
+PASSWORD_HASHING = {
+    # Hasher for new and upgraded hashes: 'scrypt' or 'argon2' (needs argon2-cffi)
+    'ALGORITHM': os.environ.get('PASSWORD_HASHER', 'scrypt'),
+    'SCRYPT_WORK_FACTOR': 2 ** 14,
+    'SCRYPT_BLOCK_SIZE': 8,
+    'SCRYPT_PARALLELISM': 1,
+    'ARGON2_TIME_COST': 2,
+    'ARGON2_MEMORY_COST': 102400,  # KiB
+    'ARGON2_PARALLELISM': 8,
+    # Hashing runs in a process pool so it cannot starve request threads;
+    # 0 workers hashes inline
+    'POOL_WORKERS': int(os.environ.get('PASSWORD_HASHING_WORKERS', 2)),
+    'POOL_MAX_PENDING': 32,
+    'POOL_QUEUE_TIMEOUT': 2.0,  # seconds before answering 503
+}
+
+PASSWORD_HASHERS = [
+    {
+        'scrypt': 'users.hashers.TunedScryptPasswordHasher',
+        'argon2': 'users.hashers.TunedArgon2PasswordHasher',
+    }[PASSWORD_HASHING['ALGORITHM']],
+    # Still verify hashes made before the switch
+    'users.hashers.TunedScryptPasswordHasher',
+    'users.hashers.TunedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -156,18 +255,20 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL= "users.User"
 
-EMAIL_HOST = os.environ["EMAIL_HOST"]
-EMAIL_PORT = int(os.environ["EMAIL_PORT"])
+EMAIL_HOST = os.environ.get("EMAIL_HOST")
+EMAIL_PORT = int(os.environ.get("EMAIL_PORT", 587))
 EMAIL_USE_TLS = True
-EMAIL_HOST_USER = os.environ["EMAIL_HOST_USER"]
-EMAIL_HOST_PASSWORD = os.environ["EMAIL_HOST_PASSWORD"]
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER", "")
+EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD", "")
+# Django's SMTP backend, checking EMAIL_HOST and EMAIL_HOST_USER on connect
+EMAIL_BACKEND = 'backends.mail.EmailBackend'
 EMAIL_DEBUG = True
 
 
-AWS_ACCESS_KEY_ID = os.environ['AWS_ACCESS_KEY_ID']
-AWS_SECRET_ACCESS_KEY = os.environ['AWS_SECRET_ACCESS_KEY']
-AWS_STORAGE_BUCKET_NAME = os.environ['AWS_STORAGE_BUCKET_NAME']
+# Without keys boto3 falls back to its own credential chain (e.g. an IAM role)
+AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
+AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
+AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME', '')
 DEFAULT_FILE_STORAGE = "backends.storage.MediaStorage"
 AWS_S3_REGION_NAME= "us-east-1"
 
@@ -182,7 +283,8 @@ MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{AWS_LOCATION}/'
 # Explicitly configure storage backends
 STORAGES = {
     "default": {
-        "BACKEND": "api.storage.MediaStorage",
+        # Imported, with boto3, only when media storage is first used
+        "BACKEND": "backends.storage.MediaStorage",
     },
     "staticfiles": {
         "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
@@ -196,9 +298,40 @@ REST_FRAMEWORK = {
         'DEFAULT_AUTHENTICATION_CLASSES': [
             #'rest_framework.authentication.BasicAuthentication',  # enables simple command line authentication
             'rest_framework.authentication.SessionAuthentication'
-        ]
+        ],
+        # Reverse proxies in front of the app, each appending to X-Forwarded-For.
+        # Throttles take the client IP that many entries from its end; with 0
+        # they use REMOTE_ADDR, as the header is whatever the client sent
+        'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+        # Views pick their limits with throttle_scope; see backends/throttling.py
+        'DEFAULT_THROTTLE_CLASSES': [
+            'backends.throttling.UserThrottle',
+        ],
+        # "<throttle_scope>_<ip|email|user>": "<requests>/<sec|min|hour|day>"
+        'DEFAULT_THROTTLE_RATES': {
+            'api_user': '600/min',
+            'register_ip': '20/hour',
+            'login_ip': '60/min',
+            'login_email': '10/min',
+            'password_reset_ip': '20/hour',
+            'password_reset_email': '5/hour',
+            # Guesses at 6-digit one-time codes
+            'verify_email_ip': '10/hour',
+            'password_reset_confirm_ip': '10/hour',
+            'search_user': '120/min',
+            'search_batch_user': '20/min',
+        },
     }
 
+# Rate limiter state lives in this Redis cache; while it is unreachable the
+# limits are enforced per process
+THROTTLING = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'throttle',
+    'REDIS_RETRY_INTERVAL': 5,  # seconds on the local fallback after a Redis error
+    'LOCAL_MAX_KEYS': 100000,
+}
+
 CORS_ALLOW_HEADERS = [
     'X-CSRFToken',  # Add any other headers you need to allow
     'Content-Type',  # Include Content-Type header
@@ -234,12 +367,153 @@ CACHES = {
         "BACKEND": "django_redis.cache.RedisCache",
         "LOCATION": "redis://127.0.0.1:6379/1",
         "OPTIONS": {
-            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # DefaultClient plus call timing and hit/miss counts for instrumentation
+            "CLIENT_CLASS": "backends.cache.InstrumentedRedisClient",
         }
     },
     'localcache': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
     },
+    # In-process LRU in front of `default` for hot search results
+    'search': {
+        'BACKEND': 'backends.cache.TieredCache',
+        'OPTIONS': {
+            'REMOTE': 'default',
+            'LOCAL_TIMEOUT': 5,
+            'MAX_ENTRIES': 10000,
+            'MAX_SIZE': 64 * 1024 * 1024,
+        },
+    },
+}
+DJANGO_REDIS_IGNORE_EXCEPTIONS = True
+
+# Runs the tests with LocMemCache in place of Redis
+TEST_RUNNER = 'backends.testing.TestRunner'
+
+# ML backend used by customer.views.SearchAPI
+ML_BACKEND = {
+    'URI': os.environ.get('ML_BACKEND_URI'),
+    'POOL_SIZE': int(os.environ.get('ML_BACKEND_POOL_SIZE', 100)),  # max open connections per process
+    'CONNECT_TIMEOUT': float(os.environ.get('ML_BACKEND_CONNECT_TIMEOUT', 3)),
+    'READ_TIMEOUT': float(os.environ.get('ML_BACKEND_READ_TIMEOUT', 30)),
+    'KEEPALIVE_TIMEOUT': float(os.environ.get('ML_BACKEND_KEEPALIVE_TIMEOUT', 30)),
+    # Batch endpoint taking {"items": [{"user_id", "task"}]} and returning a list of outputs
+    'BATCH_PATH': os.environ.get('ML_BACKEND_BATCH_PATH'),
+    # Collect concurrent single misses into one batch call (needs BATCH_PATH)
+    'MICROBATCH': os.environ.get('ML_BACKEND_MICROBATCH', '') == 'true',
+    'MICROBATCH_MAX_SIZE': int(os.environ.get('ML_BACKEND_MICROBATCH_MAX_SIZE', 32)),
+    'MICROBATCH_MAX_WAIT': float(os.environ.get('ML_BACKEND_MICROBATCH_MAX_WAIT', 0.005)),
+    # Bulkhead: calls beyond this many in flight per process fail fast; batch
+    # fan-outs (without BATCH_PATH) queue for it instead
+    'MAX_CONCURRENT': int(os.environ.get('ML_BACKEND_MAX_CONCURRENT', 20)),
+    # Circuit breaker: open after N consecutive failures, probe again after the timeout
+    'BREAKER_FAILURE_THRESHOLD': 5,
+    'BREAKER_RECOVERY_TIMEOUT': 30,
+    'BREAKER_HALF_OPEN_CALLS': 1,
+    # Jittered retries of transient failures, capped by a per-process retry budget
+    'RETRY_ATTEMPTS': 2,
+    'RETRY_BACKOFF': 0.05,
+    'RETRY_MAX_BACKOFF': 1.0,
+    'RETRY_JITTER': 0.3,
+    'RETRY_BUDGET_RATIO': 0.1,
+    'RETRY_BUDGET_MIN_PER_SECOND': 1,
+}
+
+# Search result cache used by customer.search
+SEARCH_CACHE = {
+    # Entries are fresh until SOFT_TTL, then served stale while refreshed in the background
+    'SOFT_TTL': 60 * 60 * 24,
+    'HARD_TTL': 60 * 60 * 36,
+    # Upstream errors and timeouts are cached this long
+    'NEGATIVE_TTL': 30,
+    # Fraction by which TTLs are randomly shortened to spread expiries
+    'JITTER': 0.1,
+    'REFRESH_WORKERS': 4,
+    # Cross-process single-flight lock; should outlive one ML backend call
+    'LOCK_TIMEOUT': 35,
+    'LOCK_WAIT_TIMEOUT': 35,
+    'LOCK_POLL_INTERVAL': 0.05,
+    # Also look up entries cached under the keys used before normalization;
+    # can be turned off once HARD_TTL has passed since upgrading
+    'LEGACY_KEYS': True,
+}
+
+# Email outbox drained by `manage.py send_outbox`
+EMAIL_OUTBOX = {
+    'BATCH_SIZE': 50,  # emails claimed at a time, sent over one connection
+    'MAX_ATTEMPTS': 8,
+    'BACKOFF': 30,  # seconds before the first retry, doubled on each attempt
+    'MAX_BACKOFF': 60 * 60,
+    # Seconds a worker holds the emails it claimed; must cover sending a batch
+    'LEASE': 5 * 60,
+}
+
+# Newsletter campaigns sent by `manage.py send_newsletter`; see users/newsletter.py
+NEWSLETTER = {
+    'BATCH_SIZE': 100,  # messages per send_messages call
+    'CONNECTIONS': 4,  # persistent SMTP connections
+    # Messages per second over all connections, within the SMTP provider's quota; 0 for no limit
+    'RATE': float(os.environ.get('NEWSLETTER_RATE', 50)),
+    'CHUNK_SIZE': 2000,  # rows per server-side cursor fetch
+    # Seconds without a checkpoint after which a run is presumed dead and can be resumed
+    'LEASE': 5 * 60,
+}
+
+# Push notifications sent by `manage.py send_push`; see users/push.py
+PUSH = {
+    # Base URL of the FCM-style multicast API; requests go to <URI>/send
+    'URI': os.environ.get('PUSH_PROVIDER_URI'),
+    'API_KEY': os.environ.get('PUSH_API_KEY'),
+    'BATCH_SIZE': 500,  # tokens per provider request
+    'CHUNK_SIZE': 5000,  # tokens read from the database per query
+    'MAX_CONCURRENT': int(os.environ.get('PUSH_MAX_CONCURRENT', 16)),
+    'CONNECT_TIMEOUT': 3,
+    'READ_TIMEOUT': 30,
+    'RETRY_ATTEMPTS': 3,
+    'RETRY_BACKOFF': 0.5,
+}
+
+# Lifetime of email verification and password reset codes, in seconds
+OTP_TOKEN_TTL = 60 * 60 * 24
+
+# ETags and compression of API responses; see backends/http.py
+HTTP_RESPONSES = {
+    # URL name -> function returning the current ETag of a GET without running the view
+    'ETAGS': {
+        'user-me': 'users.auth.user_etag',
+    },
+    # Smaller bodies gain little and cost a compression call
+    'COMPRESS_MIN_SIZE': 860,
+    'COMPRESS_CONTENT_TYPES': ('application/json',),
+    'GZIP_LEVEL': 6,
+    # Preferred over gzip when the brotli package is installed and the client accepts it
+    'BROTLI': True,
+    'BROTLI_QUALITY': 4,
+}
+
+# Request instrumentation; histograms are served per process at /metrics
+INSTRUMENTATION = {
+    'SERVER_TIMING': True,
+    'LOG_SAMPLE_RATE': float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', 0.01)),
+    'SLOW_REQUEST_MS': 1000,  # slower requests are always logged
+    # Scrapers send "Authorization: Bearer <token>"; unset, only staff sessions may read /metrics
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'root': {'handlers': ['console'], 'level': 'WARNING'},
+    'loggers': {
+        'backends': {'level': 'INFO'},
+        'customer': {'level': os.environ.get('SEARCH_LOG_LEVEL', 'INFO')},
+        'users': {'level': 'INFO'},
+    },
 }
-DJANGO_REDIS_IGNORE_EXCEPTIONS = True
\ No newline at end of file
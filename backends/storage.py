@@ -1,5 +1,12 @@
 from storages.backends.s3boto3 import S3Boto3Storage
 
+from .env import require
+
+
 class MediaStorage(S3Boto3Storage):
     location = 'media'
-    file_overwrite = False 
\ No newline at end of file
+    file_overwrite = False
+
+    def __init__(self, **settings):
+        require('AWS_STORAGE_BUCKET_NAME')
+        super().__init__(**settings)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+def local_caches():
+    """CACHES with every Redis alias replaced by a LocMemCache of its own"""
+    return {
+        alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'test-{alias}'}
+        if 'redis' in config['BACKEND'].lower() else config
+        for alias, config in settings.CACHES.items()
+    }
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the suite against in-process caches, so it needs no Redis server
+
+    The rate limiter then counts in process (backends.throttling.LocalLimiter).
+    Tests of Redis-specific behaviour override CACHES themselves.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = override_settings(CACHES=local_caches())
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,195 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.throttling import SimpleRateThrottle
+
+# Sliding window counter: the previous fixed window's count is weighted by
+# how much of it still overlaps the sliding window. One round trip per check.
+#   KEYS[1] current window counter, KEYS[2] previous window counter
+#   ARGV[1] limit, ARGV[2] window (ms), ARGV[3] ms elapsed in current window
+# Returns 0 when the hit is allowed (and counted), else ms to wait.
+SLIDING_WINDOW_LUA = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local elapsed = tonumber(ARGV[3])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * (window - elapsed) / window + current + 1 <= limit then
+    redis.call('INCR', KEYS[1])
+    redis.call('PEXPIRE', KEYS[1], window * 2)
+    return 0
+end
+if current + 1 > limit or previous == 0 then
+    return math.max(1, math.ceil(window - elapsed))
+end
+return math.max(1, math.ceil(window - elapsed - (limit - 1 - current) * window / previous))
+"""
+
+
+def get_config():
+    """Return the throttling settings with defaults filled in"""
+    config = {
+        'CACHE_ALIAS': 'default',
+        'KEY_PREFIX': 'throttle',
+        'REDIS_RETRY_INTERVAL': 5,
+        'LOCAL_MAX_KEYS': 100000,
+    }
+    config.update(getattr(settings, 'THROTTLING', {}))
+    return config
+
+
+def sliding_window_wait(limit, window, elapsed, current, previous):
+    """Python twin of SLIDING_WINDOW_LUA's decision; 0 means allowed"""
+    if previous * (window - elapsed) / window + current + 1 <= limit:
+        return 0
+    if current + 1 > limit or previous == 0:
+        return max(1, math.ceil(window - elapsed))
+    return max(1, math.ceil(window - elapsed - (limit - 1 - current) * window / previous))
+
+
+class LocalLimiter:
+    """In-process sliding window counters, used while Redis is unreachable
+
+    Limits are then enforced per process rather than per deployment.
+    """
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()  # key -> [window start, current, previous]
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now):
+        start = now - now % window
+        with self._lock:
+            state = self._windows.pop(key, None)
+            if state is None:
+                state = [start, 0, 0]
+            elif state[0] != start:
+                state = [start, 0, state[1] if state[0] == start - window else 0]
+            wait = sliding_window_wait(limit, window, now - start, state[1], state[2])
+            if not wait:
+                state[1] += 1
+            self._windows[key] = state
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        return wait
+
+
+class RedisLimiter:
+    """Sliding window counters in Redis, falling back to LocalLimiter
+
+    After a Redis error the local limiter is used for REDIS_RETRY_INTERVAL
+    seconds before Redis is tried again, so an outage costs one failed
+    round trip per interval instead of one per request.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.local = LocalLimiter(config['LOCAL_MAX_KEYS'])
+        self._script = None
+        self._down_until = 0
+
+    def _get_script(self):
+        if self._script is None:
+            from django_redis import get_redis_connection
+
+            # Raises NotImplementedError when the alias is not a Redis cache
+            self._script = get_redis_connection(self.config['CACHE_ALIAS']).register_script(SLIDING_WINDOW_LUA)
+        return self._script
+
+    def hit(self, key, limit, window):
+        """Count a hit on key; return 0 if allowed, else milliseconds to wait"""
+        now = int(time.time() * 1000)
+        if now >= self._down_until:
+            from redis.exceptions import RedisError
+
+            start = now - now % window
+            try:
+                return self._get_script()(
+                    keys=[f"{key}:{start}", f"{key}:{start - window}"],
+                    args=[limit, window, now - start],
+                )
+            except NotImplementedError:
+                self._down_until = float('inf')
+            except RedisError:
+                self._down_until = now + self.config['REDIS_RETRY_INTERVAL'] * 1000
+        return self.local.hit(key, limit, window, now)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RedisLimiter(get_config())
+        return _limiter
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """DRF throttle on a Redis sliding window, configured per view
+
+    The rate comes from DEFAULT_THROTTLE_RATES[f"{view.throttle_scope}_{kind}"];
+    scopes without a rate are not throttled. Subclasses set kind and
+    build the identity in get_ident_for().
+    """
+    kind = None
+    default_scope = 'api'
+
+    def __init__(self):
+        # The rate depends on the view, so it is resolved in allow_request()
+        self.wait_ms = 0
+
+    def get_ident_for(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        self.scope = f"{getattr(view, 'throttle_scope', self.default_scope)}_{self.kind}"
+        rate = self.THROTTLE_RATES.get(self.scope)
+        if rate is None:
+            return True
+        ident = self.get_ident_for(request)
+        if ident is None:
+            return True
+        self.num_requests, duration = self.parse_rate(rate)
+        key = f"{get_config()['KEY_PREFIX']}:{self.scope}:{ident}"
+        self.wait_ms = get_limiter().hit(key, self.num_requests, duration * 1000)
+        return not self.wait_ms
+
+    def wait(self):
+        return self.wait_ms / 1000
+
+
+class IPThrottle(SlidingWindowThrottle):
+    kind = 'ip'
+
+    def get_ident_for(self, request):
+        return self.get_ident(request)
+
+
+class UserThrottle(SlidingWindowThrottle):
+    """Per user when logged in, per IP otherwise"""
+    kind = 'user'
+
+    def get_ident_for(self, request):
+        if request.user and request.user.is_authenticated:
+            return f"u{request.user.pk}"
+        return self.get_ident(request)
+
+
+class EmailThrottle(SlidingWindowThrottle):
+    """Per target email address, whichever IP the requests come from"""
+    kind = 'email'
+
+    def get_ident_for(self, request):
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if not isinstance(email, str) or not email.strip():
+            return None
+        # Hashed so addresses are not stored in Redis keys
+        return hashlib.sha256(email.strip().lower().encode()).hexdigest()[:32]
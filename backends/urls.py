@@ -3,10 +3,15 @@ from django.urls import path,include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .instrumentation import metrics
+from .views import DatabasePoolStatsAPI
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('users.urls')),
     path('api/', include('customer.urls')),
+    path('api/db/stats/', DatabasePoolStatsAPI.as_view(), name='db-stats'),
+    path('metrics', metrics, name='metrics'),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 ]
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
@@ -0,0 +1,92 @@
+import math
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import permissions, status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, Throttled
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+from .db import pool_stats
+from .throttling import UserThrottle
+
+
+class DatabasePoolStatsAPI(APIView):
+    """Database connection pool counters of this worker process"""
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(pool_stats())
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """Base for async JSON views that behave like their APIView versions
+
+    Before the handler runs, the session user is loaded (session_auth),
+    CSRF is enforced for it as by SessionAuthentication, login_required
+    is checked and throttle_classes run with the view's throttle_scope.
+    The body is parsed by the first of parser_classes that accepts its
+    Content-Type (415 if none does) and handlers read it from
+    request.data, then return JsonResponse. APIExceptions raised on the
+    way, by the handler too, get the JSON error response DRF would send.
+    """
+    session_auth = True
+    login_required = False
+    throttle_classes = [UserThrottle]
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method.lower() not in self.http_method_names or not hasattr(self, request.method.lower()):
+            return await super().dispatch(request, *args, **kwargs)
+        try:
+            await self.initial(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as e:
+            return self.handle_exception(e)
+
+    async def initial(self, request):
+        if self.session_auth:
+            request.user = await request.auser()
+            if request.user.is_authenticated:
+                SessionAuthentication().enforce_csrf(request)
+        else:
+            request.user = AnonymousUser()
+        if self.login_required and not request.user.is_authenticated:
+            raise NotAuthenticated()
+
+        request.data = Request(request, parsers=[parser() for parser in self.parser_classes]).data
+
+        # Throttles talk to Redis synchronously; check them all in one hop
+        wait = await sync_to_async(self.throttle_wait)(request)
+        if wait is not None:
+            raise Throttled(wait)
+
+    def handle_exception(self, exc):
+        """The response of DRF's exception_handler, as a JsonResponse"""
+        if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+            # Session auth has no WWW-Authenticate challenge, so APIView sends 403
+            exc.status_code = status.HTTP_403_FORBIDDEN
+        headers = {}
+        if getattr(exc, 'auth_header', None):
+            headers['WWW-Authenticate'] = exc.auth_header
+        if getattr(exc, 'wait', None):
+            headers['Retry-After'] = str(math.ceil(exc.wait))
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+        return JsonResponse(data, status=exc.status_code, headers=headers, safe=False)
+
+    def throttle_wait(self, request):
+        """Seconds until the longest failing throttle allows the request, or None"""
+        waits = []
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, self):
+                waits.append(throttle.wait())
+        return max(waits) if waits else None
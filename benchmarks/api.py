@@ -0,0 +1,287 @@
+"""Throughput and latency of the API endpoints, stored as JSON per commit
+
+    python -m benchmarks.api run --requests 200 --output bench-results/$(git rev-parse --short HEAD).json
+    python -m benchmarks.api run --scenarios login users_me search_hit
+    python -m benchmarks.api compare bench-results/old.json bench-results/new.json
+
+Requests go through the full middleware stack with the Django test client.
+External services are local stand-ins (see benchmarks/settings.py): SQLite,
+fakeredis, the locmem email backend and the stub ML server, whose latency
+is set with --ml-latency-ms. Data each scenario needs (users, codes,
+sessions) is prepared before its timer starts. Requests run one at a time,
+so throughput is 1 / mean latency of a single worker.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from . import _django
+
+PASSWORD = 'Bench-password-123'
+
+
+def _email():
+    return f"{uuid.uuid4().hex[:16]}@bench.example.com"
+
+
+def _user(verified=True, password=PASSWORD):
+    from django.contrib.auth import get_user_model
+    return get_user_model().objects.create_user(_email(), password, email_verified=verified)
+
+
+def _post(client, url, data, expected):
+    response = client.post(url, data, content_type='application/json')
+    assert response.status_code == expected, (url, response.status_code, response.content[:200])
+
+
+def _get(client, url, expected=200, **extra):
+    response = client.get(url, **extra)
+    assert response.status_code == expected, (url, response.status_code, response.content[:200])
+
+
+# Each scenario takes the request count and returns that many zero-argument
+# callables, each making one request; everything else happens untimed.
+
+def register(n):
+    from django.test import Client
+    client = Client()
+    return [
+        lambda email=_email(): _post(client, '/api/auth/register/', {
+            "first_name": "Bench", "last_name": "User", "email": email,
+            "phone_number": "+10000000000", "password": PASSWORD, "confirm_password": PASSWORD,
+        }, 201)
+        for _ in range(n)
+    ]
+
+
+def verify_email(n):
+    from django.test import Client
+    from users.models import OneTimeToken
+    from users.tokens import issue_token
+    client = Client()
+    codes = [issue_token(_user(verified=False, password=None), OneTimeToken.VERIFY_EMAIL) for _ in range(n)]
+    return [lambda code=code: _post(client, '/api/auth/verify-email/', {"token": code}, 200) for code in codes]
+
+
+def login(n):
+    from django.test import Client
+    client = Client()
+    user = _user()
+    return [lambda: _post(client, '/api/auth/login/', {"email": user.email, "password": PASSWORD}, 200)] * n
+
+
+def logout(n):
+    from django.test import Client
+    user = _user()
+    clients = []
+    for _ in range(n):
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+    return [lambda client=client: _post(client, '/api/auth/logout/', {}, 200) for client in clients]
+
+
+def users_me(n):
+    from django.test import Client
+    client = Client()
+    client.force_login(_user())
+    return [lambda: _get(client, '/api/auth/users/me/')] * n
+
+
+def users_me_not_modified(n):
+    from django.test import Client
+    client = Client()
+    client.force_login(_user())
+    etag = client.get('/api/auth/users/me/').headers['ETag']
+    return [lambda: _get(client, '/api/auth/users/me/', 304, HTTP_IF_NONE_MATCH=etag)] * n
+
+
+def password_reset_request(n):
+    from django.test import Client
+    client = Client()
+    emails = [_user().email for _ in range(n)]
+    return [
+        lambda email=email: _post(client, '/api/auth/password/reset-request/', {"email": email}, 200)
+        for email in emails
+    ]
+
+
+def password_reset_confirm(n):
+    from django.test import Client
+    from users.models import OneTimeToken
+    from users.tokens import issue_token
+    client = Client()
+    codes = [issue_token(_user(password=None), OneTimeToken.PASSWORD_RESET) for _ in range(n)]
+    return [
+        lambda code=code: _post(client, '/api/auth/password/reset-confirm/', {
+            "token": code, "new_password": PASSWORD, "confirm_password": PASSWORD,
+        }, 200)
+        for code in codes
+    ]
+
+
+def search_miss(n):
+    from django.test import Client
+    client = Client()
+    return [
+        lambda text=f"benchmark task {uuid.uuid4().hex}": _post(client, '/api/search/', {"input_text": text}, 201)
+        for _ in range(n)
+    ]
+
+
+def search_hit(n):
+    from django.test import Client
+    client = Client()
+    text = f"benchmark task {uuid.uuid4().hex}"
+    _post(client, '/api/search/', {"input_text": text}, 201)
+    return [lambda: _post(client, '/api/search/', {"input_text": text}, 200)] * n
+
+
+def search_not_modified(n):
+    from django.test import Client
+    client = Client()
+    url = f"/api/search/?input_text=benchmark+task+{uuid.uuid4().hex}"
+    etag = client.get(url).headers['ETag']
+    return [lambda: _get(client, url, 304, HTTP_IF_NONE_MATCH=etag)] * n
+
+
+SCENARIOS = {
+    'register': register,
+    'verify_email': verify_email,
+    'login': login,
+    'logout': logout,
+    'users_me': users_me,
+    'users_me_not_modified': users_me_not_modified,
+    'password_reset_request': password_reset_request,
+    'password_reset_confirm': password_reset_confirm,
+    'search_miss': search_miss,
+    'search_hit': search_hit,
+    'search_not_modified': search_not_modified,
+}
+
+
+def measure(requests):
+    samples = []
+    for request in requests:
+        start = time.perf_counter()
+        request()
+        samples.append(time.perf_counter() - start)
+    return {
+        "requests": len(samples),
+        "requests_per_second": round(len(samples) / sum(samples), 1),
+        **_django.percentiles(samples),
+    }
+
+
+def start_stub(latency_ms):
+    from . import stub_ml_server
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(stub_ml_server.start(port, latency_ms))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(args):
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    os.environ['BENCH_DB'] = args.db
+    os.environ['ML_BACKEND_URI'] = start_stub(args.ml_latency_ms)
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+    from users import hashing
+    call_command('migrate', verbosity=0)
+    setup_test_environment()
+    # Start the hashing workers so the first timed login does not pay for it
+    hashing.make_password(PASSWORD)
+
+    results = {
+        "meta": {
+            "commit": _commit(),
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "cache": settings.REDIS,
+            "requests": args.requests,
+            "ml_latency_ms": args.ml_latency_ms,
+        },
+        "scenarios": {},
+    }
+    for name in args.scenarios:
+        result = measure(SCENARIOS[name](args.requests))
+        results["scenarios"][name] = result
+        print(json.dumps({"scenario": name, **result}), file=sys.stderr)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+def compare(args):
+    """Print per-scenario changes; exit 1 if any p99 grew by more than --threshold"""
+    with open(args.base) as f:
+        base = json.load(f)["scenarios"]
+    with open(args.new) as f:
+        new = json.load(f)["scenarios"]
+    regressed = False
+    for name in sorted(base.keys() & new.keys()):
+        old, cur = base[name], new[name]
+        change = (cur["p99_ms"] - old["p99_ms"]) / old["p99_ms"] if old["p99_ms"] else 0
+        flag = change > args.threshold
+        regressed |= flag
+        print(
+            f"{name:24} p50 {old['p50_ms']:9.2f} -> {cur['p50_ms']:9.2f} ms   "
+            f"p99 {old['p99_ms']:9.2f} -> {cur['p99_ms']:9.2f} ms ({change:+.0%})   "
+            f"{old['requests_per_second']:8.1f} -> {cur['requests_per_second']:8.1f} req/s"
+            + ("   REGRESSION" if flag else "")
+        )
+    sys.exit(1 if regressed else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+    run_parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    run_parser.add_argument('--ml-latency-ms', type=float, default=20)
+    run_parser.add_argument('--output', help="JSON file to write; printed when omitted")
+    run_parser.add_argument('--db', default='/tmp/api_bench.sqlite3')
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help="Allowed p99 growth, e.g. 0.2 for 20%%")
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
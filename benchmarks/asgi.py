@@ -0,0 +1,189 @@
+"""Many concurrent slow clients against the WSGI and the ASGI deployment
+
+    python -m benchmarks.asgi --clients 200 --client-delay-ms 200
+    python -m benchmarks.asgi --scenarios search --ml-latency-ms 500 --threads 16
+
+Each profile runs a real server with one worker process, started as in
+README "ASGI Deployment": gunicorn with gthread workers (--threads) for
+WSGI, and gunicorn with uvicorn workers, which serve the async views, for
+ASGI. Every client trickles its request out over --client-delay-ms, like
+a phone on a bad network, then waits for the response. Scenarios:
+users_me (session and cache only), login (waits for the hashing pool)
+and search (cache misses, each waiting --ml-latency-ms on the stub ML
+server). A WSGI thread is held while a request waits on hashing or the
+ML backend; the ASGI worker keeps serving other requests meanwhile.
+External services are the stand-ins of benchmarks/settings.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from . import _django
+from .api import start_stub
+
+PASSWORD = 'Bench-password-123'
+
+SCENARIOS = ['users_me', 'login', 'search']
+
+PROFILES = {
+    'wsgi': lambda threads: [
+        'backends.wsgi:application', '--worker-class', 'gthread', '--threads', str(threads)],
+    'asgi': lambda threads: [
+        'backends.asgi:application', '--worker-class', 'uvicorn_worker.UvicornWorker'],
+}
+
+
+def prepare(db):
+    """Migrate a fresh database; return a user's email and a session for them"""
+    if os.path.exists(db):
+        os.remove(db)
+    os.environ['BENCH_DB'] = db
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.test import Client
+    call_command('migrate', verbosity=0)
+    user = get_user_model().objects.create_user('bench@example.com', PASSWORD, email_verified=True)
+    client = Client()
+    # Saved to the database too, so the server process finds it
+    client.force_login(user)
+    return user.email, client.cookies[settings.SESSION_COOKIE_NAME].value
+
+
+def build_request(scenario, port, email, session):
+    if scenario == 'users_me':
+        head = (
+            f"GET /api/auth/users/me/ HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+            f"Cookie: sessionid={session}\r\nConnection: close\r\n\r\n"
+        )
+        return head.encode()
+    if scenario == 'login':
+        url, data = '/api/auth/login/', {"email": email, "password": PASSWORD}
+    else:
+        url, data = '/api/search/', {"input_text": f"benchmark task {uuid.uuid4().hex}"}
+    body = json.dumps(data).encode()
+    head = (
+        f"POST {url} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+    )
+    return head.encode() + body
+
+
+async def slow_request(port, payload, delay, pieces=10):
+    """Send payload in pieces spread over delay seconds; return the status"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        size = -(-len(payload) // pieces)
+        for offset in range(0, len(payload), size):
+            writer.write(payload[offset:offset + size])
+            await writer.drain()
+            await asyncio.sleep(delay / pieces)
+        response = await reader.read()
+        return int(response.split(b' ', 2)[1])
+    finally:
+        writer.close()
+
+
+async def load(port, build, clients, rounds, delay):
+    samples = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        for _ in range(rounds):
+            start = time.perf_counter()
+            try:
+                ok = await slow_request(port, build(), delay) in (200, 201)
+            except (OSError, ValueError, IndexError):
+                ok = False
+            if ok:
+                samples.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return samples, errors, time.perf_counter() - start
+
+
+def wait_for(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def run(profile, scenarios, args, email, session):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, ASYNC_VIEWS='true' if profile == 'asgi' else 'false')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', *PROFILES[profile](args.threads), '--workers', '1',
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        env=env,
+    )
+    results = []
+    try:
+        wait_for(port, process)
+        for scenario in scenarios:
+            build = lambda: build_request(scenario, port, email, session)
+            # Warm up: the first requests load the session and start the hashing pool
+            asyncio.run(load(port, build, 1, 2, 0))
+            samples, errors, elapsed = asyncio.run(
+                load(port, build, args.clients, args.rounds, args.client_delay_ms / 1000))
+            results.append({
+                "profile": profile,
+                "scenario": scenario,
+                "clients": args.clients,
+                "client_delay_ms": args.client_delay_ms,
+                "threads": args.threads if profile == 'wsgi' else None,
+                "requests": len(samples),
+                "errors": errors,
+                "requests_per_second": round(len(samples) / elapsed, 1),
+                **(_django.percentiles(samples) if samples else {}),
+            })
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--clients', type=int, default=200, help="Concurrent connections")
+    parser.add_argument('--rounds', type=int, default=3, help="Requests per client")
+    parser.add_argument('--client-delay-ms', type=float, default=200, help="Time each client takes to send its request")
+    parser.add_argument('--ml-latency-ms', type=float, default=200)
+    parser.add_argument('--threads', type=int, default=8, help="Threads of the WSGI worker")
+    parser.add_argument('--profiles', nargs='+', choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument('--db', default='/tmp/asgi_bench.sqlite3')
+    args = parser.parse_args()
+
+    os.environ['ML_BACKEND_URI'] = start_stub(args.ml_latency_ms)
+    # Let every client's call through the ML bulkhead; its limit is not under test
+    os.environ['ML_BACKEND_MAX_CONCURRENT'] = str(args.clients)
+    email, session = prepare(args.db)
+    for profile in args.profiles:
+        for result in run(profile, args.scenarios, args, email, session):
+            print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
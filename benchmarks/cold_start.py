@@ -0,0 +1,100 @@
+"""Time from starting a server to its first served request
+
+    python -m benchmarks.cold_start --runs 10
+    python -m benchmarks.cold_start --profiles wsgi --runs 20
+
+Starts the deployment of benchmarks.asgi (gunicorn with one gthread or
+uvicorn worker) again and again, sends an authenticated GET users/me as
+soon as the port accepts connections and records when its 200 arrives:
+the time a new worker, e.g. on a scale-up, keeps its first user waiting.
+Only SECRET_KEY and ML_BACKEND_URI are set; no SMTP or S3 variables.
+Run manage.py importtime to see where the import part of it goes.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from .asgi import PROFILES, prepare
+
+# Variables the server must start without
+UNSET = ('EMAIL_HOST', 'EMAIL_HOST_USER', 'EMAIL_HOST_PASSWORD', 'EMAIL_PORT',
+         'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_STORAGE_BUCKET_NAME')
+
+
+def first_response(port, session, process, timeout):
+    """Poll until users/me answers; return its status"""
+    request = (
+        f"GET /api/auth/users/me/ HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+        f"Cookie: sessionid={session}\r\nConnection: close\r\n\r\n"
+    ).encode()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+                sock.sendall(request)
+                response = sock.makefile('rb').readline()
+        except OSError:
+            time.sleep(0.005)
+            continue
+        if response:
+            return int(response.split(b' ', 2)[1])
+    raise RuntimeError("server did not answer")
+
+
+def start_once(profile, env, session, timeout):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', *PROFILES[profile](1), '--workers', '1',
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        env=env,
+    )
+    try:
+        status = first_response(port, session, process, timeout)
+        return time.perf_counter() - start, status
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10, help="Server starts per profile")
+    parser.add_argument('--profiles', nargs='+', choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--db', default='/tmp/cold_start_bench.sqlite3')
+    args = parser.parse_args()
+
+    for name in UNSET:
+        os.environ.pop(name, None)
+    # Nothing calls it; search is not under test
+    os.environ.setdefault('ML_BACKEND_URI', 'http://127.0.0.1:9')
+    _, session = prepare(args.db)
+    for profile in args.profiles:
+        env = dict(os.environ, ASYNC_VIEWS='true' if profile == 'asgi' else 'false')
+        samples = []
+        for _ in range(args.runs):
+            elapsed, status = start_once(profile, env, session, args.timeout)
+            if status != 200:
+                raise RuntimeError(f"first request answered {status}")
+            samples.append(elapsed)
+        print(json.dumps({
+            "profile": profile,
+            "runs": args.runs,
+            "median_ms": round(statistics.median(samples) * 1000, 1),
+            "min_ms": round(min(samples) * 1000, 1),
+            "max_ms": round(max(samples) * 1000, 1),
+        }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Compare the sync and async classify-task paths against the local stub
+
+    python -m benchmarks.ml_client --requests 2000 --concurrency 200
+
+The sync path is measured the way a WSGI deployment runs it: one blocking
+call per worker thread, each opening a fresh connection as SearchAPI did
+before the shared session. The async path keeps every call in flight on a
+single event loop over the pooled aiohttp session.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+
+from . import stub_ml_server
+
+
+def summarize(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return {
+        "path": name,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(p99 * 1000, 2),
+    }
+
+
+def run_sync(uri, total, workers, pooled):
+    from customer.ml_client import classify_task
+
+    def call(i):
+        start = time.perf_counter()
+        if pooled:
+            classify_task(i, f"task {i}")
+        else:
+            requests.post(
+                url=f"{uri}/classify-task",
+                headers={'Content-Type': 'application/json'},
+                data=json.dumps({"user_id": str(i), "task": f"task {i}"}),
+            ).json()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(call, range(total)))
+    return latencies, time.perf_counter() - start
+
+
+async def run_async(total, concurrency):
+    from customer.ml_client import aclassify_task, close_async_session
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await aclassify_task(i, f"task {i}")
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(call(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    await close_async_session()
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--sync-workers', type=int, default=8, help='WSGI worker threads to emulate')
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    uri = f"http://127.0.0.1:{args.port}"
+    settings.configure(ML_BACKEND={'URI': uri, 'POOL_SIZE': args.concurrency})
+
+    loop = asyncio.new_event_loop()
+    runner = loop.run_until_complete(stub_ml_server.start(args.port, args.latency_ms))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    results = [
+        summarize("sync (new connection per call)", *run_sync(uri, args.requests, args.sync_workers, pooled=False)),
+        summarize("sync (pooled session)", *run_sync(uri, args.requests, args.sync_workers, pooled=True)),
+        summarize("async (pooled aiohttp)", *asyncio.run(run_async(args.requests, args.concurrency))),
+    ]
+    for result in results:
+        print(json.dumps(result))
+
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Newsletter campaign throughput against a local SMTP server
+
+    python -m benchmarks.newsletter --users 200000 --connections 4 --latency-ms 20
+
+Fills a throwaway SQLite database with users, half of them opted in,
+starts benchmarks.stub_smtp_server in its own process and sends one
+campaign with users.newsletter at no rate limit. For comparison, the
+first --naive messages are also sent the naive way, one connection per
+message. Reports messages per second, peak RSS and the peak traced
+Python allocations during the send.
+"""
+import argparse
+import json
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from . import _django
+
+
+def populate(count):
+    from django.db import connection, transaction
+    from django.utils import timezone
+
+    now = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO users_user (password, is_superuser, first_name, last_name, is_staff, is_active,"
+            " date_joined, email, is_newsletter_interested, email_verified)"
+            " VALUES ('!', 0, %s, 'Bench', 0, 1, %s, %s, %s, 1)",
+            ((f"User{i}", now, f"user{i}@example.com", i % 2 == 0) for i in range(count)),
+        )
+
+
+def start_stub(latency_ms, connect_latency_ms):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.stub_smtp_server', '--port', str(port), '--latency-ms', str(latency_ms),
+        '--connect-latency-ms', str(connect_latency_ms),
+    ], stdout=subprocess.PIPE, text=True)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("stub SMTP server did not start")
+
+
+def stop_stub(process):
+    process.send_signal(signal.SIGINT)
+    return process.communicate(timeout=10)[0].strip()
+
+
+def naive(count):
+    from django.core.mail import send_mail
+    from users import newsletter
+
+    start = time.perf_counter()
+    for _, email, first_name, _ in newsletter.audience()[:count]:
+        send_mail("Benchmark", f"Hello {first_name}", None, [email])
+    return count / (time.perf_counter() - start)
+
+
+def max_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--latency-ms', type=float, default=20, help="Stub server time per message")
+    parser.add_argument('--connect-latency-ms', type=float, default=100, help="Stub server time per connection")
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--naive', type=int, default=200, help="Messages sent one connection each")
+    parser.add_argument('--db', default='/tmp/newsletter_bench.sqlite3')
+    args = parser.parse_args()
+
+    stub, port = start_stub(args.latency_ms, args.connect_latency_ms)
+    try:
+        _django.setup(
+            args.db,
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=port,
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_PASSWORD='',
+        )
+        from users import newsletter
+        from users.models import NewsletterCampaign
+
+        populate(args.users)
+        naive_rate = naive(args.naive) if args.naive else None
+
+        campaign = NewsletterCampaign.objects.create(subject="Benchmark", body="Hello {{ first_name }},\n\nNews.\n")
+        rss_before = max_rss_mb()
+        tracemalloc.start()
+        start = time.perf_counter()
+        campaign = newsletter.send_campaign(
+            campaign, RATE=0, BATCH_SIZE=args.batch_size, CONNECTIONS=args.connections,
+        )
+        elapsed = time.perf_counter() - start
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        received = stop_stub(stub)
+    print(json.dumps({
+        "recipients": campaign.sent + campaign.failed,
+        "sent": campaign.sent,
+        "elapsed": round(elapsed, 2),
+        "messages_per_second": round(campaign.sent / elapsed, 1),
+        "naive_messages_per_second": round(naive_rate, 1) if naive_rate else None,
+        "batch_size": args.batch_size,
+        "connections": args.connections,
+        "latency_ms": args.latency_ms,
+        "connect_latency_ms": args.connect_latency_ms,
+        "stub": received,
+        "max_rss_before_mb": rss_before,
+        "max_rss_after_mb": max_rss_mb(),
+        "traced_peak_mb": round(traced_peak / 1024 ** 2, 1),
+    }))
+
+
+if __name__ == '__main__':
+    main()
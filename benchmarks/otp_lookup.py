@@ -0,0 +1,88 @@
+"""OTP lookup cost with many users
+
+    python -m benchmarks.otp_lookup --users 1000000 --lookups 200
+
+Compares the indexed OneTimeToken lookup with the query verify-email used
+to run: an equality filter on an unindexed users_user column. The old
+column no longer exists, so the same codes are written to phone_number,
+which has the same shape (short, nullable, unindexed).
+"""
+import argparse
+import json
+import random
+import time
+from datetime import timedelta
+
+from . import _django
+
+
+def populate(count):
+    from django.db import connection, transaction
+    from django.utils import timezone
+    from users.tokens import hash_token
+
+    now = timezone.now()
+    expires_at = now + timedelta(days=1)
+    codes = random.sample(range(10 ** 6), count) if count <= 10 ** 6 else [i % 10 ** 6 for i in range(count)]
+    codes = [f"{code:06d}" for code in codes]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO users_user (password, is_superuser, first_name, last_name, is_staff, is_active,"
+            " date_joined, email, is_newsletter_interested, email_verified, phone_number)"
+            " VALUES ('!', 0, '', '', 0, 1, %s, %s, 0, 0, %s)",
+            ((now, f"user{i}@example.com", code) for i, code in enumerate(codes)),
+        )
+        cursor.executemany(
+            "INSERT INTO users_onetimetoken (user_id, purpose, token_hash, expires_at, created_at)"
+            " VALUES (%s, 'verify_email', %s, %s, %s)",
+            ((i + 1, hash_token('verify_email', code), expires_at, now) for i, code in enumerate(codes)),
+        )
+    return codes
+
+
+def measure(lookup, codes, lookups):
+    samples = []
+    for code in random.sample(codes, lookups):
+        start = time.perf_counter()
+        assert lookup(code) is not None
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--db', default='/tmp/otp_lookup_bench.sqlite3')
+    args = parser.parse_args()
+
+    _django.setup(args.db)
+    from django.contrib.auth import get_user_model
+    from django.utils import timezone
+    from users.models import OneTimeToken
+    from users.tokens import hash_token
+
+    User = get_user_model()
+    start = time.perf_counter()
+    codes = populate(args.users)
+    print(json.dumps({"populated_users": args.users, "seconds": round(time.perf_counter() - start, 1)}))
+
+    def unindexed(code):
+        return User.objects.filter(phone_number=code, email_verified=False).first()
+
+    def indexed(code):
+        return (
+            OneTimeToken.objects.select_related('user')
+            .filter(purpose=OneTimeToken.VERIFY_EMAIL, token_hash=hash_token(OneTimeToken.VERIFY_EMAIL, code),
+                    expires_at__gt=timezone.now())
+            .first()
+        )
+
+    for name, lookup in [("unindexed users_user scan", unindexed), ("hashed OneTimeToken index", indexed)]:
+        result = {"lookup": name, "users": args.users}
+        result.update(_django.percentiles(measure(lookup, codes, args.lookups)))
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Push fan-out throughput and memory with many device tokens
+
+    python -m benchmarks.push --users 1000000 --latency-ms 20 --concurrency 16
+
+Fills a throwaway SQLite database with users holding device tokens (a
+share of them invalid or failing once), starts benchmarks.stub_push_server in its own
+process and sends one notification to everyone with users.push. Reports
+sends per second and the dispatcher process's memory: peak RSS before
+and after the send and the peak traced Python allocations during it.
+"""
+import argparse
+import json
+import resource
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from . import _django
+
+
+def _token(i, invalid_every, flaky_every):
+    if invalid_every and i % invalid_every == 0:
+        kind = 'invalid'
+    elif flaky_every and i % flaky_every == 1:
+        kind = 'flaky'
+    else:
+        kind = 'device'
+    # About as long as real FCM registration tokens
+    return f"{kind}-{i:0>140}"
+
+
+def populate(count, invalid_ratio, flaky_ratio):
+    from django.db import connection, transaction
+    from django.utils import timezone
+
+    now = timezone.now()
+    invalid_every = int(1 / invalid_ratio) if invalid_ratio else 0
+    flaky_every = int(1 / flaky_ratio) if flaky_ratio else 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO users_user (password, is_superuser, first_name, last_name, is_staff, is_active,"
+            " date_joined, email, is_newsletter_interested, email_verified, device_token)"
+            " VALUES ('!', 0, '', '', 0, 1, %s, %s, 0, 1, %s)",
+            ((now, f"user{i}@example.com", _token(i, invalid_every, flaky_every)) for i in range(count)),
+        )
+
+
+def start_stub(latency_ms):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.stub_push_server', '--port', str(port), '--latency-ms', str(latency_ms),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("stub push server did not start")
+
+
+def max_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--invalid-ratio', type=float, default=0.01, help="Share of tokens the provider rejects")
+    parser.add_argument('--flaky-ratio', type=float, default=0.001, help="Share failing transiently once")
+    parser.add_argument('--latency-ms', type=float, default=20, help="Stub provider time per request")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--db', default='/tmp/push_bench.sqlite3')
+    args = parser.parse_args()
+
+    _django.setup(args.db, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    from users import push
+
+    start = time.perf_counter()
+    populate(args.users, args.invalid_ratio, args.flaky_ratio)
+    print(json.dumps({"populated_users": args.users, "seconds": round(time.perf_counter() - start, 1)}))
+
+    stub, uri = start_stub(args.latency_ms)
+    try:
+        rss_before = max_rss_mb()
+        tracemalloc.start()
+        report = push.dispatch(
+            "Benchmark", "Hello", data={"kind": "benchmark"},
+            URI=uri, BATCH_SIZE=args.batch_size, CHUNK_SIZE=args.chunk_size, MAX_CONCURRENT=args.concurrency,
+        )
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        stub.terminate()
+        stub.wait()
+    print(json.dumps({
+        **report.as_dict(),
+        "batch_size": args.batch_size,
+        "chunk_size": args.chunk_size,
+        "concurrency": args.concurrency,
+        "latency_ms": args.latency_ms,
+        "max_rss_before_mb": rss_before,
+        "max_rss_after_mb": max_rss_mb(),
+        "traced_peak_mb": round(traced_peak / 1024 ** 2, 1),
+    }))
+
+
+if __name__ == '__main__':
+    main()
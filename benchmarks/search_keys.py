@@ -0,0 +1,118 @@
+"""Replay a query log and report search cache hit rates per key strategy
+
+    python -m benchmarks.search_keys --log queries.txt
+    python -m benchmarks.search_keys --synthetic 20000
+
+The log is one input_text per line. Without --log a synthetic log is
+generated from a few base tasks with case, spacing, punctuation and
+wording variations. No ML backend is called; a miss just stores a marker.
+"""
+import argparse
+import json
+import random
+
+from django.conf import settings
+
+TEMPLATES = [
+    "book a cab to {}",
+    "order groceries delivered to {}",
+    "find a plumber near {}",
+    "schedule a haircut close to {}",
+    "buy movie tickets at {}",
+    "get my laptop repaired near {}",
+    "hire a house cleaner for {}",
+    "send flowers to {}",
+]
+PLACES = [
+    "the airport", "the office", "home", "the station", "my hotel", "the mall",
+    "downtown", "the hospital", "college", "the stadium", "my parents place",
+    "the beach", "the old town", "the conference centre", "the harbour",
+]
+FILLERS = ["please", "can you", "i want to", "help me", "quickly"]
+
+
+def synthetic_log(size, seed=0):
+    rng = random.Random(seed)
+    tasks = [template.format(place) for template in TEMPLATES for place in PLACES]
+    # A few popular tasks and a long tail, like real search traffic
+    weights = [1 / (rank + 1) for rank in range(len(tasks))]
+    for _ in range(size):
+        text = rng.choices(tasks, weights)[0]
+        roll = rng.random()
+        if roll < 0.2:
+            text = text.upper()
+        elif roll < 0.4:
+            text = f"  {text.title()}  "
+        elif roll < 0.55:
+            text = text + rng.choice(["!", "?", ".", "!!"])
+        elif roll < 0.7:
+            text = f"{rng.choice(FILLERS)} {text}"
+        yield text
+
+
+def replay(queries, simhash):
+    from django.core.cache import caches
+    from customer import search
+
+    caches['search'].clear()
+    search._normalizer = None
+    settings.SEARCH_CACHE['SIMHASH'] = simhash
+    hits = 0
+    for text in queries:
+        cache_key, index = search.resolve_cache_key(text)
+        if caches['search'].get(cache_key) is not None:
+            hits += 1
+            continue
+        entry = search.get_policy().entry({"task": text})
+        caches['search'].set(cache_key, entry)
+        if index is not None:
+            caches['search'].set_many(search._index_entries(cache_key, entry, index))
+    return hits
+
+
+def raw_hits(queries):
+    seen = set()
+    hits = 0
+    for text in queries:
+        hits += text in seen
+        seen.add(text)
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', help='file with one input_text per line')
+    parser.add_argument('--synthetic', type=int, default=20000)
+    args = parser.parse_args()
+
+    settings.configure(
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'OPTIONS': {'MAX_ENTRIES': 10 ** 6}},
+            'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'search', 'OPTIONS': {'MAX_ENTRIES': 10 ** 6}},
+        },
+        SEARCH_CACHE={},
+    )
+
+    if args.log:
+        with open(args.log, encoding='utf-8') as f:
+            queries = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        queries = list(synthetic_log(args.synthetic))
+
+    total = len(queries)
+    for name, hits in [
+        ("raw md5(input_text)", raw_hits(queries)),
+        ("normalized", replay(queries, simhash=False)),
+        ("normalized + simhash", replay(queries, simhash=True)),
+    ]:
+        print(json.dumps({
+            "strategy": name,
+            "queries": total,
+            "hits": hits,
+            "ml_calls": total - hits,
+            "hit_rate": round(hits / total, 4),
+        }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Database queries per authenticated request for each session engine
+
+    python -m benchmarks.session_writes --requests 500
+
+Logs a user in, then issues GET requests through the session and auth
+middleware with SESSION_SAVE_EVERY_REQUEST on, counting django_session
+reads and writes. The cache is LocMem, standing in for Redis.
+"""
+import argparse
+import json
+import time
+
+from django.http import JsonResponse
+from django.urls import path
+
+from . import _django
+
+
+def me(request):
+    return JsonResponse({"id": request.user.id})
+
+
+urlpatterns = [path('me/', me)]
+
+
+def run(engine, requests):
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.test import Client
+
+    settings.SESSION_ENGINE = engine
+    user = get_user_model().objects.get(email='bench@example.com')
+    client = Client()
+    client.force_login(user)
+
+    counts = {"session_reads": 0, "session_writes": 0}
+
+    def count(execute, sql, params, many, context):
+        if 'django_session' in sql:
+            key = "session_reads" if sql.lstrip().upper().startswith('SELECT') else "session_writes"
+            counts[key] += 1
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    with connection.execute_wrapper(count):
+        for _ in range(requests):
+            assert client.get('/me/').status_code == 200
+    elapsed = time.perf_counter() - start
+    return {
+        "engine": engine,
+        "requests": requests,
+        "session_reads_per_request": round(counts["session_reads"] / requests, 3),
+        "session_writes_per_request": round(counts["session_writes"] / requests, 3),
+        "requests_per_second": round(requests / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--db', default='/tmp/session_bench.sqlite3')
+    args = parser.parse_args()
+
+    _django.setup(
+        args.db,
+        ROOT_URLCONF=__name__ if __name__ != '__main__' else 'benchmarks.session_writes',
+        MIDDLEWARE=[
+            'django.contrib.sessions.middleware.SessionMiddleware',
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+        ],
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        SESSION_SAVE_EVERY_REQUEST=True,
+        SESSION_COOKIE_AGE=3600,
+        SESSION_DB_REFRESH_THRESHOLD=15 * 60,
+        ALLOWED_HOSTS=['*'],
+    )
+    from django.contrib.auth import get_user_model
+    get_user_model().objects.create_user('bench@example.com', 'benchmark-password')
+
+    for engine in ['django.contrib.sessions.backends.db', 'backends.sessions']:
+        print(json.dumps(run(engine, args.requests)))
+
+
+if __name__ == '__main__':
+    main()
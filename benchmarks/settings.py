@@ -0,0 +1,47 @@
+"""Project settings with every external service replaced by a local stand-in
+
+Used by benchmarks.api: SQLite in a temp file, fakeredis (LocMem when it
+is not installed), the locmem email backend and the stub ML server.
+"""
+import os
+
+# SMTP and S3 are only checked when used, so they need no stand-in values
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('ML_BACKEND_URI', 'http://127.0.0.1:8765')
+
+from backends.settings import *  # noqa: E402,F401,F403
+from backends.settings import CACHES, INSTRUMENTATION, REST_FRAMEWORK  # noqa: E402
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCH_DB', '/tmp/api_bench.sqlite3'),
+    }
+}
+DATABASE_REPLICAS = []
+
+try:
+    from fakeredis import FakeConnection
+except ImportError:
+    REDIS = 'locmem'
+    CACHES = {**CACHES, 'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+else:
+    REDIS = 'fakeredis'
+    CACHES = {**CACHES, 'default': {
+        **CACHES['default'],
+        'OPTIONS': {**CACHES['default']['OPTIONS'], 'CONNECTION_POOL_KWARGS': {'connection_class': FakeConnection}},
+    }}
+
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+# Measure the endpoints, not the rate limiter
+REST_FRAMEWORK = {**REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+
+SESSION_COOKIE_SECURE = False
+CSRF_COOKIE_SECURE = False
+
+# Sampled and slow-request logs would interleave with the results
+INSTRUMENTATION = {**INSTRUMENTATION, 'LOG_SAMPLE_RATE': 0, 'SLOW_REQUEST_MS': float('inf')}
@@ -0,0 +1,49 @@
+"""Local stand-in for ML_BACKEND_URI
+
+    python -m benchmarks.stub_ml_server --port 8765 --latency-ms 50
+"""
+import argparse
+import asyncio
+
+from aiohttp import web
+
+
+def make_app(latency_ms=50):
+    app = web.Application()
+    app['calls'] = 0
+
+    async def classify_task(request):
+        payload = await request.json()
+        app['calls'] += 1
+        await asyncio.sleep(latency_ms / 1000)
+        return web.json_response({"task": payload.get("task"), "category": "stub", "confidence": 1.0})
+
+    async def classify_tasks(request):
+        payload = await request.json()
+        app['calls'] += 1
+        await asyncio.sleep(latency_ms / 1000)
+        return web.json_response([
+            {"task": item.get("task"), "category": "stub", "confidence": 1.0}
+            for item in payload["items"]
+        ])
+
+    app.router.add_post('/classify-task', classify_task)
+    app.router.add_post('/classify-tasks', classify_tasks)
+    return app
+
+
+async def start(port=8765, latency_ms=50):
+    """Start the stub on the running loop and return its runner"""
+    app = make_app(latency_ms)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency_ms), host='127.0.0.1', port=args.port)
@@ -0,0 +1,62 @@
+"""Local stand-in for PUSH['URI']
+
+    python -m benchmarks.stub_push_server --port 8766 --latency-ms 20
+
+Answers POST /send like a multicast push provider. Tokens starting with
+"invalid" get NotRegistered and tokens starting with "flaky" get
+Unavailable the first time they are sent.
+"""
+import argparse
+import asyncio
+import itertools
+
+from aiohttp import web
+
+
+def make_app(latency_ms=20):
+    app = web.Application(client_max_size=16 * 1024 ** 2)
+    app['requests'] = 0
+    app['tokens'] = 0
+    app['seen_flaky'] = set()
+    ids = itertools.count(1)
+
+    def result(token):
+        if token.startswith('invalid'):
+            return {"error": "NotRegistered"}
+        if token.startswith('flaky') and token not in app['seen_flaky']:
+            app['seen_flaky'].add(token)
+            return {"error": "Unavailable"}
+        return {"message_id": f"stub:{next(ids)}"}
+
+    async def send(request):
+        payload = await request.json()
+        tokens = payload["registration_ids"]
+        app['requests'] += 1
+        app['tokens'] += len(tokens)
+        await asyncio.sleep(latency_ms / 1000)
+        results = [result(token) for token in tokens]
+        return web.json_response({
+            "success": sum('message_id' in r for r in results),
+            "failure": sum('error' in r for r in results),
+            "results": results,
+        })
+
+    app.router.add_post('/send', send)
+    return app
+
+
+async def start(port=8766, latency_ms=20):
+    """Start the stub on the running loop and return its runner"""
+    app = make_app(latency_ms)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency_ms), host='127.0.0.1', port=args.port)
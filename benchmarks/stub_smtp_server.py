@@ -0,0 +1,88 @@
+"""Local stand-in for EMAIL_HOST
+
+    python -m benchmarks.stub_smtp_server --port 8025 --latency-ms 20 --connect-latency-ms 100
+
+Speaks just enough plain SMTP for Django's smtp backend (no TLS, no AUTH)
+and discards what it receives; --connect-latency-ms delays the greeting
+to stand in for the TLS handshake and AUTH of a real server. Recipients
+starting with "reject" are refused with 550. Prints the number of
+accepted messages on exit.
+"""
+import argparse
+import asyncio
+
+
+class Stats:
+    def __init__(self):
+        self.connections = 0
+        self.messages = 0
+
+
+async def handle(reader, writer, stats, latency, connect_latency):
+    stats.connections += 1
+    await asyncio.sleep(connect_latency)
+
+    async def reply(line):
+        writer.write(line.encode() + b"\r\n")
+        await writer.drain()
+
+    await reply("220 stub ESMTP")
+    recipients = 0
+    while line := await reader.readline():
+        command = line.decode('latin-1').strip()
+        verb = command[:4].upper()
+        if verb in ('EHLO', 'HELO'):
+            await reply("250-stub" if verb == 'EHLO' else "250 stub")
+            if verb == 'EHLO':
+                await reply("250 8BITMIME")
+        elif verb == 'MAIL':
+            recipients = 0
+            await reply("250 OK")
+        elif verb == 'RCPT':
+            if command[8:].strip(' <>').lower().startswith('reject'):
+                await reply("550 No such user")
+            else:
+                recipients += 1
+                await reply("250 OK")
+        elif verb == 'DATA':
+            if not recipients:
+                await reply("554 No valid recipients")
+                continue
+            await reply("354 End data with <CR><LF>.<CR><LF>")
+            while (await reader.readline()) not in (b".\r\n", b".\n", b""):
+                pass
+            await asyncio.sleep(latency)
+            stats.messages += 1
+            await reply("250 OK queued")
+        elif verb == 'QUIT':
+            await reply("221 Bye")
+            break
+        else:
+            # RSET, NOOP and anything else
+            await reply("250 OK")
+    writer.close()
+
+
+async def serve(port, latency_ms, connect_latency_ms):
+    stats = Stats()
+    server = await asyncio.start_server(
+        lambda reader, writer: handle(reader, writer, stats, latency_ms / 1000, connect_latency_ms / 1000),
+        '127.0.0.1', port,
+    )
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        print(f"{stats.messages} messages over {stats.connections} connections", flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency-ms', type=float, default=20, help="Time to accept each message")
+    parser.add_argument('--connect-latency-ms', type=float, default=100, help="Time before the greeting")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port, args.latency_ms, args.connect_latency_ms))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,76 @@
+"""Per-request cost of the sliding window throttle
+
+    python -m benchmarks.throttle_overhead --requests 20000
+    python -m benchmarks.throttle_overhead --redis redis://127.0.0.1:6379/15
+
+Calls a trivial DRF view with no throttle, with the in-process limiter
+and, when --redis is given, with the Redis Lua limiter, each request
+from a different client IP so no call is rejected.
+"""
+import argparse
+import json
+import time
+
+from . import _django
+
+
+def run(label, view, requests):
+    from rest_framework.test import APIRequestFactory
+
+    factory = APIRequestFactory()
+    samples = []
+    for i in range(requests):
+        request = factory.get('/', REMOTE_ADDR=f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}")
+        start = time.perf_counter()
+        response = view(request)
+        samples.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    return {"limiter": label, "requests": requests, **_django.percentiles(samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--redis', help="Redis URL to benchmark the Lua limiter against")
+    parser.add_argument('--db', default='/tmp/throttle_bench.sqlite3')
+    args = parser.parse_args()
+
+    caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    if args.redis:
+        caches['redis'] = {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': args.redis}
+    _django.setup(
+        args.db,
+        CACHES=caches,
+        REST_FRAMEWORK={
+            'DEFAULT_AUTHENTICATION_CLASSES': [],
+            'DEFAULT_THROTTLE_RATES': {'bench_ip': '1000/min'},
+            'UNAUTHENTICATED_USER': None,
+        },
+    )
+    from rest_framework.response import Response
+    from rest_framework.views import APIView
+
+    from backends import throttling
+
+    class Plain(APIView):
+        throttle_classes = []
+
+        def get(self, request):
+            return Response({})
+
+    class Throttled(Plain):
+        throttle_classes = [throttling.IPThrottle]
+        throttle_scope = 'bench'
+
+    print(json.dumps(run('none', Plain.as_view(), args.requests)))
+    throttling._limiter = throttling.RedisLimiter(throttling.get_config())
+    print(json.dumps(run('local', Throttled.as_view(), args.requests)))
+    if args.redis:
+        from django_redis import get_redis_connection
+        get_redis_connection('redis').ping()  # fail loudly rather than fall back
+        throttling._limiter = throttling.RedisLimiter({**throttling.get_config(), 'CACHE_ALIAS': 'redis'})
+        print(json.dumps(run('redis', Throttled.as_view(), args.requests)))
+
+
+if __name__ == '__main__':
+    main()
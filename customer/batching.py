@@ -0,0 +1,121 @@
+import asyncio
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .ml_client import MLBackendError
+
+
+class MicroBatcher:
+    """Group single classify calls from many threads into batch calls
+
+    Calls arriving within max_wait seconds of the first one, up to
+    max_batch_size of them, are sent upstream together through send(), which
+    takes a list of items and returns one result or exception per item.
+    """
+
+    def __init__(self, send, max_batch_size=32, max_wait=0.005, max_in_flight=4):
+        self.send = send
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='ml-batch')
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def classify(self, user_id, task):
+        result = self.submit((user_id, task)).result()
+        if isinstance(result, MLBackendError):
+            raise result
+        return result
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, name='ml-batcher', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        try:
+            results = self.send([item for item, _ in batch])
+        except Exception as e:
+            results = [MLBackendError(str(e))] * len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+class AsyncMicroBatcher:
+    """MicroBatcher for one event loop; send is a coroutine function"""
+
+    def __init__(self, send, max_batch_size=32, max_wait=0.005):
+        self.send = send
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def classify(self, user_id, task):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((user_id, task), future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        result = await future
+        if isinstance(result, MLBackendError):
+            raise result
+        return result
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._dispatch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            results = await self.send([item for item, _ in batch])
+        except Exception as e:
+            results = [MLBackendError(str(e))] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+_async_batchers = weakref.WeakKeyDictionary()
+
+
+def get_async_batcher(send, **kwargs):
+    """One AsyncMicroBatcher per running event loop"""
+    loop = asyncio.get_running_loop()
+    batcher = _async_batchers.get(loop)
+    if batcher is None:
+        batcher = _async_batchers[loop] = AsyncMicroBatcher(send, **kwargs)
+    return batcher
@@ -0,0 +1,112 @@
+import random
+import time
+import uuid
+
+
+class CacheEntry:
+    """What the search cache stores under a search_api_ key
+
+    error entries are short-lived negative results for failed upstream calls.
+    version is new for every upstream result, so it can serve as an ETag;
+    rendered holds response bodies made from output, if the cache's user
+    stores any. Entries cached before either existed load with None.
+    """
+    version = None
+    rendered = None
+
+    def __init__(self, output, fresh_until, expires_at, error=False, version=None, rendered=None):
+        self.output = output
+        self.fresh_until = fresh_until
+        self.expires_at = expires_at
+        self.error = error
+        self.version = version
+        self.rendered = rendered
+
+    def is_stale(self, now=None):
+        return (now or time.time()) >= self.fresh_until
+
+    def remaining(self, now=None):
+        return max(1, int(self.expires_at - (now or time.time())))
+
+
+class CachePolicy:
+    """Soft/hard TTL, negative caching and jitter for one cache
+
+    Entries are served as-is until soft_ttl, served stale while a background
+    refresh runs until hard_ttl, and dropped by the cache after that. Upstream
+    failures are cached for negative_ttl only. jitter is the fraction by which
+    both TTLs are randomly shortened so entries written together do not all
+    expire together.
+    """
+
+    def __init__(self, soft_ttl, hard_ttl, negative_ttl, jitter=0.0):
+        if soft_ttl > hard_ttl:
+            raise ValueError("soft_ttl must not exceed hard_ttl")
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.negative_ttl = negative_ttl
+        self.jitter = jitter
+
+    def _jittered(self, ttl):
+        if not self.jitter:
+            return ttl
+        return ttl * (1 - random.uniform(0, self.jitter))
+
+    def entry(self, output):
+        now = time.time()
+        return CacheEntry(
+            output,
+            fresh_until=now + self._jittered(self.soft_ttl),
+            expires_at=now + self._jittered(self.hard_ttl),
+            version=uuid.uuid4().hex[:16],
+        )
+
+    def error_entry(self, detail):
+        now = time.time()
+        return CacheEntry(
+            detail,
+            fresh_until=now + self.negative_ttl,
+            expires_at=now + self.negative_ttl,
+            error=True,
+        )
+
+    def deferred(self, entry):
+        """Stale entry kept after a failed refresh; the next refresh waits negative_ttl"""
+        return CacheEntry(
+            entry.output,
+            fresh_until=time.time() + self.negative_ttl,
+            expires_at=entry.expires_at,
+            version=entry.version,
+            rendered=entry.rendered,
+        )
+
+    def timeout(self, entry):
+        return entry.remaining()
+
+    def batch_timeout(self, entry, buckets=4):
+        """Cache timeout of entry when written with set_many alongside others
+
+        Results get the shortest of buckets jittered TTLs, evenly spread
+        between the shortest and longest TTL jitter allows, that still
+        covers their own expires_at. A batch is then written with at most
+        buckets set_many calls for results, one for errors, and its results
+        do not all expire at the same instant.
+        """
+        if entry.error:
+            return self.negative_ttl
+        remaining = entry.remaining()
+        for step in range(buckets - 1, 0, -1):
+            timeout = int(self.hard_ttl * (1 - self.jitter * step / (buckets - 1)))
+            if timeout >= remaining:
+                return timeout
+        return self.hard_ttl
+
+    def load(self, value):
+        """Turn a raw cache value into a CacheEntry
+
+        Values written before entries existed are bare ML outputs stored for
+        a fixed TTL; they are treated as fresh until the cache drops them.
+        """
+        if value is None or isinstance(value, CacheEntry):
+            return value
+        return CacheEntry(value, fresh_until=float('inf'), expires_at=float('inf'))
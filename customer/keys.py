@@ -0,0 +1,75 @@
+import hashlib
+import re
+import unicodedata
+
+from django.utils.module_loading import import_string
+
+
+def nfkc(text):
+    return unicodedata.normalize('NFKC', text)
+
+
+def casefold(text):
+    return text.casefold()
+
+
+def strip_punctuation(text):
+    return ''.join(' ' if unicodedata.category(ch).startswith('P') else ch for ch in text)
+
+
+def collapse_whitespace(text):
+    return ' '.join(text.split())
+
+
+DEFAULT_NORMALIZERS = [
+    'customer.keys.nfkc',
+    'customer.keys.casefold',
+    'customer.keys.strip_punctuation',
+    'customer.keys.collapse_whitespace',
+]
+
+
+class KeyNormalizer:
+    """Apply a pipeline of str -> str steps given as dotted paths"""
+
+    def __init__(self, steps=None):
+        self.steps = [import_string(step) for step in (DEFAULT_NORMALIZERS if steps is None else steps)]
+
+    def __call__(self, text):
+        for step in self.steps:
+            text = step(text)
+        return text
+
+
+_word_re = re.compile(r'\w+')
+
+
+def _features(text):
+    words = _word_re.findall(text)
+    # Single words plus word bigrams, so word order still counts a little
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def simhash(text, bits=64):
+    """SimHash signature of text; similar texts differ in few bits"""
+    weights = [0] * bits
+    for feature in _features(text):
+        h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=bits // 8).digest(), 'big')
+        for i in range(bits):
+            weights[i] += 1 if h >> i & 1 else -1
+    signature = 0
+    for i, weight in enumerate(weights):
+        if weight > 0:
+            signature |= 1 << i
+    return signature
+
+
+def bands(signature, count=4, bits=64):
+    """Split a signature into LSH bands; near duplicates share at least one band"""
+    width = bits // count
+    mask = (1 << width) - 1
+    return [(i, signature >> (i * width) & mask) for i in range(count)]
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
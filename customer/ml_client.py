@@ -0,0 +1,317 @@
+import asyncio
+import json
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from backends.instrumentation import timed
+
+from .resilience import (
+    Bulkhead,
+    BulkheadFullError,
+    CircuitBreaker,
+    CircuitOpenError,
+    Guard,
+    RetryBudget,
+    make_retry,
+)
+
+headers = {
+  'Content-Type': 'application/json'
+}
+
+_sync_session = None
+_async_sessions = weakref.WeakKeyDictionary()
+_fanout_executor = None
+_fanout_semaphores = weakref.WeakKeyDictionary()
+_guard = None
+
+
+class MLBackendError(Exception):
+    """The ML backend failed, timed out or returned an unusable response
+
+    retryable marks transient failures (connection errors, timeouts, 5xx).
+    cacheable is False when the call never reached the backend, so the
+    outcome says nothing about the input and must not be negatively cached.
+    """
+    cacheable = True
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class MLBackendUnavailable(MLBackendError):
+    """Call rejected by the circuit breaker or bulkhead"""
+    cacheable = False
+
+
+def get_config():
+    """Return the ML backend settings with defaults filled in"""
+    config = {
+        'URI': None,
+        'POOL_SIZE': 100,
+        'CONNECT_TIMEOUT': 3.0,
+        'READ_TIMEOUT': 30.0,
+        'KEEPALIVE_TIMEOUT': 30.0,
+        'BATCH_PATH': None,
+        'MICROBATCH': False,
+        'MICROBATCH_MAX_SIZE': 32,
+        'MICROBATCH_MAX_WAIT': 0.005,
+        'MAX_CONCURRENT': 20,
+        'BREAKER_FAILURE_THRESHOLD': 5,
+        'BREAKER_RECOVERY_TIMEOUT': 30,
+        'BREAKER_HALF_OPEN_CALLS': 1,
+        'RETRY_ATTEMPTS': 2,
+        'RETRY_BACKOFF': 0.05,
+        'RETRY_MAX_BACKOFF': 1.0,
+        'RETRY_JITTER': 0.3,
+        'RETRY_BUDGET_RATIO': 0.1,
+        'RETRY_BUDGET_MIN_PER_SECOND': 1,
+    }
+    config.update(getattr(settings, 'ML_BACKEND', {}))
+    return config
+
+
+def get_guard():
+    """Process-wide resilience guard shared by sync and async calls"""
+    global _guard
+    if _guard is None:
+        config = get_config()
+        _guard = Guard(
+            breaker=CircuitBreaker(
+                failure_threshold=config['BREAKER_FAILURE_THRESHOLD'],
+                recovery_timeout=config['BREAKER_RECOVERY_TIMEOUT'],
+                half_open_calls=config['BREAKER_HALF_OPEN_CALLS'],
+            ),
+            bulkhead=Bulkhead(config['MAX_CONCURRENT']),
+            budget=RetryBudget(
+                ratio=config['RETRY_BUDGET_RATIO'],
+                min_per_second=config['RETRY_BUDGET_MIN_PER_SECOND'],
+            ),
+            retry=make_retry(
+                attempts=config['RETRY_ATTEMPTS'],
+                start_timeout=config['RETRY_BACKOFF'],
+                max_timeout=config['RETRY_MAX_BACKOFF'],
+                jitter=config['RETRY_JITTER'],
+            ),
+            is_retryable=lambda e: getattr(e, 'retryable', False),
+        )
+    return _guard
+
+
+def guarded(fn):
+    try:
+        return get_guard().call(fn)
+    except (CircuitOpenError, BulkheadFullError) as e:
+        raise MLBackendUnavailable(str(e)) from e
+
+
+async def aguarded(fn):
+    try:
+        return await get_guard().acall(fn)
+    except (CircuitOpenError, BulkheadFullError) as e:
+        raise MLBackendUnavailable(str(e)) from e
+
+
+def _require_uri(config):
+    if not config['URI']:
+        raise ImproperlyConfigured("Set ML_BACKEND_URI in the environment or .env")
+
+
+# requests and aiohttp are imported by the functions below rather than at
+# module level: together they cost a few hundred milliseconds of import
+# time, which every worker would otherwise pay at boot, and each process
+# only ever needs one of them.
+
+def get_sync_session():
+    """Shared requests session so sync workers reuse TCP/TLS connections"""
+    global _sync_session
+    if _sync_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        config = get_config()
+        _require_uri(config)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config['POOL_SIZE'])
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(headers)
+        _sync_session = session
+    return _sync_session
+
+
+def get_async_session():
+    """Shared aiohttp session for the running event loop
+
+    aiohttp sessions are bound to the loop that created them, so one pooled
+    session is kept per loop and reused by every request served on it.
+    """
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        import aiohttp
+
+        config = get_config()
+        _require_uri(config)
+        connector = aiohttp.TCPConnector(
+            limit=config['POOL_SIZE'],
+            keepalive_timeout=config['KEEPALIVE_TIMEOUT'],
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=config['CONNECT_TIMEOUT'],
+                sock_read=config['READ_TIMEOUT'],
+            ),
+        )
+        _async_sessions[loop] = session
+    return session
+
+
+async def close_async_session():
+    """Close the session of the running loop, e.g. on ASGI shutdown"""
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def _post(path, payload):
+    import requests
+
+    config = get_config()
+    try:
+        with timed('ml'):
+            response = get_sync_session().post(
+                url=f"{config['URI']}{path}",
+                data=payload,
+                timeout=(config['CONNECT_TIMEOUT'], config['READ_TIMEOUT']),
+            )
+    except requests.RequestException as e:
+        raise MLBackendError(str(e), retryable=True) from e
+    if not response.ok:
+        raise MLBackendError(f"HTTP {response.status_code}", retryable=response.status_code >= 500)
+    try:
+        return response.json()
+    except ValueError as e:
+        raise MLBackendError(str(e)) from e
+
+
+async def _apost(path, payload):
+    import aiohttp
+
+    config = get_config()
+    try:
+        with timed('ml'):
+            async with get_async_session().post(f"{config['URI']}{path}", data=payload) as response:
+                if not response.ok:
+                    raise MLBackendError(f"HTTP {response.status}", retryable=response.status >= 500)
+                try:
+                    return await response.json(content_type=None)
+                except ValueError as e:
+                    raise MLBackendError(str(e)) from e
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise MLBackendError(str(e) or e.__class__.__name__, retryable=True) from e
+
+
+def classify_task(user_id, task):
+    """Call the ML backend classify-task endpoint from a sync worker"""
+    payload = json.dumps({
+        "user_id": str(user_id),
+        "task": task
+    })
+    return guarded(lambda: _post('/classify-task', payload))
+
+
+async def aclassify_task(user_id, task):
+    """Call the ML backend classify-task endpoint without blocking the loop"""
+    payload = json.dumps({
+        "user_id": str(user_id),
+        "task": task
+    })
+    return await aguarded(lambda: _apost('/classify-task', payload))
+
+
+def _batch_payload(items):
+    return json.dumps({
+        "items": [{"user_id": str(user_id), "task": task} for user_id, task in items]
+    })
+
+
+def _batch_outputs(outputs, items):
+    if not isinstance(outputs, list) or len(outputs) != len(items):
+        raise MLBackendError("Batch response does not match the request")
+    return outputs
+
+
+def _call_or_error(user_id, task):
+    try:
+        return classify_task(user_id, task)
+    except MLBackendError as e:
+        return e
+
+
+def get_fanout_executor():
+    """Executor of batch fan-outs, no wider than the bulkhead so it never rejects them"""
+    global _fanout_executor
+    if _fanout_executor is None:
+        config = get_config()
+        _fanout_executor = ThreadPoolExecutor(
+            max_workers=min(config['POOL_SIZE'], config['MAX_CONCURRENT']),
+            thread_name_prefix='ml-fanout',
+        )
+    return _fanout_executor
+
+
+def get_fanout_semaphore():
+    """Async counterpart of get_fanout_executor(), one per event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _fanout_semaphores.get(loop)
+    if semaphore is None:
+        config = get_config()
+        semaphore = _fanout_semaphores[loop] = asyncio.Semaphore(min(config['POOL_SIZE'], config['MAX_CONCURRENT']))
+    return semaphore
+
+
+def classify_tasks(items):
+    """Classify a list of (user_id, task) pairs in one go
+
+    Uses the ML backend's batch endpoint when BATCH_PATH is configured; it
+    receives {"items": [{"user_id", "task"}, ...]} and returns a JSON list of
+    outputs in the same order. Without one, the calls are fanned out over
+    the shared session, at most MAX_CONCURRENT at a time across the process
+    so the rest wait for the bulkhead instead of being rejected by it.
+    Returns one output or MLBackendError per item.
+    """
+    config = get_config()
+    if not config['BATCH_PATH']:
+        return list(get_fanout_executor().map(lambda item: _call_or_error(*item), items))
+    payload = _batch_payload(items)
+    try:
+        return _batch_outputs(guarded(lambda: _post(config['BATCH_PATH'], payload)), items)
+    except MLBackendError as e:
+        return [e] * len(items)
+
+
+async def _acall_or_error(user_id, task):
+    try:
+        async with get_fanout_semaphore():
+            return await aclassify_task(user_id, task)
+    except MLBackendError as e:
+        return e
+
+
+async def aclassify_tasks(items):
+    """Async variant of classify_tasks()"""
+    config = get_config()
+    if not config['BATCH_PATH']:
+        return list(await asyncio.gather(*(_acall_or_error(*item) for item in items)))
+    payload = _batch_payload(items)
+    try:
+        return _batch_outputs(await aguarded(lambda: _apost(config['BATCH_PATH'], payload)), items)
+    except MLBackendError as e:
+        return [e] * len(items)
@@ -0,0 +1,212 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+
+class CircuitBreaker:
+    """Stop calling a dependency after repeated failures
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    are rejected for recovery_timeout seconds. Then up to half_open_calls
+    probe calls are let through: a success closes the circuit, a failure
+    opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30, half_open_calls=1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    return False
+                self._probes += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class Bulkhead:
+    """Cap the number of concurrent calls; extra callers are rejected at once"""
+
+    def __init__(self, max_concurrent):
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.max_concurrent:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class RetryBudget:
+    """Allow retries only while they stay a small share of recent calls
+
+    Over the last window seconds, retries may be at most ratio times the
+    number of first attempts, plus min_per_second * window so that a quiet
+    process can still retry at all.
+    """
+
+    def __init__(self, ratio=0.1, min_per_second=1, window=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        for events in (self._requests, self._retries):
+            while events and events[0] < now - self.window:
+                events.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.monotonic()
+            # Trimmed here too, as try_spend() only runs when a call fails
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_spend(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            allowed = self.min_per_second * self.window + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class BulkheadFullError(Exception):
+    pass
+
+
+class Guard:
+    """Circuit breaker, bulkhead and budgeted jittered retries around a call
+
+    is_retryable(exc) decides which failures are worth another attempt.
+    Only those count toward opening the circuit: any other error (a 4xx,
+    an unusable body) is one the dependency answered with, so it is
+    re-raised and counts as a sign of life. Rejections raise
+    CircuitOpenError or BulkheadFullError without calling the dependency.
+    """
+
+    def __init__(self, breaker, bulkhead, budget, retry, is_retryable):
+        self.breaker = breaker
+        self.bulkhead = bulkhead
+        self.budget = budget
+        self.retry = retry
+        self.is_retryable = is_retryable
+
+    def _admit(self):
+        if not self.bulkhead.try_acquire():
+            raise BulkheadFullError("Too many concurrent calls")
+        if not self.breaker.allow():
+            self.bulkhead.release()
+            raise CircuitOpenError("Circuit open")
+        self.budget.record_request()
+
+    def _record_error(self, error):
+        if self.is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            # Also ends a half-open probe, which would otherwise hold its slot
+            self.breaker.record_success()
+
+    def _should_retry(self, attempt, error):
+        return (
+            attempt + 1 < self.retry.attempts
+            and self.is_retryable(error)
+            and self.budget.try_spend()
+        )
+
+    def call(self, fn):
+        self._admit()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    result = fn()
+                except Exception as e:
+                    if not self._should_retry(attempt, e):
+                        self._record_error(e)
+                        raise
+                    time.sleep(self.retry.get_timeout(attempt))
+                    attempt += 1
+                else:
+                    self.breaker.record_success()
+                    return result
+        finally:
+            self.bulkhead.release()
+
+    async def acall(self, fn):
+        """Async variant of call(); fn is a coroutine function"""
+        self._admit()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    result = await fn()
+                except Exception as e:
+                    if not self._should_retry(attempt, e):
+                        self._record_error(e)
+                        raise
+                    await asyncio.sleep(self.retry.get_timeout(attempt))
+                    attempt += 1
+                else:
+                    self.breaker.record_success()
+                    return result
+        finally:
+            self.bulkhead.release()
+
+
+def make_retry(attempts, start_timeout, max_timeout, jitter):
+    """Backoff schedule of aiohttp-retry; attempts counts the first call"""
+    # aiohttp_retry imports all of aiohttp; only pay for it once a guard is built
+    from aiohttp_retry import JitterRetry
+
+    return JitterRetry(
+        attempts=attempts,
+        start_timeout=start_timeout,
+        max_timeout=max_timeout,
+        random_interval_size=jitter,
+    )
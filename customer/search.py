@@ -0,0 +1,412 @@
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.renderers import JSONRenderer
+
+from backends import http
+
+from .batching import MicroBatcher, get_async_batcher
+from .cache_policy import CachePolicy
+from .keys import KeyNormalizer, bands, hamming, simhash
+from .ml_client import (
+    MLBackendError,
+    aclassify_task,
+    aclassify_tasks,
+    classify_task,
+    classify_tasks,
+    get_config as get_ml_config,
+)
+from .serializers import SearchResponseSerializer
+from .singleflight import SingleFlight
+
+
+def get_config():
+    """Return the search cache settings with defaults filled in"""
+    config = {
+        'SOFT_TTL': 60 * 60 * 24,
+        'HARD_TTL': 60 * 60 * 36,
+        'NEGATIVE_TTL': 30,
+        'JITTER': 0.1,
+        'LOCK_TIMEOUT': 35,
+        'LOCK_WAIT_TIMEOUT': 35,
+        'LOCK_POLL_INTERVAL': 0.05,
+        'REFRESH_WORKERS': 4,
+        'CACHE_ALIAS': 'search',
+        'KEY_NORMALIZERS': None,
+        'SIMHASH': False,
+        'SIMHASH_BANDS': 4,
+        'SIMHASH_MAX_DISTANCE': 3,
+        'LEGACY_KEYS': True,
+    }
+    config.update(getattr(settings, 'SEARCH_CACHE', {}))
+    return config
+
+
+_normalizer = None
+_flight = None
+_policy = None
+_refresh_executor = None
+_batcher = None
+_refresh_tasks = set()
+
+
+def get_cache():
+    return caches[get_config()['CACHE_ALIAS']]
+
+
+def get_normalizer():
+    global _normalizer
+    if _normalizer is None:
+        _normalizer = KeyNormalizer(get_config()['KEY_NORMALIZERS'])
+    return _normalizer
+
+
+def search_cache_key(input_text):
+    """Create a unique cache key based on the normalized input text"""
+    normalized = get_normalizer()(input_text)
+    return f"search_api_{hashlib.md5(normalized.encode()).hexdigest()}"
+
+
+def legacy_cache_key(input_text):
+    """Key of input_text before keys were normalized, or None if it is the same"""
+    cache_key = f"search_api_{hashlib.md5(input_text.encode()).hexdigest()}"
+    if not get_config()['LEGACY_KEYS'] or cache_key == search_cache_key(input_text):
+        return None
+    return cache_key
+
+
+def _get_with_legacy(cache_key, input_text):
+    """Cache value under cache_key, else under the legacy key of input_text
+
+    Entries cached before normalization keep being served until they
+    expire; their first refresh stores the result under cache_key.
+    """
+    value = get_cache().get(cache_key)
+    legacy_key = legacy_cache_key(input_text) if value is None else None
+    return get_cache().get(legacy_key) if legacy_key else value
+
+
+async def _aget_with_legacy(cache_key, input_text):
+    value = await get_cache().aget(cache_key)
+    legacy_key = legacy_cache_key(input_text) if value is None else None
+    return await get_cache().aget(legacy_key) if legacy_key else value
+
+
+def _similarity_index(input_text):
+    config = get_config()
+    signature = simhash(get_normalizer()(input_text))
+    band_keys = [
+        f"search_api_band_{i}_{value:x}"
+        for i, value in bands(signature, config['SIMHASH_BANDS'])
+    ]
+    return signature, band_keys
+
+
+def _closest(signature, candidates):
+    closest = min(
+        ((hamming(signature, other), cache_key) for cache_key, other in candidates.values()),
+        default=None,
+    )
+    if closest is None or closest[0] > get_config()['SIMHASH_MAX_DISTANCE']:
+        return None
+    return closest[1]
+
+
+def resolve_cache_key(input_text):
+    """Return (cache_key, index) for input_text
+
+    With SIMHASH enabled, a text whose signature is within
+    SIMHASH_MAX_DISTANCE bits of an already cached text reuses that text's
+    key, so paraphrases share one classification. index is what
+    fetch_entry() records so later near duplicates can find this key.
+    """
+    cache_key = search_cache_key(input_text)
+    if not get_config()['SIMHASH']:
+        return cache_key, None
+    signature, band_keys = _similarity_index(input_text)
+    similar_key = _closest(signature, get_cache().get_many(band_keys))
+    return similar_key or cache_key, (signature, band_keys)
+
+
+async def aresolve_cache_key(input_text):
+    """Async variant of resolve_cache_key()"""
+    cache_key = search_cache_key(input_text)
+    if not get_config()['SIMHASH']:
+        return cache_key, None
+    signature, band_keys = _similarity_index(input_text)
+    similar_key = _closest(signature, await get_cache().aget_many(band_keys))
+    return similar_key or cache_key, (signature, band_keys)
+
+
+def get_flight():
+    global _flight
+    if _flight is None:
+        config = get_config()
+        _flight = SingleFlight(
+            get_cache(),
+            lock_timeout=config['LOCK_TIMEOUT'],
+            wait_timeout=config['LOCK_WAIT_TIMEOUT'],
+            poll_interval=config['LOCK_POLL_INTERVAL'],
+        )
+    return _flight
+
+
+def get_policy():
+    global _policy
+    if _policy is None:
+        config = get_config()
+        _policy = CachePolicy(
+            soft_ttl=config['SOFT_TTL'],
+            hard_ttl=config['HARD_TTL'],
+            negative_ttl=config['NEGATIVE_TTL'],
+            jitter=config['JITTER'],
+        )
+    return _policy
+
+
+def get_refresh_executor():
+    global _refresh_executor
+    if _refresh_executor is None:
+        _refresh_executor = ThreadPoolExecutor(
+            max_workers=get_config()['REFRESH_WORKERS'],
+            thread_name_prefix='search-refresh',
+        )
+    return _refresh_executor
+
+
+def _batcher_options():
+    config = get_ml_config()
+    return {
+        'max_batch_size': config['MICROBATCH_MAX_SIZE'],
+        'max_wait': config['MICROBATCH_MAX_WAIT'],
+    }
+
+
+def classify(user_id, input_text):
+    """classify_task(), through the micro-batcher when it is enabled"""
+    if not get_ml_config()['MICROBATCH']:
+        return classify_task(user_id, input_text)
+    global _batcher
+    if _batcher is None:
+        _batcher = MicroBatcher(classify_tasks, **_batcher_options())
+    return _batcher.classify(user_id, input_text)
+
+
+async def aclassify(user_id, input_text):
+    """Async variant of classify()"""
+    if not get_ml_config()['MICROBATCH']:
+        return await aclassify_task(user_id, input_text)
+    return await get_async_batcher(aclassify_tasks, **_batcher_options()).classify(user_id, input_text)
+
+
+def render(output):
+    """Response body of a search result, by content encoding (see backends.http.encode)"""
+    return http.encode(JSONRenderer().render(SearchResponseSerializer({"output": output}).data))
+
+
+def _entry(output):
+    # Rendered once per upstream call, so cache hits skip JSON rendering and compression
+    entry = get_policy().entry(output)
+    entry.rendered = render(output)
+    return entry
+
+
+def _checked(entry, created):
+    if entry.error:
+        raise MLBackendError(entry.output)
+    return entry, created
+
+
+def resolve_cache_keys(input_texts):
+    """Batch variant of resolve_cache_key() doing at most one cache round trip"""
+    keys = [search_cache_key(input_text) for input_text in input_texts]
+    if not get_config()['SIMHASH']:
+        return [(cache_key, None) for cache_key in keys]
+    indexes = [_similarity_index(input_text) for input_text in input_texts]
+    candidates = get_cache().get_many({band_key for _, band_keys in indexes for band_key in band_keys})
+    resolved = []
+    for cache_key, (signature, band_keys) in zip(keys, indexes):
+        own = {band_key: candidates[band_key] for band_key in band_keys if band_key in candidates}
+        resolved.append((_closest(signature, own) or cache_key, (signature, band_keys)))
+    return resolved
+
+
+def _index_entries(cache_key, entry, index):
+    if index is None or entry.error:
+        return {}
+    signature, band_keys = index
+    return {band_key: (cache_key, signature) for band_key in band_keys}
+
+
+def fetch_entry(cache_key, user_id, input_text, stale=None, index=None):
+    """Call the ML backend and cache the outcome
+
+    A failure is cached as a short negative entry, unless a stale entry
+    exists: that one is kept and served until the next refresh attempt.
+    Calls rejected before reaching the backend are not cached at all.
+    """
+    policy = get_policy()
+    try:
+        entry = _entry(classify(user_id, input_text))
+    except MLBackendError as e:
+        if stale:
+            entry = policy.deferred(stale)
+        elif not e.cacheable:
+            raise
+        else:
+            entry = policy.error_entry(str(e))
+    get_cache().set(cache_key, entry, policy.timeout(entry))
+    index_entries = _index_entries(cache_key, entry, index)
+    if index_entries:
+        get_cache().set_many(index_entries, policy.timeout(entry))
+    return entry
+
+
+async def afetch_entry(cache_key, user_id, input_text, stale=None, index=None):
+    """Async variant of fetch_entry()"""
+    policy = get_policy()
+    try:
+        entry = _entry(await aclassify(user_id, input_text))
+    except MLBackendError as e:
+        if stale:
+            entry = policy.deferred(stale)
+        elif not e.cacheable:
+            raise
+        else:
+            entry = policy.error_entry(str(e))
+    await get_cache().aset(cache_key, entry, policy.timeout(entry))
+    index_entries = _index_entries(cache_key, entry, index)
+    if index_entries:
+        await get_cache().aset_many(index_entries, policy.timeout(entry))
+    return entry
+
+
+def search(user_id, input_text):
+    """Return (output, created) for input_text
+
+    created is True only when this request called the ML backend itself;
+    cache hits and requests coalesced onto another caller's call get False.
+    Stale entries are served immediately while a background refresh runs.
+    Raises MLBackendError when the upstream call failed recently.
+    """
+    entry, created = search_entry(user_id, input_text)
+    return entry.output, created
+
+
+async def asearch(user_id, input_text):
+    """Async variant of search()"""
+    entry, created = await asearch_entry(user_id, input_text)
+    return entry.output, created
+
+
+def search_entry(user_id, input_text):
+    """search(), returning the CacheEntry with the output instead
+
+    Its version and rendered bodies let views answer without rendering.
+    """
+    cache_key, index = resolve_cache_key(input_text)
+    policy = get_policy()
+
+    # Try to get cached response
+    entry = policy.load(_get_with_legacy(cache_key, input_text))
+    if entry is not None:
+        if entry.is_stale() and not entry.error:
+            get_refresh_executor().submit(
+                get_flight().try_lead,
+                cache_key,
+                lambda: fetch_entry(cache_key, user_id, input_text, stale=entry, index=index),
+            )
+        return _checked(entry, False)
+
+    value, shared = get_flight().do(
+        cache_key,
+        lambda: fetch_entry(cache_key, user_id, input_text, index=index),
+    )
+    return _checked(policy.load(value), not shared)
+
+
+async def asearch_entry(user_id, input_text):
+    """Async variant of search_entry()"""
+    cache_key, index = await aresolve_cache_key(input_text)
+    policy = get_policy()
+
+    entry = policy.load(await _aget_with_legacy(cache_key, input_text))
+    if entry is not None:
+        if entry.is_stale() and not entry.error:
+            task = asyncio.create_task(get_flight().atry_lead(
+                cache_key,
+                lambda: afetch_entry(cache_key, user_id, input_text, stale=entry, index=index),
+            ))
+            _refresh_tasks.add(task)
+            task.add_done_callback(_refresh_tasks.discard)
+        return _checked(entry, False)
+
+    value, shared = await get_flight().ado(
+        cache_key,
+        lambda: afetch_entry(cache_key, user_id, input_text, index=index),
+    )
+    return _checked(policy.load(value), not shared)
+
+
+def search_many(user_id, input_texts):
+    """Return one (output or MLBackendError) per input text
+
+    Cached entries are read with a single get_many and all misses are sent
+    to the ML backend as one batch.
+    """
+    policy = get_policy()
+    resolved = resolve_cache_keys(input_texts)
+    cached = get_cache().get_many({cache_key for cache_key, _ in resolved})
+    legacy_keys = {
+        cache_key: legacy_key
+        for input_text, (cache_key, _) in zip(input_texts, resolved)
+        if cache_key not in cached and (legacy_key := legacy_cache_key(input_text))
+    }
+    if legacy_keys:
+        legacy = get_cache().get_many(set(legacy_keys.values()))
+        cached.update({
+            cache_key: legacy[legacy_key] for cache_key, legacy_key in legacy_keys.items() if legacy_key in legacy
+        })
+
+    results = {}
+    misses = {}
+    for input_text, (cache_key, index) in zip(input_texts, resolved):
+        entry = policy.load(cached.get(cache_key))
+        if entry is None:
+            misses.setdefault(cache_key, (input_text, index))
+            continue
+        if entry.is_stale() and not entry.error:
+            get_refresh_executor().submit(
+                get_flight().try_lead,
+                cache_key,
+                lambda cache_key=cache_key, input_text=input_text, entry=entry, index=index:
+                    fetch_entry(cache_key, user_id, input_text, stale=entry, index=index),
+            )
+        results[cache_key] = entry
+
+    if misses:
+        outputs = classify_tasks([(user_id, input_text) for input_text, _ in misses.values()])
+        # One set_many per cache timeout: errors, and a few jittered TTLs for results
+        by_timeout = {}
+        for (cache_key, (_, index)), output in zip(misses.items(), outputs):
+            if isinstance(output, MLBackendError):
+                entry = policy.error_entry(str(output))
+            else:
+                entry = _entry(output)
+            results[cache_key] = entry
+            if isinstance(output, MLBackendError) and not output.cacheable:
+                continue
+            writes = by_timeout.setdefault(policy.batch_timeout(entry), {})
+            writes[cache_key] = entry
+            writes.update(_index_entries(cache_key, entry, index))
+        for timeout, writes in by_timeout.items():
+            get_cache().set_many(writes, timeout)
+
+    outcome = []
+    for cache_key, _ in resolved:
+        entry = results[cache_key]
+        outcome.append(MLBackendError(entry.output) if entry.error else entry.output)
+    return outcome
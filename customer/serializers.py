@@ -5,6 +5,15 @@ class SearchCreate(serializers.Serializer):
     class Meta:
         fields= ['input_text']
 
+class SearchBatchCreate(serializers.Serializer):
+    input_texts = serializers.ListField(
+        child=serializers.CharField(max_length=500),
+        allow_empty=False,
+        max_length=100
+    )
+    class Meta:
+        fields= ['input_texts']
+
 class SearchResponseSerializer(serializers.Serializer):
     output = serializers.JSONField()
 
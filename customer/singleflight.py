@@ -0,0 +1,187 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import Counter
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def incr(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def stats():
+    """Snapshot of the coalescing counters of this process
+
+    leaders: calls that went upstream
+    coalesced_local: callers that shared an in-flight call of this process
+    coalesced_remote: callers served by another process holding the cache lock
+    lock_wait_timeouts: callers that gave up waiting for a remote holder
+    refreshes_skipped: background refreshes dropped because one was running
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent loads of the same key into one call
+
+    Inside a process, callers of the same key wait on the first caller.
+    Across processes and nodes, the first caller takes a short lock in the
+    shared cache and the others poll the cache for the value it stores.
+    """
+
+    def __init__(self, cache, lock_timeout=35, wait_timeout=35, poll_interval=0.05):
+        self.cache = cache
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+
+    def lock_key(self, key):
+        return f"{key}:lock"
+
+    def do(self, key, load):
+        """Return (value, shared); shared is False only for the caller that ran load()"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            incr('coalesced_local')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._do_locked(key, load)
+            return call.result, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _do_locked(self, key, load):
+        token = uuid.uuid4().hex
+        lock_key = self.lock_key(key)
+        if not self.cache.add(lock_key, token, self.lock_timeout):
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                value = self.cache.get(key)
+                if value is not None:
+                    incr('coalesced_remote')
+                    return value, True
+                if self.cache.add(lock_key, token, self.lock_timeout):
+                    break
+            else:
+                incr('lock_wait_timeouts')
+                token = None
+        try:
+            incr('leaders')
+            return load(), False
+        finally:
+            if token is not None and self.cache.get(lock_key) == token:
+                self.cache.delete(lock_key)
+
+    async def ado(self, key, load):
+        """Async variant of do(); load is a coroutine function"""
+        flight_key = (id(asyncio.get_running_loop()), key)
+        future = self._async_calls.get(flight_key)
+        if future is not None:
+            incr('coalesced_local')
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # The leader was cancelled, e.g. by its client disconnecting;
+            # load it ourselves, leading the callers that come after us
+            return await self.ado(key, load)
+
+        future = self._async_calls[flight_key] = asyncio.get_running_loop().create_future()
+        try:
+            result, shared = await self._ado_locked(key, load)
+            future.set_result(result)
+            return result, shared
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieve it so an exception without followers is not reported as unhandled
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._async_calls[flight_key]
+
+    async def _ado_locked(self, key, load):
+        token = uuid.uuid4().hex
+        lock_key = self.lock_key(key)
+        if not await self.cache.aadd(lock_key, token, self.lock_timeout):
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                value = await self.cache.aget(key)
+                if value is not None:
+                    incr('coalesced_remote')
+                    return value, True
+                if await self.cache.aadd(lock_key, token, self.lock_timeout):
+                    break
+            else:
+                incr('lock_wait_timeouts')
+                token = None
+        try:
+            incr('leaders')
+            return await load(), False
+        finally:
+            if token is not None and await self.cache.aget(lock_key) == token:
+                await self.cache.adelete(lock_key)
+
+    def try_lead(self, key, load):
+        """Run load() only if no process holds the lock; for background refreshes"""
+        token = uuid.uuid4().hex
+        lock_key = self.lock_key(key)
+        if not self.cache.add(lock_key, token, self.lock_timeout):
+            incr('refreshes_skipped')
+            return False
+        try:
+            incr('leaders')
+            load()
+            return True
+        finally:
+            if self.cache.get(lock_key) == token:
+                self.cache.delete(lock_key)
+
+    async def atry_lead(self, key, load):
+        """Async variant of try_lead()"""
+        token = uuid.uuid4().hex
+        lock_key = self.lock_key(key)
+        if not await self.cache.aadd(lock_key, token, self.lock_timeout):
+            incr('refreshes_skipped')
+            return False
+        try:
+            incr('leaders')
+            await load()
+            return True
+        finally:
+            if await self.cache.aget(lock_key) == token:
+                await self.cache.adelete(lock_key)
@@ -1,3 +1,865 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import hashlib
+import json
+import threading
+import time
+import weakref
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from backends.cache import TieredCache
+
+from . import ml_client, search, singleflight
+from .keys import KeyNormalizer, bands, hamming, simhash
+from .batching import AsyncMicroBatcher, MicroBatcher
+from .cache_policy import CacheEntry, CachePolicy
+from .ml_client import MLBackendError, MLBackendUnavailable
+from .resilience import (
+    Bulkhead,
+    BulkheadFullError,
+    CircuitBreaker,
+    CircuitOpenError,
+    Guard,
+    RetryBudget,
+    make_retry,
+)
+
+
+class SearchCacheMixin:
+    def setUp(self):
+        search.get_cache().clear()
+        # Module-level singletons are built from settings on first use
+        for name in ('_normalizer', '_flight', '_policy'):
+            patcher = mock.patch.object(search, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(search.get_cache().clear)
+
+
+class LegacyKeyTests(SearchCacheMixin, SimpleTestCase):
+    text = "  What is the Capital of France?"
+
+    def setUp(self):
+        super().setUp()
+        self.raw_key = f"search_api_{hashlib.md5(self.text.encode()).hexdigest()}"
+        entry = search.get_policy().entry({"answer": "Paris"})
+        search.get_cache().set(self.raw_key, entry, 60)
+
+    def test_keys_differ(self):
+        self.assertNotEqual(search.search_cache_key(self.text), self.raw_key)
+        self.assertEqual(search.legacy_cache_key(self.text), self.raw_key)
+        self.assertIsNone(search.legacy_cache_key("already normalized"))
+
+    def test_search_serves_legacy_entry(self):
+        with mock.patch.object(search, 'classify') as classify:
+            self.assertEqual(search.search(1, self.text), ({"answer": "Paris"}, False))
+        classify.assert_not_called()
+
+    def test_search_many_serves_legacy_entry(self):
+        with mock.patch.object(search, 'classify_tasks', return_value=[{"answer": "?"}]) as classify_tasks:
+            outcome = search.search_many(1, [self.text, "something else"])
+        self.assertEqual(outcome, [{"answer": "Paris"}, {"answer": "?"}])
+        classify_tasks.assert_called_once_with([(1, "something else")])
+
+    def test_legacy_keys_off(self):
+        with override_settings(SEARCH_CACHE={'LEGACY_KEYS': False}), \
+                mock.patch.object(search, 'classify', return_value={"answer": "new"}) as classify:
+            self.assertEqual(search.search(1, self.text), ({"answer": "new"}, True))
+        classify.assert_called_once()
+
+
+class CachePolicyTests(SimpleTestCase):
+    policy = CachePolicy(soft_ttl=60, hard_ttl=600, negative_ttl=5)
+
+    def test_fresh_then_stale_until_hard_ttl(self):
+        entry = self.policy.entry({"answer": 1})
+        self.assertFalse(entry.error)
+        self.assertIsNotNone(entry.version)
+        self.assertFalse(entry.is_stale())
+        self.assertTrue(entry.is_stale(now=time.time() + 61))
+        self.assertAlmostEqual(self.policy.timeout(entry), 600, delta=1)
+
+    def test_jitter_only_shortens(self):
+        policy = CachePolicy(soft_ttl=60, hard_ttl=600, negative_ttl=5, jitter=0.1)
+        now = time.time()
+        for _ in range(20):
+            entry = policy.entry({})
+            self.assertTrue(now + 54 <= entry.fresh_until <= time.time() + 60)
+            self.assertTrue(now + 540 <= entry.expires_at <= time.time() + 600)
+
+    def test_soft_ttl_must_not_exceed_hard_ttl(self):
+        with self.assertRaises(ValueError):
+            CachePolicy(soft_ttl=600, hard_ttl=60, negative_ttl=5)
+
+    def test_error_entry_is_short_lived(self):
+        entry = self.policy.error_entry("HTTP 503")
+        self.assertTrue(entry.error)
+        self.assertIsNone(entry.version)
+        self.assertLessEqual(self.policy.timeout(entry), 5)
+
+    def test_deferred_keeps_stale_entry_until_next_attempt(self):
+        stale = self.policy.entry({"answer": 1})
+        stale.fresh_until = time.time() - 1
+        entry = self.policy.deferred(stale)
+        self.assertEqual((entry.output, entry.version, entry.expires_at), (stale.output, stale.version, stale.expires_at))
+        self.assertFalse(entry.is_stale())
+        self.assertTrue(entry.is_stale(now=time.time() + 6))
+
+    def test_batch_timeout_rounds_up_to_a_jittered_ttl(self):
+        policy = CachePolicy(soft_ttl=60, hard_ttl=600, negative_ttl=5, jitter=0.1)
+        entry = policy.entry({})
+        timeouts = set()
+        for remaining in (530, 540, 555, 590, 600):
+            entry.expires_at = time.time() + remaining
+            timeouts.add(policy.batch_timeout(entry))
+            self.assertGreaterEqual(policy.batch_timeout(entry), policy.timeout(entry))
+        self.assertEqual(timeouts, {540, 560, 600})
+        self.assertEqual(policy.batch_timeout(policy.error_entry("HTTP 503")), 5)
+        self.assertEqual(self.policy.batch_timeout(self.policy.entry({})), 600)
+
+    def test_load(self):
+        self.assertIsNone(self.policy.load(None))
+        entry = self.policy.entry({})
+        self.assertIs(self.policy.load(entry), entry)
+        # A bare output cached before entries existed
+        legacy = self.policy.load({"answer": 1})
+        self.assertIsInstance(legacy, CacheEntry)
+        self.assertEqual(legacy.output, {"answer": 1})
+        self.assertFalse(legacy.is_stale())
+
+
+class StaleWhileRevalidateTests(SearchCacheMixin, SimpleTestCase):
+    text = "stale question"
+
+    def setUp(self):
+        super().setUp()
+        # Refreshes run inline instead of on the background pool
+        executor = mock.Mock(submit=lambda fn, *args: fn(*args))
+        patcher = mock.patch.object(search, 'get_refresh_executor', return_value=executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cache_stale(self, output):
+        entry = search.get_policy().entry(output)
+        entry.fresh_until = time.time() - 1
+        key, _ = search.resolve_cache_key(self.text)
+        search.get_cache().set(key, entry, 600)
+        return key
+
+    def test_stale_entry_served_while_refreshed(self):
+        key = self.cache_stale({"answer": "old"})
+        with mock.patch.object(search, 'classify', return_value={"answer": "new"}) as classify:
+            self.assertEqual(search.search(1, self.text), ({"answer": "old"}, False))
+        classify.assert_called_once()
+        entry = search.get_cache().get(key)
+        self.assertEqual(entry.output, {"answer": "new"})
+        self.assertFalse(entry.is_stale())
+
+    def test_failed_refresh_keeps_stale_entry(self):
+        key = self.cache_stale({"answer": "old"})
+        with mock.patch.object(search, 'classify', side_effect=MLBackendError("HTTP 503", retryable=True)):
+            self.assertEqual(search.search(1, self.text), ({"answer": "old"}, False))
+        entry = search.get_cache().get(key)
+        self.assertEqual(entry.output, {"answer": "old"})
+        self.assertFalse(entry.is_stale())
+        with mock.patch.object(search, 'classify') as classify:
+            self.assertEqual(search.search(1, self.text), ({"answer": "old"}, False))
+        classify.assert_not_called()
+
+    def test_failure_cached_negatively(self):
+        with mock.patch.object(search, 'classify', side_effect=MLBackendError("HTTP 503", retryable=True)) as classify:
+            for _ in range(3):
+                with self.assertRaisesMessage(MLBackendError, "HTTP 503"):
+                    search.search(1, self.text)
+        classify.assert_called_once()
+
+    def test_rejected_call_not_cached(self):
+        with mock.patch.object(search, 'classify', side_effect=MLBackendUnavailable("circuit open")) as classify:
+            for _ in range(2):
+                with self.assertRaises(MLBackendUnavailable):
+                    search.search(1, self.text)
+        self.assertEqual(classify.call_count, 2)
+
+
+class SearchETagTests(SearchCacheMixin, SimpleTestCase):
+    def get(self, url, **headers):
+        return self.client.get(url, {"input_text": "etag question"}, **headers)
+
+    def assertNotModifiedOnRepeat(self, url):
+        with mock.patch.object(search, 'classify', return_value={"answer": 42}), \
+                mock.patch.object(search, 'aclassify', return_value={"answer": 42}):
+            response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"output": {"answer": 42}})
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"search-'))
+        with mock.patch.object(search, 'classify') as classify, mock.patch.object(search, 'aclassify') as aclassify:
+            response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH='W/"search-other"').status_code, 200)
+        classify.assert_not_called()
+        aclassify.assert_not_called()
+
+    def test_search(self):
+        self.assertNotModifiedOnRepeat('/api/search/')
+
+    def test_async_search(self):
+        self.assertNotModifiedOnRepeat('/api/search/async/')
+
+    def test_post_is_never_not_modified(self):
+        with mock.patch.object(search, 'classify', return_value={"answer": 42}):
+            etag = self.get('/api/search/')['ETag']
+            response = self.client.post(
+                '/api/search/', {"input_text": "etag question"},
+                content_type='application/json', HTTP_IF_NONE_MATCH=etag,
+            )
+        self.assertEqual(response.status_code, 200)
+
+
+class KeyNormalizerTests(SimpleTestCase):
+    normalize = KeyNormalizer()
+
+    def test_variants_collapse_to_one_key(self):
+        variants = [
+            "What is the capital of France?",
+            "  what IS the\tcapital of   France ",
+            "WHAT is the capital of france!!",
+            # Fullwidth letters and a non-breaking space, folded by NFKC
+            "Ｗｈａｔ is the capital\u00a0of France?",
+        ]
+        self.assertEqual({self.normalize(text) for text in variants}, {"what is the capital of france"})
+        self.assertEqual(len({search.search_cache_key(text) for text in variants}), 1)
+
+    def test_casefold_and_compatibility_forms(self):
+        self.assertEqual(self.normalize("STRASSE"), self.normalize("Straße"))
+        self.assertEqual(self.normalize("ﬁle №1"), "file no1")
+
+    def test_custom_steps(self):
+        self.assertEqual(KeyNormalizer(['customer.keys.casefold'])("  A  B "), "  a  b ")
+
+
+@override_settings(SEARCH_CACHE={**settings.SEARCH_CACHE, 'SIMHASH': True})
+class SimilarKeyTests(SearchCacheMixin, SimpleTestCase):
+    text = (
+        "please classify this support ticket about a refund for a damaged blender that arrived late "
+        "last week and the courier left it outside in the rain so the box was soaked through"
+    )
+    near = text.replace("late last week", "late the week")
+    distant = "how do I reset the password of my account on the mobile app"
+
+    def signature(self, text):
+        return simhash(KeyNormalizer()(text))
+
+    def test_signatures(self):
+        self.assertLessEqual(hamming(self.signature(self.text), self.signature(self.near)), 3)
+        self.assertTrue(set(bands(self.signature(self.text))) & set(bands(self.signature(self.near))))
+        self.assertGreater(hamming(self.signature(self.text), self.signature(self.distant)), 3)
+
+    def test_near_duplicate_reuses_entry(self):
+        with mock.patch.object(search, 'classify', return_value={"answer": "refund"}) as classify:
+            self.assertEqual(search.search(1, self.text), ({"answer": "refund"}, True))
+            self.assertEqual(search.search(1, self.near), ({"answer": "refund"}, False))
+        classify.assert_called_once()
+        self.assertEqual(search.resolve_cache_key(self.near)[0], search.search_cache_key(self.text))
+
+    def test_distant_text_gets_own_entry(self):
+        with mock.patch.object(search, 'classify', return_value={"answer": "refund"}):
+            search.search(1, self.text)
+        with mock.patch.object(search, 'classify', return_value={"answer": "password"}) as classify:
+            self.assertEqual(search.search(1, self.distant), ({"answer": "password"}, True))
+        classify.assert_called_once()
+
+    @override_settings(SEARCH_CACHE={**settings.SEARCH_CACHE, 'SIMHASH': True, 'SIMHASH_MAX_DISTANCE': 0})
+    def test_max_distance(self):
+        with mock.patch.object(search, 'classify', return_value={"answer": "refund"}) as classify:
+            search.search(1, self.text)
+            search.search(1, self.near)
+        self.assertEqual(classify.call_count, 2)
+
+
+class SearchManyTests(SearchCacheMixin, SimpleTestCase):
+    def test_misses_written_with_one_set_many_per_timeout(self):
+        texts = [f"question {i}" for i in range(6)]
+        outputs = [{"answer": i} if i % 3 else MLBackendError("HTTP 503", retryable=True) for i in range(6)]
+        cache = search.get_cache()
+        with mock.patch.object(search, 'classify_tasks', return_value=outputs), \
+                mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            outcome = search.search_many(1, texts)
+        self.assertEqual([isinstance(item, MLBackendError) for item in outcome], [True, False, False] * 2)
+        policy = search.get_policy()
+        writes = {timeout: data for (data, timeout), _ in set_many.call_args_list}
+        self.assertEqual(len(set_many.call_args_list), len(writes))
+        self.assertEqual(len(writes.pop(policy.negative_ttl)), 2)
+        self.assertLessEqual(len(writes), 4)
+        self.assertEqual(sum(len(data) for data in writes.values()), 4)
+        for timeout, data in writes.items():
+            self.assertGreaterEqual(timeout, policy.hard_ttl * (1 - policy.jitter))
+            for entry in data.values():
+                self.assertGreaterEqual(timeout, policy.timeout(entry))
+        with mock.patch.object(search, 'classify_tasks') as classify_tasks:
+            self.assertEqual(search.search_many(1, texts)[1:3], [{"answer": 1}, {"answer": 2}])
+        classify_tasks.assert_not_called()
+
+    def test_batch_endpoint_keeps_input_order(self):
+        with mock.patch.object(search, 'classify', return_value={"answer": "hit"}):
+            search.search(None, "cached question")
+        outputs = [{"answer": "miss"}, MLBackendError("HTTP 503", retryable=True)]
+        with mock.patch.object(search, 'classify_tasks', return_value=outputs) as classify_tasks:
+            response = self.client.post('/api/search/batch/', {
+                "input_texts": ["new question", "cached question", "failing question", "New Question?"],
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        classify_tasks.assert_called_once_with([(None, "new question"), (None, "failing question")])
+        self.assertEqual(response.json()["results"], [
+            {"input_text": "new question", "output": {"answer": "miss"}},
+            {"input_text": "cached question", "output": {"answer": "hit"}},
+            {"input_text": "failing question", "error": "Search is temporarily unavailable"},
+            {"input_text": "New Question?", "output": {"answer": "miss"}},
+        ])
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+
+    def send(self, items):
+        self.batches.append(items)
+        return [{"answer": task} if task != "bad" else MLBackendError("HTTP 422") for _, task in items]
+
+    def classify_from_threads(self, batcher, tasks):
+        results = {}
+
+        def classify(task):
+            try:
+                results[task] = batcher.classify(1, task)
+            except MLBackendError as e:
+                results[task] = e
+        threads = [threading.Thread(target=classify, args=(task,)) for task in tasks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_flushes_when_full(self):
+        batcher = MicroBatcher(self.send, max_batch_size=3, max_wait=10)
+        start = time.monotonic()
+        results = self.classify_from_threads(batcher, ["a", "b", "c"])
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(results, {task: {"answer": task} for task in "abc"})
+        self.assertEqual(len(self.batches), 1)
+
+    def test_flushes_after_max_wait(self):
+        batcher = MicroBatcher(self.send, max_batch_size=100, max_wait=0.05)
+        results = self.classify_from_threads(batcher, ["a", "bad"])
+        self.assertEqual(results["a"], {"answer": "a"})
+        self.assertIsInstance(results["bad"], MLBackendError)
+        self.assertEqual(sorted(task for batch in self.batches for _, task in batch), ["a", "bad"])
+
+    def test_send_failure_reaches_every_caller(self):
+        batcher = MicroBatcher(mock.Mock(side_effect=RuntimeError("boom")), max_batch_size=2, max_wait=10)
+        results = self.classify_from_threads(batcher, ["a", "b"])
+        self.assertEqual([str(results[task]) for task in "ab"], ["boom", "boom"])
+
+    async def test_async_flushes_when_full(self):
+        async def send(items):
+            return self.send(items)
+        batcher = AsyncMicroBatcher(send, max_batch_size=3, max_wait=10)
+        results = await asyncio.wait_for(asyncio.gather(*(batcher.classify(1, task) for task in "abc")), 1)
+        self.assertEqual(results, [{"answer": task} for task in "abc"])
+        self.assertEqual(len(self.batches), 1)
+
+    async def test_async_flushes_after_max_wait(self):
+        async def send(items):
+            return self.send(items)
+        batcher = AsyncMicroBatcher(send, max_batch_size=100, max_wait=0.01)
+        results = await asyncio.gather(batcher.classify(1, "a"), batcher.classify(1, "bad"), return_exceptions=True)
+        self.assertEqual(results[0], {"answer": "a"})
+        self.assertIsInstance(results[1], MLBackendError)
+        self.assertEqual(self.batches, [[(1, "a"), (1, "bad")]])
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = LocMemCache('singleflight-tests', {})
+        self.addCleanup(self.cache.clear)
+        self.flight = singleflight.SingleFlight(self.cache, lock_timeout=5, wait_timeout=1, poll_interval=0.01)
+
+    def wait_for(self, stat, count):
+        deadline = time.monotonic() + 5
+        while singleflight.stats().get(stat, 0) < count:
+            self.assertLess(time.monotonic(), deadline, f"{stat} never reached {count}")
+            time.sleep(0.001)
+
+    def run_concurrently(self, load, callers=4):
+        """Run do() from callers threads, releasing load once the others wait on it"""
+        release = threading.Event()
+        outcomes = []
+
+        def gated():
+            release.wait(5)
+            return load()
+
+        def call():
+            try:
+                outcomes.append(self.flight.do('k', gated))
+            except Exception as e:
+                outcomes.append(e)
+        waiting = singleflight.stats().get('coalesced_local', 0) + callers - 1
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        self.wait_for('coalesced_local', waiting)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_callers_share_one_load(self):
+        load = mock.Mock(return_value='value')
+        outcomes = self.run_concurrently(load)
+        load.assert_called_once()
+        self.assertEqual(sorted(outcomes), [('value', False)] + [('value', True)] * 3)
+        self.assertIsNone(self.cache.get(self.flight.lock_key('k')))
+
+    def test_error_reaches_every_caller(self):
+        error = ValueError("upstream")
+        outcomes = self.run_concurrently(mock.Mock(side_effect=error))
+        self.assertEqual(outcomes, [error] * 4)
+        self.assertIsNone(self.cache.get(self.flight.lock_key('k')))
+
+    def test_waits_for_value_stored_by_lock_holder(self):
+        self.cache.add(self.flight.lock_key('k'), 'other process')
+        threading.Timer(0.05, self.cache.set, ('k', 'remote value')).start()
+        load = mock.Mock()
+        self.assertEqual(self.flight.do('k', load), ('remote value', True))
+        load.assert_not_called()
+
+    def test_loads_once_lock_holder_gives_up(self):
+        self.cache.add(self.flight.lock_key('k'), 'other process')
+        threading.Timer(0.05, self.cache.delete, (self.flight.lock_key('k'),)).start()
+        self.assertEqual(self.flight.do('k', lambda: 'value'), ('value', False))
+        self.assertIsNone(self.cache.get(self.flight.lock_key('k')))
+
+    def test_loads_after_wait_timeout_without_taking_lock(self):
+        self.cache.add(self.flight.lock_key('k'), 'other process')
+        timeouts = singleflight.stats().get('lock_wait_timeouts', 0)
+        self.flight.wait_timeout = 0.05
+        self.assertEqual(self.flight.do('k', lambda: 'value'), ('value', False))
+        self.assertEqual(singleflight.stats()['lock_wait_timeouts'], timeouts + 1)
+        self.assertEqual(self.cache.get(self.flight.lock_key('k')), 'other process')
+
+    def test_try_lead(self):
+        load = mock.Mock()
+        self.assertTrue(self.flight.try_lead('k', load))
+        self.assertIsNone(self.cache.get(self.flight.lock_key('k')))
+        self.cache.add(self.flight.lock_key('k'), 'other process')
+        self.assertFalse(self.flight.try_lead('k', load))
+        load.assert_called_once()
+
+    async def test_async_callers_share_one_load(self):
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'value'
+        outcomes = await asyncio.gather(*(self.flight.ado('k', load) for _ in range(4)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(outcomes), [('value', False)] + [('value', True)] * 3)
+        self.assertIsNone(await self.cache.aget(self.flight.lock_key('k')))
+
+    async def test_async_error_reaches_every_caller(self):
+        async def load():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream")
+        outcomes = await asyncio.gather(*(self.flight.ado('k', load) for _ in range(3)), return_exceptions=True)
+        self.assertEqual([type(outcome) for outcome in outcomes], [ValueError] * 3)
+
+    async def test_async_followers_take_over_from_cancelled_leader(self):
+        started = asyncio.Event()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            if len(calls) == 1:
+                started.set()
+                await asyncio.sleep(10)
+            return 'value'
+        leader = asyncio.create_task(self.flight.ado('k', load))
+        await started.wait()
+        followers = [asyncio.create_task(self.flight.ado('k', load)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        outcomes = await asyncio.wait_for(asyncio.gather(*followers), 1)
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(outcomes), [('value', False)] + [('value', True)] * 2)
+        self.assertIsNone(await self.cache.aget(self.flight.lock_key('k')))
+
+
+@override_settings(ML_BACKEND={**settings.ML_BACKEND, 'BATCH_PATH': None, 'MAX_CONCURRENT': 3, 'RETRY_ATTEMPTS': 1})
+class FanOutTests(SimpleTestCase):
+    def setUp(self):
+        # Built from settings on first use
+        for name, value in (('_guard', None), ('_fanout_executor', None), ('_fanout_semaphores', weakref.WeakKeyDictionary())):
+            patcher = mock.patch.object(ml_client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.items = [(1, f"task {i}") for i in range(10)]
+        self.expected = [{"answer": task} for _, task in self.items]
+        self.peak = self.in_flight = 0
+
+    def track(self, delta):
+        self.in_flight += delta
+        self.peak = max(self.peak, self.in_flight)
+
+    def test_batch_larger_than_bulkhead(self):
+        lock = threading.Lock()
+
+        def post(path, payload):
+            with lock:
+                self.track(1)
+            time.sleep(0.01)
+            with lock:
+                self.track(-1)
+            return {"answer": json.loads(payload)["task"]}
+
+        with mock.patch.object(ml_client, '_post', side_effect=post):
+            self.assertEqual(ml_client.classify_tasks(self.items), self.expected)
+        self.assertEqual(self.peak, 3)
+
+    async def test_async_batch_larger_than_bulkhead(self):
+        async def apost(path, payload):
+            self.track(1)
+            await asyncio.sleep(0.01)
+            self.track(-1)
+            return {"answer": json.loads(payload)["task"]}
+
+        with mock.patch.object(ml_client, '_apost', side_effect=apost):
+            self.assertEqual(await ml_client.aclassify_tasks(self.items), self.expected)
+        self.assertEqual(self.peak, 3)
+
+
+class StubResponse:
+    """requests and aiohttp response stand-in"""
+
+    def __init__(self, status, body=b'{"answer": 1}'):
+        self.status = self.status_code = status
+        self.ok = status < 400
+        self.body = body
+
+    def json(self, content_type=None):
+        return json.loads(self.body)
+
+
+class StubAsyncSession:
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.calls = []
+
+    def post(self, url, data):
+        self.calls.append(url)
+        return self._post()
+
+    @contextlib.asynccontextmanager
+    async def _post(self):
+        if isinstance(self.outcome, BaseException):
+            raise self.outcome
+        response = mock.Mock(status=self.outcome.status, ok=self.outcome.ok)
+        response.json = mock.AsyncMock(side_effect=self.outcome.json)
+        yield response
+
+
+@override_settings(ML_BACKEND={
+    **settings.ML_BACKEND, 'URI': 'http://ml.test', 'CONNECT_TIMEOUT': 2, 'READ_TIMEOUT': 7, 'RETRY_ATTEMPTS': 1,
+})
+class MLClientTests(SimpleTestCase):
+    def setUp(self):
+        for name, value in (('_guard', None), ('_sync_session', None), ('_async_sessions', weakref.WeakKeyDictionary())):
+            patcher = mock.patch.object(ml_client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post_answering(self, outcome):
+        session = ml_client.get_sync_session()
+        return mock.patch.object(session, 'post', side_effect=[outcome] if isinstance(outcome, BaseException) else None,
+                                 return_value=outcome)
+
+    def test_session_reused_with_sized_pool(self):
+        session = ml_client.get_sync_session()
+        self.assertIs(ml_client.get_sync_session(), session)
+        self.assertEqual(session.get_adapter('http://ml.test')._pool_maxsize, settings.ML_BACKEND['POOL_SIZE'])
+
+    def test_timeouts_passed_to_requests(self):
+        with self.post_answering(StubResponse(200)) as post:
+            self.assertEqual(ml_client.classify_task(1, "task"), {"answer": 1})
+        self.assertEqual(post.call_args.kwargs['url'], 'http://ml.test/classify-task')
+        self.assertEqual(post.call_args.kwargs['timeout'], (2, 7))
+        self.assertEqual(json.loads(post.call_args.kwargs['data']), {"user_id": "1", "task": "task"})
+
+    def test_errors_mapped(self):
+        import requests
+
+        for outcome, retryable in (
+            (requests.ConnectTimeout("connect timed out"), True),
+            (requests.ReadTimeout("read timed out"), True),
+            (requests.ConnectionError("refused"), True),
+            (StubResponse(503), True),
+            (StubResponse(422), False),
+            (StubResponse(200, b'not json'), False),
+        ):
+            with self.subTest(outcome=outcome), self.post_answering(outcome):
+                with self.assertRaises(MLBackendError) as raised:
+                    ml_client.classify_task(1, "task")
+                self.assertEqual(raised.exception.retryable, retryable)
+                self.assertNotIsInstance(raised.exception, MLBackendUnavailable)
+                ml_client.get_guard().breaker.record_success()
+
+    def test_rejected_calls_unavailable(self):
+        ml_client.get_guard().breaker.state = CircuitBreaker.OPEN
+        ml_client.get_guard().breaker._opened_at = time.monotonic()
+        with self.post_answering(StubResponse(200)) as post, self.assertRaises(MLBackendUnavailable) as raised:
+            ml_client.classify_task(1, "task")
+        post.assert_not_called()
+        self.assertFalse(raised.exception.cacheable)
+
+    @override_settings(ML_BACKEND={**settings.ML_BACKEND, 'URI': None})
+    def test_uri_required_on_first_call(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ml_client.classify_task(1, "task")
+
+    async def test_async_session_per_loop(self):
+        session = ml_client.get_async_session()
+        self.assertIs(ml_client.get_async_session(), session)
+        self.assertEqual(session.timeout.sock_connect, 2)
+        self.assertEqual(session.timeout.sock_read, 7)
+        await ml_client.close_async_session()
+        self.assertTrue(session.closed)
+        replacement = ml_client.get_async_session()
+        self.assertIsNot(replacement, session)
+        await ml_client.close_async_session()
+
+    async def test_async_errors_mapped(self):
+        import aiohttp
+
+        for outcome, retryable in (
+            (asyncio.TimeoutError(), True),
+            (aiohttp.ClientConnectionError("refused"), True),
+            (StubResponse(502), True),
+            (StubResponse(404), False),
+            (StubResponse(200, b'<html>'), False),
+        ):
+            session = StubAsyncSession(outcome)
+            with self.subTest(outcome=outcome), mock.patch.object(ml_client, 'get_async_session', return_value=session):
+                with self.assertRaises(MLBackendError) as raised:
+                    await ml_client.aclassify_task(1, "task")
+                self.assertEqual(raised.exception.retryable, retryable)
+                self.assertEqual(session.calls, ['http://ml.test/classify-task'])
+                ml_client.get_guard().breaker.record_success()
+
+    async def test_async_success(self):
+        session = StubAsyncSession(StubResponse(200))
+        with mock.patch.object(ml_client, 'get_async_session', return_value=session):
+            self.assertEqual(await ml_client.aclassify_task(1, "task"), {"answer": 1})
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+        for _ in range(2):
+            breaker.record_failure()
+        breaker.record_success()
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30, half_open_calls=1)
+        breaker.record_failure()
+        with mock.patch('customer.resilience.time.monotonic', return_value=breaker._opened_at + 31):
+            self.assertTrue(breaker.allow())
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertFalse(breaker.allow())
+            breaker.record_failure()
+            self.assertFalse(breaker.allow())
+        with mock.patch('customer.resilience.time.monotonic', return_value=breaker._opened_at + 31):
+            self.assertTrue(breaker.allow())
+            breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+
+class RetryBudgetTests(SimpleTestCase):
+    def test_retries_capped_by_ratio_of_requests(self):
+        budget = RetryBudget(ratio=0.1, min_per_second=0, window=10)
+        for _ in range(30):
+            budget.record_request()
+        self.assertEqual(sum(budget.try_spend() for _ in range(10)), 3)
+
+    def test_old_requests_forgotten_without_retries(self):
+        budget = RetryBudget(window=10)
+        with mock.patch('customer.resilience.time.monotonic', return_value=0):
+            for _ in range(100):
+                budget.record_request()
+        with mock.patch('customer.resilience.time.monotonic', return_value=11):
+            budget.record_request()
+        self.assertEqual(len(budget._requests), 1)
+
+    def test_minimum_for_quiet_processes(self):
+        budget = RetryBudget(ratio=0.1, min_per_second=1, window=2)
+        self.assertEqual(sum(budget.try_spend() for _ in range(5)), 2)
+
+
+class GuardTests(SimpleTestCase):
+    def setUp(self):
+        self.guard = Guard(
+            breaker=CircuitBreaker(failure_threshold=2, recovery_timeout=30),
+            bulkhead=Bulkhead(2),
+            budget=RetryBudget(ratio=1, min_per_second=10),
+            retry=make_retry(attempts=3, start_timeout=0.001, max_timeout=0.001, jitter=0),
+            is_retryable=lambda e: getattr(e, 'retryable', False),
+        )
+
+    def failing(self, error):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            raise error
+        return fn, calls
+
+    def test_backend_faults_retried_and_open_circuit(self):
+        fn, calls = self.failing(MLBackendError("HTTP 503", retryable=True))
+        for _ in range(2):
+            with self.assertRaises(MLBackendError):
+                self.guard.call(fn)
+        self.assertEqual(len(calls), 6)
+        with self.assertRaises(CircuitOpenError):
+            self.guard.call(fn)
+        self.assertEqual(len(calls), 6)
+
+    def test_client_errors_do_not_open_circuit(self):
+        fn, calls = self.failing(MLBackendError("HTTP 422"))
+        for _ in range(5):
+            with self.assertRaises(MLBackendError):
+                self.guard.call(fn)
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(self.guard.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.guard.call(lambda: "ok"), "ok")
+
+    def test_client_error_ends_half_open_probe(self):
+        breaker = self.guard.breaker
+        breaker.state, breaker._opened_at = CircuitBreaker.OPEN, 0
+        with self.assertRaises(MLBackendError):
+            self.guard.call(self.failing(MLBackendError("HTTP 400"))[0])
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_async_client_errors_do_not_open_circuit(self):
+        async def fn():
+            raise MLBackendError("Expecting value")
+        for _ in range(3):
+            with self.assertRaises(MLBackendError):
+                await self.guard.acall(fn)
+        self.assertEqual(self.guard.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_bulkhead_rejects_when_full(self):
+        self.guard.bulkhead.in_flight = 2
+        with self.assertRaises(BulkheadFullError):
+            self.guard.call(lambda: "ok")
+
+
+@override_settings(CACHES={
+    **settings.CACHES,
+    'tiered-remote': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-remote'},
+})
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        # Local tiers are per process and location; each test gets its own
+        self.cache = TieredCache(self.id(), {'OPTIONS': {
+            'REMOTE': 'tiered-remote', 'LOCAL_TIMEOUT': 5, 'MAX_ENTRIES': 3, 'MAX_SIZE': 1024,
+        }})
+        self.addCleanup(self.cache.clear)
+
+    def cached_locally(self):
+        return [key.rsplit(':', 1)[-1] for key in self.cache._local]
+
+    def test_reads_fill_local_tier(self):
+        self.cache.remote.set('k', 'v')
+        self.assertEqual(self.cache.get('k'), 'v')
+        self.cache.remote.delete('k')
+        self.assertEqual(self.cache.get('k'), 'v')
+        stats = self.cache.stats()
+        self.assertEqual((stats['remote_hits'], stats['local_hits'], stats['local_entries']), (1, 1, 1))
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.cache.stats()['remote_misses'], 1)
+
+    def test_local_entries_expire_after_local_timeout(self):
+        self.cache.set('k', 'v', 60)
+        self.cache.remote.set('k', 'changed')
+        later = time.monotonic() + 6
+        with mock.patch('backends.cache.time.monotonic', return_value=later):
+            self.assertEqual(self.cache.get('k'), 'changed')
+
+    def test_least_recently_used_evicted(self):
+        for key in 'abc':
+            self.cache.set(key, key)
+        self.cache.get('a')
+        self.cache.set('d', 'd')
+        self.assertEqual(self.cached_locally(), ['c', 'a', 'd'])
+        self.assertEqual(self.cache.stats()['local_evictions'], 1)
+        # Still in the remote tier
+        self.assertEqual(self.cache.get('b'), 'b')
+
+    def test_size_bounded(self):
+        self.cache.set('big', 'x' * 2048)
+        self.assertEqual(self.cached_locally(), [])
+        self.assertEqual(self.cache.get('big'), 'x' * 2048)
+        for key in 'abc':
+            self.cache.set(key, 'x' * 400)
+        self.assertEqual(self.cached_locally(), ['b', 'c'])
+        self.assertLessEqual(self.cache.stats()['local_size'], 1024)
+
+    def test_writes_through_and_invalidate_local(self):
+        self.cache.set('k', 'v')
+        self.assertEqual(self.cache.remote.get('k'), 'v')
+        self.cache.delete('k')
+        self.assertIsNone(self.cache.remote.get('k'))
+        self.assertIsNone(self.cache.get('k'))
+        self.cache.set('k', 'v')
+        self.cache.remote.delete('k')
+        self.assertTrue(self.cache.add('k', 'added'))
+        self.assertEqual(self.cache.get('k'), 'added')
+        self.assertFalse(self.cache.add('k', 'again'))
+
+    def test_get_many(self):
+        self.cache.set('a', 1)
+        self.cache.remote.set('b', 2)
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        self.assertEqual(sorted(self.cached_locally()), ['a', 'b'])
+
+    def test_lock_keys_read_from_remote(self):
+        self.assertTrue(self.cache.add('k:lock', 'first'))
+        self.assertEqual(self.cache.get('k:lock'), 'first')
+        # Another process takes over the lock once this one's expired
+        self.cache.remote.set('k:lock', 'second')
+        self.assertEqual(self.cache.get('k:lock'), 'second')
+        self.assertTrue(self.cache.has_key('k:lock'))
+        self.cache.remote.delete('k:lock')
+        self.assertFalse(self.cache.has_key('k:lock'))
+        self.assertEqual(self.cached_locally(), [])
+
+    def test_clear(self):
+        self.cache.set('k', 'v')
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['local_size'], 0)
+        self.assertIsNone(self.cache.get('k'))
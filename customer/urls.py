@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path 
 from rest_framework import routers
 from . import views
@@ -6,5 +7,14 @@ from . import views
 #router.register('search', views.SearchAPI, basename='search')
 
 urlpatterns = [
-    path('search/', views.SearchAPI.as_view(), name='search')
-]
\ No newline at end of file
+    path('search/', views.SearchAPI.as_view(), name='search'),
+    path('search/batch/', views.SearchBatchAPI.as_view(), name='search-batch'),
+    path('search/stats/', views.SearchStatsAPI.as_view(), name='search-stats'),
+    path('search/async/', views.AsyncSearchAPI.as_view(), name='search-async'),
+]
+
+if settings.ASYNC_VIEWS:
+    # Matched before SearchAPI
+    urlpatterns = [
+        path('search/', views.AsyncSearchAPI.as_view(), name='search'),
+    ] + urlpatterns
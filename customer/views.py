@@ -1,56 +1,140 @@
 from rest_framework.views import APIView
 from rest_framework import permissions, status
-from .serializers import SearchCreate,SearchResponseSerializer
-from dotenv import load_dotenv
-import os
+from .serializers import SearchCreate,SearchBatchCreate,SearchResponseSerializer
+from .search import search_entry, asearch_entry, search_many, get_cache, render
+from .ml_client import MLBackendError, get_guard
+from . import singleflight
+from backends import http
+from backends.views import AsyncAPIView
 import json
-import requests
+import logging
 from rest_framework.response import Response
-from django.core.cache import cache
-import hashlib
-load_dotenv()
+from django.http import JsonResponse
 
+logger = logging.getLogger(__name__)
 
-URI= os.environ['ML_BACKEND_URI']
-headers = {
-  'Content-Type': 'application/json'
-}
+
+def search_response(request, entry, created):
+    """Response for a search result from its pre-rendered bodies
+
+    GETs whose If-None-Match matches the entry's version get a 304 right
+    after the cache read. Entries cached without rendered bodies are
+    rendered here.
+    """
+    etag = f'W/"search-{entry.version}"' if entry.version else None
+    response = http.not_modified(request, etag)
+    if response is not None:
+        return response
+    created = created and request.method == 'POST'
+    return http.encoded_response(
+        request,
+        entry.rendered or render(entry.output),
+        etag=etag,
+        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+    )
 
 
 class SearchAPI(APIView):
+    """Classify a task; POST it as JSON, or GET it with ?input_text= to use ETags"""
     permission_classes = (permissions.AllowAny,)
+    throttle_scope = 'search'
 
     def post(self, request):
-        serializer= SearchCreate(data=request.data)
+        return self.respond(request, request.data)
+
+    def get(self, request):
+        return self.respond(request, request.query_params)
+
+    def respond(self, request, data):
+        serializer= SearchCreate(data=data)
         serializer.is_valid(raise_exception=True)
         input_text = serializer.validated_data.get("input_text")
-        print(input_text)
+        logger.debug(json.dumps({"event": "search", "input_text": input_text}))
         
-        # Create a unique cache key based on the input text
-        cache_key = f"search_api_{hashlib.md5(input_text.encode()).hexdigest()}"
+        # Served from cache, or from one upstream call shared by identical requests
+        try:
+            entry, created = search_entry(self.request.user.id, input_text)
+        except MLBackendError:
+            return Response(
+                {"detail": "Search is temporarily unavailable"},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
         
-        # Try to get cached response
-        cached_result = cache.get(cache_key)
-        if cached_result:
+        if request.accepted_renderer.format != 'json':
+            # The browsable API renders the result itself
             response_serializer = SearchResponseSerializer({
-                "output": cached_result
+                "output": entry.output
             })
-            return Response(response_serializer.data, status=status.HTTP_200_OK)
-        
-        # If not cached, make the actual API request
-        output = requests.post(
-            url=f"{URI}/classify-task", 
-            headers=headers, 
-            data=json.dumps({
-                "user_id": str(self.request.user.id), 
-                "task": input_text
-            })
-        ).json()
-        
-        # Cache the result for 36 hours (in seconds)
-        cache.set(cache_key, output, 60 * 60 * 36)
-        
-        response_serializer = SearchResponseSerializer({
-            "output": output
+            return Response(
+                response_serializer.data,
+                status=status.HTTP_201_CREATED if created and request.method == 'POST' else status.HTTP_200_OK
+            )
+        return search_response(request, entry, created)
+
+
+class SearchBatchAPI(APIView):
+    """Classify many tasks at once; misses go upstream as one batch"""
+    permission_classes = (permissions.AllowAny,)
+    throttle_scope = 'search_batch'
+
+    def post(self, request):
+        serializer= SearchBatchCreate(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        input_texts = serializer.validated_data.get("input_texts")
+
+        results = []
+        for input_text, output in zip(input_texts, search_many(self.request.user.id, input_texts)):
+            if isinstance(output, MLBackendError):
+                results.append({"input_text": input_text, "error": "Search is temporarily unavailable"})
+            else:
+                results.append({
+                    "input_text": input_text,
+                    **SearchResponseSerializer({"output": output}).data
+                })
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class SearchStatsAPI(APIView):
+    """Request coalescing and search cache counters of this worker process"""
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        search_cache = get_cache()
+        return Response({
+            "singleflight": singleflight.stats(),
+            "cache": search_cache.stats() if hasattr(search_cache, 'stats') else {},
+            "ml_backend": {
+                "circuit": get_guard().breaker.state,
+                "in_flight": get_guard().bulkhead.in_flight,
+            },
         })
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+
+
+class AsyncSearchAPI(AsyncAPIView):
+    """Non-blocking SearchAPI for ASGI deployments
+
+    Mirrors SearchAPI but awaits the ML backend over a pooled aiohttp
+    session, so one worker can keep many classify-task calls in flight.
+    """
+    throttle_scope = 'search'
+
+    async def post(self, request):
+        return await self.respond(request, request.data)
+
+    async def get(self, request):
+        return await self.respond(request, request.GET)
+
+    async def respond(self, request, data):
+        serializer= SearchCreate(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        input_text = serializer.validated_data.get("input_text")
+
+        try:
+            entry, created = await asearch_entry(request.user.id, input_text)
+        except MLBackendError:
+            return JsonResponse(
+                {"detail": "Search is temporarily unavailable"},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
+        return search_response(request, entry, created)
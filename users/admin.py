@@ -1,5 +1,7 @@
 from django.contrib import admin
 
-from .models import User
+from .models import User, OutboxEmail, NewsletterCampaign
 
-admin.site.register(User)
\ No newline at end of file
+admin.site.register(User)
+admin.site.register(OutboxEmail)
+admin.site.register(NewsletterCampaign)
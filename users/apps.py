@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        # Connects the user snapshot invalidation signals
+        from . import auth  # noqa: F401
+        # Registers the deploy checks of the middleware in backends.middleware
+        from backends import checks  # noqa: F401
@@ -0,0 +1,164 @@
+import uuid
+from datetime import date
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from backends.replicas import use_primary
+
+from . import hashing
+
+User = get_user_model()
+
+
+VERSION_KEY = '_version'
+
+
+def snapshot_key(user_id):
+    return f"user_snapshot:{user_id}"
+
+
+def get_cache():
+    return caches[settings.USER_CACHE_ALIAS]
+
+
+def take_snapshot(user):
+    """Concrete column values of user; enough to rebuild it without the DB
+
+    Every snapshot also gets a new version, so one taken after the user
+    changed never has the version of an earlier one.
+    """
+    snapshot = {field.attname: getattr(user, field.attname) for field in User._meta.concrete_fields}
+    snapshot[VERSION_KEY] = uuid.uuid4().hex[:16]
+    return snapshot
+
+
+def from_snapshot(snapshot):
+    snapshot = dict(snapshot)
+    version = snapshot.pop(VERSION_KEY, None)
+    user = User(**snapshot)
+    user._state.adding = False
+    user._state.db = 'default'
+    user.snapshot_version = version
+    # Saving it writes only what the request changed
+    user.mark_clean()
+    return user
+
+
+def user_etag(request):
+    """ETag of the user's own details (users/me), from their snapshot version"""
+    version = getattr(request.user, 'snapshot_version', None)
+    if version is None:
+        return None
+    # age is derived from the date as well as the user's columns
+    return f'W/"user-{request.user.pk}-{version}-{date.today():%Y%m%d}"'
+
+
+def invalidate(user_id):
+    get_cache().delete(snapshot_key(user_id))
+
+
+def invalidate_many(user_ids):
+    get_cache().delete_many([snapshot_key(user_id) for user_id in user_ids])
+
+
+def invalidate_on_commit(user_id):
+    """invalidate() once the current transaction commits (now outside of one)
+
+    Dropped any earlier, a concurrent request could take a new snapshot
+    from the not yet committed, old row.
+    """
+    transaction.on_commit(partial(invalidate, user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend that resolves session users from a cached snapshot
+
+    The snapshot includes the password hash, so Django's session auth hash
+    check still runs against it; it is dropped whenever the user is saved
+    or deleted (which covers password changes and update_session_auth_hash)
+    and on logout. Code that changes users with QuerySet.update() must call
+    invalidate_on_commit() itself. Dropping the snapshot also changes the user's
+    ETag (user_etag()), since the next snapshot gets a new version.
+
+    Logins hash in the bounded pool of users.hashing and upgrade outdated
+    password hashes on success. The async methods, used by the views of
+    ASGI deployments, wait for hashes without holding a thread.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            # Spend the same time as a wrong password so emails cannot be probed
+            hashing.make_password(password)
+            raise PermissionDenied
+        if not (hashing.check_password(user, password) and self.user_can_authenticate(user)):
+            # Stop here instead of hashing again in the next backend
+            raise PermissionDenied
+        return user
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await User._default_manager.aget_by_natural_key(username)
+        except User.DoesNotExist:
+            await hashing.amake_password(password)
+            raise PermissionDenied
+        if not (await hashing.acheck_password(user, password) and self.user_can_authenticate(user)):
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        snapshot = get_cache().get(snapshot_key(user_id))
+        if snapshot is None:
+            # A lagging replica must not seed the snapshot with stale data
+            with use_primary():
+                user = super().get_user(user_id)
+            if user is not None:
+                snapshot = take_snapshot(user)
+                get_cache().set(snapshot_key(user_id), snapshot, settings.USER_CACHE_TIMEOUT)
+                user.snapshot_version = snapshot[VERSION_KEY]
+            return user
+        user = from_snapshot(snapshot)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        snapshot = await get_cache().aget(snapshot_key(user_id))
+        if snapshot is None:
+            with use_primary():
+                user = await super().aget_user(user_id)
+            if user is not None:
+                snapshot = take_snapshot(user)
+                await get_cache().aset(snapshot_key(user_id), snapshot, settings.USER_CACHE_TIMEOUT)
+                user.snapshot_version = snapshot[VERSION_KEY]
+            return user
+        user = from_snapshot(snapshot)
+        return user if self.user_can_authenticate(user) else None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_user_snapshot(sender, instance, **kwargs):
+    invalidate_on_commit(instance.pk)
+
+
+@receiver(user_logged_out)
+def drop_snapshot_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate(user.pk)
@@ -0,0 +1,180 @@
+import csv
+import json
+import re
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.utils import timezone
+
+User = get_user_model()
+
+# Columns accepted by import_users; the same fields as UserRegistrationSerializer
+IMPORT_FIELDS = [
+    'first_name', 'last_name', 'email', 'phone_number',
+    'date_of_birth', 'is_newsletter_interested', 'password', 'confirm_password',
+]
+EXPORT_FIELDS = [
+    'id', 'email', 'first_name', 'last_name', 'phone_number', 'date_of_birth',
+    'is_newsletter_interested', 'email_verified', 'is_active', 'date_joined',
+]
+
+_phone_re = re.compile(r'^\+?[0-9]{10,15}$')
+_true = {'1', 'true', 'yes', 'y', 't'}
+_false = {'', '0', 'false', 'no', 'n', 'f'}
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'csv' if path.endswith('.csv') else 'jsonl'
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row dict) one input line at a time"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Surplus cells of a long row are collected under None
+            row.pop(None, None)
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, e
+
+
+def _column(rows, name):
+    return [row.get(name) for row in rows]
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def validate_rows(rows):
+    """Apply UserRegistrationSerializer's rules to a batch, column by column
+
+    No database access: uniqueness is checked separately with
+    existing_emails(). Returns (cleaned rows, {index: errors}) where
+    cleaned rows hold None for invalid input.
+    """
+    errors = {}
+    cleaned = [{} for _ in rows]
+    today = timezone.now().date()
+
+    def fail(i, field, message):
+        errors.setdefault(i, {}).setdefault(field, []).append(message)
+
+    for i, value in enumerate(_column(rows, 'email')):
+        email = _text(value)
+        try:
+            validate_email(email)
+        except ValidationError:
+            fail(i, 'email', "Enter a valid email address.")
+            continue
+        # Same normalization as CustomUserManager.create_user
+        cleaned[i]['email'] = User.objects.normalize_email(email).lower()
+
+    for field in ('first_name', 'last_name'):
+        max_length = User._meta.get_field(field).max_length
+        for i, value in enumerate(_column(rows, field)):
+            value = _text(value)
+            if len(value) > max_length:
+                fail(i, field, f"Ensure this field has no more than {max_length} characters.")
+            cleaned[i][field] = value
+
+    for i, value in enumerate(_column(rows, 'phone_number')):
+        value = _text(value)
+        if value and not _phone_re.match(value):
+            fail(i, 'phone_number', "Enter a valid phone number")
+        cleaned[i]['phone_number'] = value or None
+
+    for i, value in enumerate(_column(rows, 'date_of_birth')):
+        value = _text(value)
+        if not value:
+            cleaned[i]['date_of_birth'] = None
+            continue
+        try:
+            value = date.fromisoformat(value)
+        except ValueError:
+            fail(i, 'date_of_birth', "Date has wrong format. Use YYYY-MM-DD.")
+            continue
+        if value > today:
+            fail(i, 'date_of_birth', "Date of birth cannot be in the future")
+        cleaned[i]['date_of_birth'] = value
+
+    for i, value in enumerate(_column(rows, 'is_newsletter_interested')):
+        if isinstance(value, bool):
+            cleaned[i]['is_newsletter_interested'] = value
+            continue
+        value = _text(value).lower()
+        if value not in _true and value not in _false:
+            fail(i, 'is_newsletter_interested', "Must be a valid boolean.")
+        cleaned[i]['is_newsletter_interested'] = value in _true
+
+    passwords = _column(rows, 'password')
+    for i, (password, confirm) in enumerate(zip(passwords, _column(rows, 'confirm_password'))):
+        # Rows without a password get an unusable one and must reset it
+        if confirm is not None and password != confirm:
+            fail(i, 'confirm_password', "Passwords do not match")
+        cleaned[i]['password'] = password or None
+
+    return [None if i in errors else row for i, row in enumerate(cleaned)], errors
+
+
+def existing_emails(emails, chunk_size=500):
+    """Emails already in the database, looked up in chunks of IN (...)
+
+    emails must be normalized (lowercase), as validate_rows() leaves them.
+    """
+    emails = list(emails)
+    found = set()
+    for start in range(0, len(emails), chunk_size):
+        found.update(User.objects.by_emails(emails[start:start + chunk_size]).values_list('email', flat=True))
+    return found
+
+
+def build_users(rows, executor=None):
+    """Unsaved User objects for cleaned rows, passwords hashed on executor"""
+    from .hashing import make_passwords
+
+    raw = [row.pop('password') for row in rows]
+    to_hash = [password for password in raw if password is not None]
+    hashed = iter(make_passwords(executor, to_hash) if executor else [make_password(p) for p in to_hash])
+    return [
+        User(**row, password=next(hashed) if password is not None else make_password(None))
+        for row, password in zip(rows, raw)
+    ]
+
+
+def count_inserted(users, chunk_size=500):
+    """How many of users bulk_create(ignore_conflicts=True) actually inserted
+
+    Users are found by email through the LOWER(email) index. A row skipped
+    over a conflicting email belongs to someone else and has another
+    (salted) password hash, so it is not counted.
+    """
+    count = 0
+    for start in range(0, len(users), chunk_size):
+        chunk = users[start:start + chunk_size]
+        count += User.objects.by_emails([user.email for user in chunk]).filter(
+            password__in=[user.password for user in chunk],
+        ).count()
+    return count
+
+
+def export_row(values):
+    """JSON-safe dict for one values_list() row of EXPORT_FIELDS"""
+    row = dict(zip(EXPORT_FIELDS, values))
+    for field in ('date_of_birth', 'date_joined'):
+        if row[field] is not None:
+            row[field] = row[field].isoformat()
+    return row
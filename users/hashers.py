@@ -0,0 +1,42 @@
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher
+
+from .hashing import get_config
+
+
+def _option(name):
+    return get_config()[name]
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    """Scrypt with cost parameters from PASSWORD_HASHING
+
+    Stored hashes with other parameters are upgraded on the next login.
+    """
+
+    @property
+    def work_factor(self):
+        return _option('SCRYPT_WORK_FACTOR')
+
+    @property
+    def block_size(self):
+        return _option('SCRYPT_BLOCK_SIZE')
+
+    @property
+    def parallelism(self):
+        return _option('SCRYPT_PARALLELISM')
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2 with cost parameters from PASSWORD_HASHING; needs argon2-cffi"""
+
+    @property
+    def time_cost(self):
+        return _option('ARGON2_TIME_COST')
+
+    @property
+    def memory_cost(self):
+        return _option('ARGON2_MEMORY_COST')
+
+    @property
+    def parallelism(self):
+        return _option('ARGON2_PARALLELISM')
@@ -0,0 +1,175 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from backends.instrumentation import timed
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+def get_config():
+    """Return the password hashing settings with defaults filled in"""
+    config = {
+        'SCRYPT_WORK_FACTOR': 2 ** 14,
+        'SCRYPT_BLOCK_SIZE': 8,
+        'SCRYPT_PARALLELISM': 1,
+        'ARGON2_TIME_COST': 2,
+        'ARGON2_MEMORY_COST': 102400,
+        'ARGON2_PARALLELISM': 8,
+        'POOL_WORKERS': 2,
+        'POOL_MAX_PENDING': 32,
+        'POOL_QUEUE_TIMEOUT': 2.0,
+    }
+    config.update(getattr(settings, 'PASSWORD_HASHING', {}))
+    return config
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Server is busy, please try again shortly."
+    default_code = 'hashing_busy'
+
+
+def _exit_with_parent(parent_pid):
+    # Server workers can be killed or recycled (gunicorn --max-requests)
+    # without shutting the pool down
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os._exit(0)
+
+
+def _init_worker(settings_module, parent_pid):
+    os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+    django.setup()
+    threading.Thread(target=_exit_with_parent, args=(parent_pid,), daemon=True).start()
+
+
+def _make(raw_password):
+    return hashers.make_password(raw_password)
+
+
+def _verify(raw_password, encoded):
+    return hashers.verify_password(raw_password, encoded)
+
+
+def make_pool(workers):
+    """Process pool whose workers hash with this project's settings"""
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        # Forking a threaded server process is unsafe
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(os.environ['DJANGO_SETTINGS_MODULE'], os.getpid()),
+    )
+
+
+def make_passwords(executor, raw_passwords, chunksize=16):
+    """Hash many passwords on executor (from make_pool), keeping order"""
+    return list(executor.map(_make, raw_passwords, chunksize=chunksize))
+
+
+def _pool():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            config = get_config()
+            _executor = make_pool(config['POOL_WORKERS'])
+            _slots = threading.BoundedSemaphore(config['POOL_MAX_PENDING'])
+        return _executor, _slots
+
+
+def run(fn, *args):
+    """Run a hashing function in the bounded process pool
+
+    At most POOL_WORKERS hashes run at once, so hashing cannot take every
+    core, and at most POOL_MAX_PENDING wait for a worker; callers that
+    cannot get a slot within POOL_QUEUE_TIMEOUT get HashingBusy (503).
+    Runs inline when the pool is disabled or Django was configured without
+    a settings module the workers could load.
+    """
+    config = get_config()
+    with timed('hash'):
+        if not config['POOL_WORKERS'] or 'DJANGO_SETTINGS_MODULE' not in os.environ:
+            return fn(*args)
+        executor, slots = _pool()
+        if not slots.acquire(timeout=config['POOL_QUEUE_TIMEOUT']):
+            raise HashingBusy()
+        try:
+            return executor.submit(fn, *args).result()
+        finally:
+            slots.release()
+
+
+async def arun(fn, *args):
+    """run() for async views: waits for the pool without holding a thread"""
+    config = get_config()
+    with timed('hash'):
+        if not config['POOL_WORKERS'] or 'DJANGO_SETTINGS_MODULE' not in os.environ:
+            return await sync_to_async(fn, thread_sensitive=False)(*args)
+        executor, slots = _pool()
+        # Only a full queue costs a thread, to wait for a free slot
+        if not slots.acquire(blocking=False):
+            acquire = sync_to_async(slots.acquire, thread_sensitive=False)
+            if not await acquire(timeout=config['POOL_QUEUE_TIMEOUT']):
+                raise HashingBusy()
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        finally:
+            slots.release()
+
+
+def make_password(raw_password):
+    if raw_password is None:
+        # Unusable password; nothing to hash
+        return hashers.make_password(None)
+    return run(_make, raw_password)
+
+
+def set_password(user, raw_password):
+    """user.set_password() with the hashing done off-thread"""
+    user.password = make_password(raw_password)
+    user._password = raw_password
+
+
+def check_password(user, raw_password):
+    """user.check_password() with off-thread hashing
+
+    A correct password stored with an outdated hasher or cost parameters is
+    rehashed with the preferred one and saved.
+    """
+    is_correct, must_update = run(_verify, raw_password, user.password)
+    if is_correct and must_update:
+        user.password = make_password(raw_password)
+        user.save(update_fields=['password'])
+    return is_correct
+
+
+async def amake_password(raw_password):
+    if raw_password is None:
+        return hashers.make_password(None)
+    return await arun(_make, raw_password)
+
+
+async def aset_password(user, raw_password):
+    user.password = await amake_password(raw_password)
+    user._password = raw_password
+
+
+async def acheck_password(user, raw_password):
+    is_correct, must_update = await arun(_verify, raw_password, user.password)
+    if is_correct and must_update:
+        user.password = await amake_password(raw_password)
+        await user.asave(update_fields=['password'])
+    return is_correct
@@ -0,0 +1,109 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.hashing import get_config
+
+
+def _scrypt(cost):
+    work_factor, block_size, parallelism = cost
+    start = time.perf_counter()
+    hashlib.scrypt(
+        b'calibration password',
+        salt=os.urandom(16),
+        n=work_factor,
+        r=block_size,
+        p=parallelism,
+        maxmem=128 * work_factor * block_size * parallelism * 2,
+        dklen=64,
+    )
+    return time.perf_counter() - start
+
+
+def _argon2(cost):
+    import argon2
+
+    time_cost, memory_cost, parallelism = cost
+    hasher = argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    start = time.perf_counter()
+    hasher.hash('calibration password')
+    return time.perf_counter() - start
+
+
+def _p99(samples):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+class Command(BaseCommand):
+    help = "Time password hashing costs under concurrent logins and suggest PASSWORD_HASHING parameters"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm', choices=['scrypt', 'argon2'])
+        parser.add_argument('--target-p99-ms', type=float, default=250,
+                            help="Login hashing latency to stay under, queueing included")
+        parser.add_argument('--concurrency', type=int, default=8, help="Simultaneous logins to simulate")
+        parser.add_argument('--workers', type=int, help="Pool size; defaults to POOL_WORKERS")
+        parser.add_argument('--samples', type=int, default=64, help="Hashes timed per cost")
+
+    def handle(self, *args, **options):
+        config = get_config()
+        algorithm = options['algorithm'] or settings.PASSWORD_HASHING.get('ALGORITHM', 'scrypt')
+        workers = options['workers'] or config['POOL_WORKERS'] or 1
+        target = options['target_p99_ms'] / 1000
+        if algorithm == 'argon2':
+            try:
+                import argon2  # noqa: F401
+            except ImportError:
+                raise CommandError("argon2-cffi is not installed")
+            fn = _argon2
+            costs = [(t, config['ARGON2_MEMORY_COST'], config['ARGON2_PARALLELISM']) for t in range(1, 9)]
+        else:
+            fn = _scrypt
+            costs = [(2 ** n, config['SCRYPT_BLOCK_SIZE'], config['SCRYPT_PARALLELISM']) for n in range(12, 19)]
+
+        self.stdout.write(
+            f"{algorithm}: {workers} workers, {options['concurrency']} concurrent logins, "
+            f"target p99 {options['target_p99_ms']:g} ms"
+        )
+        best = None
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            # Start the workers before timing anything
+            wait([executor.submit(fn, costs[0]) for _ in range(workers)])
+            for cost in costs:
+                latencies, hash_times = self._measure(executor, fn, cost, options['concurrency'], options['samples'])
+                p99 = _p99(latencies)
+                self.stdout.write(
+                    f"  {cost}: hash {sorted(hash_times)[len(hash_times) // 2] * 1000:.1f} ms, "
+                    f"p99 with queueing {p99 * 1000:.1f} ms, "
+                    f"{len(latencies) / sum(hash_times) * workers:.0f} hashes/s"
+                )
+                if p99 > target:
+                    break
+                best = cost
+
+        if best is None:
+            raise CommandError("Even the cheapest cost misses the target; add workers or lower concurrency")
+        if algorithm == 'argon2':
+            suggestion = {'ARGON2_TIME_COST': best[0]}
+        else:
+            suggestion = {'SCRYPT_WORK_FACTOR': best[0]}
+        self.stdout.write(self.style.SUCCESS(f"Suggested PASSWORD_HASHING: {suggestion}, 'POOL_WORKERS': {workers}"))
+
+    def _measure(self, executor, fn, cost, concurrency, samples):
+        """Keep `concurrency` hashes queued; return (latencies, hash times)"""
+        latencies = []
+        hash_times = []
+        while len(latencies) < samples:
+            started = time.perf_counter()
+            futures = [executor.submit(fn, cost) for _ in range(concurrency)]
+            for future in futures:
+                hash_times.append(future.result())
+                latencies.append(time.perf_counter() - started)
+        return latencies, hash_times
@@ -0,0 +1,43 @@
+import csv
+import json
+import sys
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand
+
+from users import bulk
+from users.bulk import User
+
+
+class Command(BaseCommand):
+    help = "Stream all users to CSV or JSONL through a server-side cursor"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file, or - for stdout")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per round trip")
+
+    def handle(self, *args, **options):
+        fmt = bulk.detect_format(options['path'], options['format'])
+        rows = User.objects.order_by('pk').values_list(*bulk.EXPORT_FIELDS).iterator(chunk_size=options['chunk_size'])
+        start = time.perf_counter()
+        count = 0
+        if options['path'] == '-':
+            output = nullcontext(sys.stdout)
+        else:
+            output = open(options['path'], 'w', newline='' if fmt == 'csv' else None, encoding='utf-8')
+        with output as stream:
+            if fmt == 'csv':
+                writer = csv.writer(stream)
+                writer.writerow(bulk.EXPORT_FIELDS)
+                for values in rows:
+                    writer.writerow(values)
+                    count += 1
+            else:
+                for values in rows:
+                    stream.write(json.dumps(bulk.export_row(values)) + "\n")
+                    count += 1
+        elapsed = time.perf_counter() - start
+        # stdout may be the export itself
+        self.stderr.write(f"{count} users in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} rows/s)")
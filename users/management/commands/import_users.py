@@ -0,0 +1,112 @@
+import json
+import os
+import sys
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users import bulk
+from users.bulk import User
+from users.hashing import make_pool
+
+
+class Command(BaseCommand):
+    help = "Create users from a CSV or JSONL file in batches, hashing passwords in a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or - for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per bulk_create")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Hashing processes; 0 hashes inline")
+        parser.add_argument('--errors', help="Write rejected rows with their errors to this JSONL file")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and dedupe without writing")
+
+    def handle(self, *args, **options):
+        self.fmt = bulk.detect_format(options['path'], options['format'])
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.seen = set()
+        self.counts = {'created': 0, 'duplicate': 0, 'invalid': 0}
+        self.errors = open(options['errors'], 'w') if options['errors'] else None
+        self.executor = make_pool(options['workers']) if options['workers'] else None
+        start = time.perf_counter()
+        rows = 0
+        try:
+            with self._open(options['path']) as stream:
+                batch = []
+                for number, row in bulk.read_rows(stream, self.fmt):
+                    rows += 1
+                    batch.append((number, row))
+                    if len(batch) >= self.batch_size:
+                        self._import(batch)
+                        batch = []
+                        if options['verbosity'] > 1:
+                            self._progress(rows, start)
+                if batch:
+                    self._import(batch)
+        finally:
+            if self.executor:
+                self.executor.shutdown()
+            if self.errors:
+                self.errors.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s): "
+            f"{self.counts['created']} created, {self.counts['duplicate']} duplicates, "
+            f"{self.counts['invalid']} invalid" + (" (dry run)" if self.dry_run else "")
+        )
+
+    def _open(self, path):
+        if path == '-':
+            return nullcontext(sys.stdin)
+        return open(path, newline='' if self.fmt == 'csv' else None, encoding='utf-8')
+
+    def _progress(self, rows, start):
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{rows} rows, {rows / elapsed:.0f} rows/s")
+
+    def _reject(self, number, errors):
+        self.counts['invalid'] += 1
+        if self.errors:
+            self.errors.write(json.dumps({"line": number, "errors": errors}) + "\n")
+
+    def _import(self, batch):
+        parsed = []
+        for number, row in batch:
+            if isinstance(row, dict):
+                parsed.append((number, row))
+            else:
+                self._reject(number, {"non_field_errors": ["Invalid JSON object"]})
+
+        cleaned, errors = bulk.validate_rows([row for _, row in parsed])
+        for i, messages in errors.items():
+            self._reject(parsed[i][0], messages)
+
+        candidates = []
+        for row in cleaned:
+            if row is None:
+                continue
+            if row['email'] in self.seen:
+                self.counts['duplicate'] += 1
+                continue
+            self.seen.add(row['email'])
+            candidates.append(row)
+
+        taken = bulk.existing_emails(row['email'] for row in candidates)
+        new = [row for row in candidates if row['email'] not in taken]
+        self.counts['duplicate'] += len(candidates) - len(new)
+        if not new:
+            return
+        if self.dry_run:
+            self.counts['created'] += len(new)
+            return
+        users = bulk.build_users(new, self.executor)
+        with transaction.atomic():
+            # A concurrent signup can still take an email; skip it rather than fail the batch
+            User.objects.bulk_create(users, batch_size=self.batch_size, ignore_conflicts=True)
+            created = bulk.count_inserted(users)
+        self.counts['created'] += created
+        self.counts['duplicate'] += len(new) - created
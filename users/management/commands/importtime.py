@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter, as a worker boots: settings, app registry,
+# URLconf (and with it every view module), then the WSGI handler
+BOOT = """
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+"""
+
+
+def parse(stderr):
+    """Return (module, self_us, cumulative_us) rows from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        if not self_us.strip().isdigit():
+            # The header line
+            continue
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Report what importing the project costs a fresh worker, per module (python -X importtime)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help="Rows to show")
+        parser.add_argument('--sort', choices=('self', 'cumulative'), default='self')
+        parser.add_argument('--by-package', action='store_true', help="Sum self time per top-level package")
+        parser.add_argument('--module', action='append', default=[], help="Also import this module, e.g. users.push")
+
+    def handle(self, *args, **options):
+        code = BOOT + ''.join(f"import {module}\n" for module in options['module'])
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE,
+            'PYTHONPATH': os.pathsep.join(sys.path),
+        }
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, env=env)
+        rows = parse(result.stderr)
+        if result.returncode:
+            errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+            raise CommandError("Importing the project failed:\n" + '\n'.join(errors[-20:]))
+
+        total = sum(self_us for _, self_us, _ in rows)
+        if options['by_package']:
+            packages = defaultdict(lambda: [0, 0])
+            for name, self_us, _ in rows:
+                package = packages[name.split('.')[0]]
+                package[0] += self_us
+                package[1] += 1
+            table = sorted(((name, us, count) for name, (us, count) in packages.items()), key=lambda row: -row[1])
+            self.stdout.write(f"{'ms':>9}  {'modules':>7}  package")
+            for name, self_us, count in table[:options['top']]:
+                self.stdout.write(f"{self_us / 1000:9.1f}  {count:7}  {name}")
+        else:
+            column = 1 if options['sort'] == 'self' else 2
+            self.stdout.write(f"{'self ms':>9}  {'cumul ms':>9}  module")
+            for name, self_us, cumulative_us in sorted(rows, key=lambda row: -row[column])[:options['top']]:
+                self.stdout.write(f"{self_us / 1000:9.1f}  {cumulative_us / 1000:9.1f}  {name}")
+        self.stdout.write(f"{len(rows)} modules, {total / 1000:.1f} ms in total")
+
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.auth import invalidate_many
+from users.models import User
+from users.tokens import expired_reset_tokens
+
+
+def delete_in_batches(queryset, batch_size, on_batch=None):
+    """Delete the rows of queryset batch_size ids at a time; returns the count
+
+    Each DELETE is its own short transaction instead of one long one.
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        queryset.model.objects.filter(pk__in=ids).delete()
+        if on_batch:
+            on_batch(ids)
+        deleted += len(ids)
+
+
+class Command(BaseCommand):
+    help = "Delete expired password reset codes and, with --unverified-days, accounts never verified"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--unverified-days', type=int,
+            help="Also delete non-staff users who joined this many days ago and never verified their email",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per DELETE")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be deleted")
+
+    def handle(self, *args, **options):
+        tokens = expired_reset_tokens()
+        users = None
+        if options['unverified_days'] is not None:
+            users = User.objects.unverified_joined_before(timezone.now() - timedelta(days=options['unverified_days']))
+
+        if options['dry_run']:
+            self.stdout.write(f"{tokens.count()} expired reset codes")
+            if users is not None:
+                self.stdout.write(f"{users.count()} unverified users")
+            return
+
+        count = delete_in_batches(tokens, options['batch_size'])
+        self.stdout.write(f"Deleted {count} expired reset codes")
+        if users is not None:
+            count = delete_in_batches(users, options['batch_size'], on_batch=invalidate_many)
+            self.stdout.write(f"Deleted {count} unverified users")
@@ -0,0 +1,66 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users import newsletter
+from users.models import NewsletterCampaign
+
+
+class Command(BaseCommand):
+    help = "Mail a newsletter to users with is_newsletter_interested, or resume an interrupted campaign"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subject', help="Subject of a new campaign")
+        parser.add_argument(
+            '--template',
+            help="File with the body of a new campaign, a Django template with first_name, last_name and email",
+        )
+        parser.add_argument('--from-email', default='', help="Defaults to EMAIL_HOST_USER")
+        parser.add_argument('--resume', type=int, metavar='CAMPAIGN_ID', help="Continue a campaign after its checkpoint")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the remaining recipients")
+        parser.add_argument('--batch-size', type=int, help="Messages per send_messages call")
+        parser.add_argument('--connections', type=int, help="Persistent SMTP connections")
+        parser.add_argument('--rate', type=float, help="Messages per second over all connections; 0 for no limit")
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                campaign = NewsletterCampaign.objects.get(pk=options['resume'])
+            except NewsletterCampaign.DoesNotExist:
+                raise CommandError(f"No campaign {options['resume']}")
+        elif options['subject'] and options['template']:
+            body = Path(options['template']).read_text(encoding='utf-8')
+            campaign = NewsletterCampaign(subject=options['subject'], body=body, from_email=options['from_email'])
+        else:
+            raise CommandError("Pass --subject and --template for a new campaign, or --resume")
+
+        if options['dry_run']:
+            count = newsletter.audience(campaign.last_user_id).count()
+            self.stdout.write(f"{count} recipients after user id {campaign.last_user_id}")
+            return
+        if campaign.pk is None:
+            campaign.save()
+            self.stdout.write(f"Campaign {campaign.pk} created")
+
+        overrides = {
+            name: options[option]
+            for name, option in (('BATCH_SIZE', 'batch_size'), ('CONNECTIONS', 'connections'), ('RATE', 'rate'))
+            if options[option] is not None
+        }
+        start = time.perf_counter()
+        try:
+            campaign = newsletter.send_campaign(campaign, **overrides)
+        except newsletter.CampaignBusy as e:
+            raise CommandError(str(e))
+        except (Exception, KeyboardInterrupt) as e:
+            campaign.refresh_from_db()
+            raise CommandError(
+                f"Campaign {campaign.pk} stopped after user id {campaign.last_user_id}: {str(e) or e.__class__.__name__}. "
+                f"Run again with --resume {campaign.pk}"
+            )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Campaign {campaign.pk}: sent {campaign.sent}, failed {campaign.failed} in total; "
+            f"this run took {elapsed:.1f}s"
+        )
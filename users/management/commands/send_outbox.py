@@ -0,0 +1,38 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from users.outbox import drain
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails from the outbox over one persistent SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+        parser.add_argument('--batch-size', type=int, help='Emails claimed at a time')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait when the outbox is empty')
+
+    def handle(self, *args, **options):
+        connection = get_connection(fail_silently=False)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    connection.open()
+                    sent, failed = drain(connection, options['batch_size'])
+                except Exception as e:
+                    # SMTP server unreachable; keep the worker alive and try again
+                    self.stderr.write(f"Outbox delivery failed: {e}")
+                    connection.close()
+                    sent = failed = 0
+                if sent or failed:
+                    self.stdout.write(f"Sent {sent}, failed {failed} in {time.perf_counter() - start:.2f}s")
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
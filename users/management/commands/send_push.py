@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users import push
+
+
+class Command(BaseCommand):
+    help = "Send a push notification to the devices of users matching --filter"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--title', required=True)
+        parser.add_argument('--body', required=True)
+        parser.add_argument('--data', help="JSON object delivered with the notification")
+        parser.add_argument(
+            '--filter', action='append', default=[], dest='filters',
+            help="field[__lookup]=value, e.g. is_newsletter_interested=true or date_joined__gte=2025-01-01; repeatable",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Only count the targeted devices")
+        parser.add_argument('--batch-size', type=int, help="Tokens per provider request")
+        parser.add_argument('--chunk-size', type=int, help="Tokens read from the database per query")
+        parser.add_argument('--concurrency', type=int, help="Provider requests in flight")
+
+    def handle(self, *args, **options):
+        try:
+            filters = push.parse_filters(options['filters'])
+            data = json.loads(options['data']) if options['data'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['dry_run']:
+            self.stdout.write(f"{push.targets(filters).count()} devices targeted")
+            return
+
+        overrides = {
+            name: options[option]
+            for name, option in (('BATCH_SIZE', 'batch_size'), ('CHUNK_SIZE', 'chunk_size'), ('MAX_CONCURRENT', 'concurrency'))
+            if options[option]
+        }
+        try:
+            report = push.dispatch(options['title'], options['body'], data=data, filters=filters, **overrides)
+        except push.PushProviderError as e:
+            raise CommandError(str(e))
+        self.stdout.write(json.dumps(report.as_dict()))
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from backends.sessions import DB_EXPIRY_KEY, SessionStore
+
+
+class Command(BaseCommand):
+    help = "Copy live database sessions into the session cache so no user is logged out or hits the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        cache = caches[settings.SESSION_CACHE_ALIAS]
+        now = timezone.now()
+        store = SessionStore()
+        copied = 0
+        sessions = Session.objects.filter(expire_date__gt=now).iterator(chunk_size=options['chunk_size'])
+        for session in sessions:
+            data = store.decode(session.session_data)
+            # The row is already valid until expire_date; no rewrite needed yet
+            data[DB_EXPIRY_KEY] = int(session.expire_date.timestamp())
+            timeout = int((session.expire_date - now).total_seconds())
+            if timeout > 0 and cache.add(SessionStore.cache_key_prefix + session.session_key, data, timeout):
+                copied += 1
+        self.stdout.write(f"Copied {copied} sessions into the '{settings.SESSION_CACHE_ALIAS}' cache")
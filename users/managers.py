@@ -1,19 +1,67 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import models
+from django.db.models.functions import Lower
 from django.utils.translation import gettext_lazy as _
 
-class CustomUserManager(BaseUserManager):
+from . import hashing
 
-    def create_user(self, email, password=None, **extra_fields):
+
+class UserQuerySet(models.QuerySet):
+    def by_email(self, email):
+        """Users whose email matches case-insensitively
+
+        Filters on LOWER(email), the expression of the user_email_lower_uniq
+        index, so the lookup stays an index search; email__iexact would not.
+        """
+        return self.alias(email_lower=Lower('email')).filter(email_lower=email.lower())
+
+    def by_emails(self, emails):
+        """Users with any of emails, case-insensitively, through the same index"""
+        return self.alias(email_lower=Lower('email')).filter(email_lower__in=[email.lower() for email in emails])
+
+    def unverified_joined_before(self, cutoff):
+        """Non-staff users who never verified their email and joined before cutoff
+
+        Served by the partial index user_unverified_idx, which holds only
+        unverified users.
+        """
+        return self.filter(email_verified=False, date_joined__lt=cutoff, is_staff=False)
+
+
+class CustomUserManager(BaseUserManager.from_queryset(UserQuerySet)):
+
+    def _build_user(self, email, **extra_fields):
         if not email:
             raise ValueError(_("The Email must be set"))
 
         # Normalize email to lowercase
         email = self.normalize_email(email).lower()
-        user = self.model(email=email, **extra_fields)
-        user.set_password(password)
+        return self.model(email=email, **extra_fields)
+
+    def create_user(self, email, password=None, **extra_fields):
+        user = self._build_user(email, **extra_fields)
+        hashing.set_password(user, password)
         user.save(using=self._db)
         return user
 
+    async def acreate_user(self, email, password=None, **extra_fields):
+        user = self._build_user(email, **extra_fields)
+        await hashing.aset_password(user, password)
+        await user.asave(using=self._db)
+        return user
+
+    def create_user_hashed(self, email, password_hash, **extra_fields):
+        """create_user() for a password hashed beforehand, e.g. by hashing.amake_password()"""
+        user = self._build_user(email, password=password_hash, **extra_fields)
+        user.save(using=self._db)
+        return user
+
+    def get_by_natural_key(self, username):
+        return self.by_email(username).get()
+
+    async def aget_by_natural_key(self, username):
+        return await self.by_email(username).aget()
+
     def create_superuser(self, email, password=None, **extra_fields):
         extra_fields.setdefault("is_staff", True)
         extra_fields.setdefault("is_superuser", True)
@@ -0,0 +1,72 @@
+# Generated by Django 5.2 on 2026-10-18 08:02
+
+import hashlib
+import hmac
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def copy_outstanding_tokens(apps, schema_editor):
+    """Keep codes already emailed working; they get a fresh 24h lifetime"""
+    User = apps.get_model('users', 'User')
+    OneTimeToken = apps.get_model('users', 'OneTimeToken')
+    expires_at = timezone.now() + timedelta(seconds=getattr(settings, 'OTP_TOKEN_TTL', 60 * 60 * 24))
+    seen = set()
+    tokens = []
+    rows = User.objects.filter(
+        models.Q(email_verification_token__isnull=False, email_verified=False)
+        | models.Q(password_reset_token__isnull=False)
+    ).values_list('id', 'email_verification_token', 'email_verified', 'password_reset_token')
+    for user_id, verification_token, email_verified, reset_token in rows.iterator():
+        for purpose, token in (
+            ('verify_email', None if email_verified else verification_token),
+            ('password_reset', reset_token),
+        ):
+            if not token:
+                continue
+            token_hash = hmac.new(
+                settings.SECRET_KEY.encode(), f"{purpose}:{token}".encode(), hashlib.sha256
+            ).hexdigest()
+            # Codes shared by several users were ambiguous before; keep the first
+            if (purpose, token_hash) in seen:
+                continue
+            seen.add((purpose, token_hash))
+            tokens.append(OneTimeToken(user_id=user_id, purpose=purpose, token_hash=token_hash, expires_at=expires_at))
+    OneTimeToken.objects.bulk_create(tokens, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_outboxemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OneTimeToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purpose', models.CharField(choices=[('verify_email', 'Verify email'), ('password_reset', 'Password reset')], max_length=20)),
+                ('token_hash', models.CharField(max_length=64)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='one_time_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('purpose', 'token_hash'), name='otp_purpose_hash_uniq'), models.UniqueConstraint(fields=('user', 'purpose'), name='otp_user_purpose_uniq')],
+            },
+        ),
+        migrations.RunPython(copy_outstanding_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='user',
+            name='email_verification_token',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='password_reset_token',
+        ),
+    ]
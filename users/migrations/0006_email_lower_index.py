@@ -0,0 +1,110 @@
+# Generated by Django 5.2 on 2026-10-18 09:40
+
+import django.db.models.functions.text
+from django.db import IntegrityError, migrations, models, transaction
+
+BATCH_SIZE = 1000
+
+
+def normalize_emails(apps, schema_editor):
+    """Lowercase stored emails, BATCH_SIZE rows per transaction
+
+    Rows are walked in id order and only rows that change are updated, so
+    each transaction locks a handful of rows at most. Emails that would
+    collide with an existing one are left for an admin to resolve and
+    stop the migration before user_email_lower_uniq is built.
+    """
+    User = apps.get_model('users', 'User')
+    db = schema_editor.connection.alias
+    conflicts = []
+    last_id = 0
+    while True:
+        rows = list(
+            User.objects.using(db).filter(pk__gt=last_id).order_by('pk').values_list('pk', 'email')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        with transaction.atomic(using=db):
+            for pk, email in rows:
+                if email == email.lower():
+                    continue
+                try:
+                    with transaction.atomic(using=db):
+                        User.objects.using(db).filter(pk=pk, email=email).update(email=email.lower())
+                except IntegrityError:
+                    conflicts.append((pk, email))
+    if conflicts:
+        raise RuntimeError(
+            "These users' emails differ only in case from another user's; merge or rename them and migrate again: "
+            + ", ".join(f"{pk} ({email})" for pk, email in conflicts)
+        )
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """AddIndex that builds with CREATE INDEX CONCURRENTLY on PostgreSQL
+
+    Writes to the table continue while the index is built. Other databases
+    get a plain CREATE INDEX.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+
+class AddUniqueConstraintConcurrently(migrations.AddConstraint):
+    """AddConstraint for an expression UniqueConstraint, which is a unique
+    index, built with CREATE UNIQUE INDEX CONCURRENTLY on PostgreSQL"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            statement = self.constraint.create_sql(model, schema_editor)
+            statement.template = statement.template.replace('CREATE UNIQUE INDEX', 'CREATE UNIQUE INDEX CONCURRENTLY', 1)
+            schema_editor.execute(statement)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(self.constraint.name)}")
+
+
+class Migration(migrations.Migration):
+    # Each backfill batch commits on its own, and PostgreSQL cannot build
+    # indexes concurrently inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('users', '0005_newslettercampaign'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_emails, migrations.RunPython.noop),
+        AddUniqueConstraintConcurrently(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='user_email_lower_uniq'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(condition=models.Q(('email_verified', False)), fields=['date_joined'], name='user_unverified_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='onetimetoken',
+            index=models.Index(condition=models.Q(('purpose', 'password_reset')), fields=['expires_at'], name='otp_reset_expiry_idx'),
+        ),
+    ]
@@ -1,12 +1,63 @@
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import uuid
 from datetime import date
 
 from .managers import CustomUserManager
 
-class User(AbstractUser):
+
+class DirtyFieldsMixin:
+    """Save only the concrete fields changed since the instance was loaded
+
+    save() without update_fields on a loaded or saved instance becomes
+    save(update_fields=<changed fields>), so it issues UPDATE ... SET for
+    those columns only, and no query at all when nothing changed.
+    Instances built some other way can opt in with mark_clean().
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.mark_clean()
+        return instance
+
+    def mark_clean(self, fields=None):
+        """Take the current values of fields (default: all loaded ones) as saved"""
+        clean = self.__dict__.setdefault('_clean_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or field.name in fields or field.attname in fields):
+                clean[field.attname] = getattr(self, field.attname)
+
+    def dirty_fields(self):
+        """Names of the concrete fields changed since mark_clean(); None if never marked"""
+        clean = self.__dict__.get('_clean_values')
+        if clean is None:
+            return None
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in self.__dict__
+            and (field.attname not in clean or clean[field.attname] != getattr(self, field.attname))
+        ]
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is None and not args and not kwargs.get('force_insert') and not self._state.adding:
+            update_fields = self.dirty_fields()
+            if update_fields == []:
+                # Nothing to write; Django would skip the query and signals too
+                return
+        super().save(*args, update_fields=update_fields, **kwargs)
+        self.mark_clean(update_fields)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self.mark_clean(fields)
+
+
+class User(DirtyFieldsMixin, AbstractUser):
     username= None
     # Basic user information
     email = models.EmailField(('email address'), unique=True)
@@ -14,12 +65,8 @@ class User(AbstractUser):
     date_of_birth = models.DateField(null=True, blank=True)
     is_newsletter_interested = models.BooleanField(default=False)
     
-    # Email verification fields
+    # Email verification field; OTPs live in OneTimeToken
     email_verified = models.BooleanField(default=False)
-    email_verification_token = models.CharField(max_length=10, null=True, blank=True)
-    
-    # Password reset field
-    password_reset_token = models.CharField(max_length=10, null=True, blank=True)
     
     # Push notification token for mobile
     device_token = models.CharField(max_length=255, null=True, blank=True)
@@ -29,6 +76,16 @@ class User(AbstractUser):
     
     #cUSERNAME_FIELD = 'email'
     objects = CustomUserManager()
+
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Serves every email lookup through UserQuerySet.by_email()
+            models.UniqueConstraint(Lower('email'), name='user_email_lower_uniq'),
+        ]
+        indexes = [
+            # Only the few users who never verified: purge_stale_accounts
+            models.Index(fields=['date_joined'], name='user_unverified_idx', condition=models.Q(email_verified=False)),
+        ]
     
     def __str__(self):
         return f"{self.first_name} ({self.email})"
@@ -40,4 +97,102 @@ class User(AbstractUser):
             return today.year - self.date_of_birth.year - (
                 (today.month, today.day) < (self.date_of_birth.month, self.date_of_birth.day)
             )
-        return None
\ No newline at end of file
+        return None
+
+class OneTimeToken(models.Model):
+    """Hashed OTP for one user and one purpose
+
+    Only an HMAC of the code is stored, so the unique index can be used for
+    lookups without keeping usable codes in the database.
+    """
+    VERIFY_EMAIL = 'verify_email'
+    PASSWORD_RESET = 'password_reset'
+    PURPOSE_CHOICES = [
+        (VERIFY_EMAIL, 'Verify email'),
+        (PASSWORD_RESET, 'Password reset'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='one_time_tokens')
+    purpose = models.CharField(max_length=20, choices=PURPOSE_CHOICES)
+    token_hash = models.CharField(max_length=64)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['purpose', 'token_hash'], name='otp_purpose_hash_uniq'),
+            models.UniqueConstraint(fields=['user', 'purpose'], name='otp_user_purpose_uniq'),
+        ]
+        indexes = [
+            # Reset codes are only deleted when used; purge_stale_accounts
+            # finds the expired ones here
+            models.Index(fields=['expires_at'], name='otp_reset_expiry_idx', condition=models.Q(purpose='password_reset')),
+        ]
+
+    def __str__(self):
+        return f"{self.purpose} for {self.user_id}"
+
+
+class OutboxEmail(models.Model):
+    """Email queued by a request and delivered by the send_outbox worker"""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
+
+
+class NewsletterCampaign(models.Model):
+    """Newsletter mailed to opted-in users by the send_newsletter command
+
+    last_user_id is the checkpoint: every opted-in user up to that id has
+    been handed to the mail server, so an interrupted run resumes after it.
+    heartbeat_at is refreshed at each checkpoint and keeps a second run from
+    sending the same campaign while the first is alive.
+    """
+    DRAFT = 'draft'
+    SENDING = 'sending'
+    SENT = 'sent'
+    STATUS_CHOICES = [
+        (DRAFT, 'Draft'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    # Django template rendered per user with first_name, last_name and email
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=DRAFT)
+    last_user_id = models.PositiveBigIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} ({self.status})"
@@ -0,0 +1,236 @@
+"""Newsletter campaigns to users with is_newsletter_interested
+
+The audience is streamed in id order through a server-side cursor
+(QuerySet.iterator()), and each batch is rendered only when a connection
+is free to send it, so memory stays flat however many users opted in.
+Batches go out over a small pool of persistent connections, one
+send_messages() call per batch, no faster than NEWSLETTER['RATE'].
+
+Progress is checkpointed as the highest user id up to which every batch
+has been handed over (NewsletterCampaign.last_user_id). A run that stops
+resumes after it; batches still in flight when it stopped are sent again,
+so delivery is at least once.
+"""
+import queue
+import smtplib
+import time
+from collections import deque
+from concurrent import futures
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Q
+from django.template import Context, Engine
+from django.utils import timezone
+
+from backends.instrumentation import timed
+
+from .models import NewsletterCampaign, User
+
+# Plain text bodies: no HTML escaping of names
+_engine = Engine(autoescape=False)
+
+
+def get_config():
+    """Return the newsletter settings with defaults filled in"""
+    config = {
+        'BATCH_SIZE': 100,
+        'CONNECTIONS': 4,
+        'RATE': 50,
+        'CHUNK_SIZE': 2000,
+        'LEASE': 5 * 60,
+    }
+    config.update(getattr(settings, 'NEWSLETTER', {}))
+    return config
+
+
+class CampaignBusy(Exception):
+    """The campaign is already sent, or another run checkpointed it recently"""
+
+
+def audience(after=0):
+    """(id, email, first_name, last_name) of opted-in users with id > after, in id order"""
+    return (
+        User.objects.filter(is_newsletter_interested=True, is_active=True, pk__gt=after)
+        .order_by('pk')
+        .values_list('pk', 'email', 'first_name', 'last_name')
+    )
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class RateLimiter:
+    """Spaces out sends to at most rate messages per second; 0 for no limit"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_at = 0.0
+
+    def wait(self, count):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        # Time left unused while idle is not saved up for a burst
+        start = max(self.next_at, now)
+        self.next_at = start + count * self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ConnectionPool:
+    """A fixed set of email connections, each kept open between batches"""
+
+    def __init__(self, size, backend=None):
+        self.connections = [get_connection(backend, fail_silently=False) for _ in range(size)]
+        self.idle = queue.SimpleQueue()
+        for connection in self.connections:
+            self.idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.idle.get()
+        try:
+            # No-op when already open; send_messages() would otherwise
+            # open and close it around every batch
+            connection.open()
+            yield connection
+        finally:
+            self.idle.put(connection)
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+
+def render(campaign, template, row):
+    user_id, email, first_name, last_name = row
+    return EmailMessage(
+        subject=campaign.subject,
+        body=template.render(Context({'first_name': first_name, 'last_name': last_name, 'email': email})),
+        from_email=campaign.from_email or settings.EMAIL_HOST_USER,
+        to=[email],
+    )
+
+
+def send_batch(pool, campaign, template, rows):
+    """Render and send one batch over a pooled connection; returns (sent, failed)
+
+    If the batch fails it is sent again one message at a time, counting
+    addresses the server refuses as failed. Any other error, like a lost
+    connection, propagates and stops the run.
+    """
+    messages = [render(campaign, template, row) for row in rows]
+    with pool.connection() as connection:
+        try:
+            with timed('smtp'):
+                connection.send_messages(messages)
+            return len(messages), 0
+        except Exception:
+            connection.close()
+        failed = 0
+        for message in messages:
+            try:
+                with timed('smtp'):
+                    connection.open()
+                    connection.send_messages([message])
+            except smtplib.SMTPRecipientsRefused:
+                failed += 1
+        return len(messages) - failed, failed
+
+
+def claim(campaign, lease):
+    """Mark the campaign as sending for this run, unless another run holds it"""
+    now = timezone.now()
+    claimed = NewsletterCampaign.objects.filter(
+        Q(heartbeat_at__isnull=True) | Q(heartbeat_at__lt=now - timedelta(seconds=lease)),
+        pk=campaign.pk,
+    ).exclude(status=NewsletterCampaign.SENT).update(status=NewsletterCampaign.SENDING, heartbeat_at=now)
+    if not claimed:
+        raise CampaignBusy(f"Campaign {campaign.pk} is already sent or being sent")
+
+
+class Checkpoint:
+    """Advances last_user_id over the batches completed in submission order"""
+
+    def __init__(self, campaign):
+        self.campaign = campaign
+        self.pending = deque()
+
+    def add(self, last_user_id, future):
+        self.pending.append((last_user_id, future))
+
+    def advance(self):
+        """Record the completed prefix of pending batches; re-raises their errors"""
+        sent = failed = 0
+        last_user_id = None
+        try:
+            while self.pending and self.pending[0][1].done():
+                batch_sent, batch_failed = self.pending[0][1].result()
+                last_user_id, _ = self.pending.popleft()
+                sent += batch_sent
+                failed += batch_failed
+        finally:
+            if last_user_id is not None:
+                NewsletterCampaign.objects.filter(pk=self.campaign.pk).update(
+                    last_user_id=last_user_id,
+                    sent=F('sent') + sent,
+                    failed=F('failed') + failed,
+                    heartbeat_at=timezone.now(),
+                )
+
+    def wait(self, limit=0):
+        """Block until at most limit batches are pending"""
+        self.advance()
+        while len(self.pending) > limit:
+            futures.wait([future for _, future in self.pending], return_when=futures.FIRST_COMPLETED)
+            self.advance()
+
+
+def send_campaign(campaign, backend=None, **options):
+    """Send campaign to its remaining audience; returns the refreshed campaign
+
+    options override NEWSLETTER settings for this run, e.g. RATE. Raises
+    CampaignBusy if another run holds the campaign. On any other error the
+    campaign is released with last_error set and can be resumed.
+    """
+    config = {**get_config(), **options}
+    template = _engine.from_string(campaign.body)
+    claim(campaign, config['LEASE'])
+    campaign.refresh_from_db()
+    rows = audience(campaign.last_user_id).iterator(chunk_size=config['CHUNK_SIZE'])
+    limiter = RateLimiter(config['RATE'])
+    pool = ConnectionPool(config['CONNECTIONS'], backend)
+    checkpoint = Checkpoint(campaign)
+    try:
+        with futures.ThreadPoolExecutor(config['CONNECTIONS']) as executor:
+            try:
+                for batch in batched(rows, config['BATCH_SIZE']):
+                    # One batch queued per connection besides those being sent
+                    checkpoint.wait(2 * config['CONNECTIONS'] - 1)
+                    limiter.wait(len(batch))
+                    checkpoint.add(batch[-1][0], executor.submit(send_batch, pool, campaign, template, batch))
+                checkpoint.wait()
+            except BaseException:
+                for _, future in checkpoint.pending:
+                    future.cancel()
+                raise
+    except BaseException as e:
+        # Interrupted runs too, so a resume need not wait for the lease
+        NewsletterCampaign.objects.filter(pk=campaign.pk).update(heartbeat_at=None, last_error=str(e) or repr(e))
+        raise
+    finally:
+        # Closes the cursor while the database connection is still open
+        rows.close()
+        pool.close()
+    NewsletterCampaign.objects.filter(pk=campaign.pk).update(
+        status=NewsletterCampaign.SENT, heartbeat_at=None, finished_at=timezone.now(),
+    )
+    campaign.refresh_from_db()
+    return campaign
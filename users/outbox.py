@@ -0,0 +1,119 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from backends.instrumentation import timed
+
+from .models import OutboxEmail
+
+
+def get_config():
+    """Return the outbox settings with defaults filled in"""
+    config = {
+        'BATCH_SIZE': 50,
+        'MAX_ATTEMPTS': 8,
+        'BACKOFF': 30,
+        'MAX_BACKOFF': 60 * 60,
+        'LEASE': 5 * 60,
+    }
+    config.update(getattr(settings, 'EMAIL_OUTBOX', {}))
+    return config
+
+
+def enqueue_mail(subject, message, recipient_list, from_email=None):
+    """Queue an email; it is committed with the caller's transaction"""
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.EMAIL_HOST_USER,
+        recipients=list(recipient_list),
+    )
+
+
+def claim_batch(size, lease):
+    """Lease and return due pending emails for lease seconds
+
+    The rows are locked only while their next_attempt_at is pushed past
+    the lease, so other workers skip them without a transaction being held
+    open while they are sent. Emails a crashed worker did not get to are
+    due again once the lease runs out.
+    """
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.PENDING, next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at')[:size]
+        )
+        if emails:
+            OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+                next_attempt_at=timezone.now() + timedelta(seconds=lease),
+            )
+    return emails
+
+
+def _to_message(email, connection):
+    return EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.recipients,
+        connection=connection,
+    )
+
+
+def _mark_failed(email, error, config):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= config['MAX_ATTEMPTS']:
+        email.status = OutboxEmail.FAILED
+    else:
+        backoff = min(config['BACKOFF'] * 2 ** (email.attempts - 1), config['MAX_BACKOFF'])
+        email.next_attempt_at = timezone.now() + timedelta(seconds=backoff)
+
+
+def deliver(emails, connection, config):
+    """Send claimed emails one at a time over one open connection
+
+    Each email's outcome is saved as soon as the server answers, so a
+    failure or crash partway through a batch only retries the emails that
+    did not go out. The connection is reopened for the next email after a
+    failure.
+    """
+    failed = 0
+    for email in emails:
+        try:
+            with timed('smtp'):
+                connection.open()
+                connection.send_messages([_to_message(email, connection)])
+        except Exception as e:
+            connection.close()
+            _mark_failed(email, e, config)
+            failed += 1
+        else:
+            email.status = OutboxEmail.SENT
+            email.sent_at = timezone.now()
+            email.attempts += 1
+            email.last_error = ''
+        email.save(update_fields=['status', 'sent_at', 'attempts', 'last_error', 'next_attempt_at'])
+    return len(emails) - failed, failed
+
+
+def drain(connection=None, batch_size=None):
+    """Deliver due emails until none are left; returns (sent, failed)
+
+    The connection is left open so a long-running worker reuses it.
+    """
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    connection = connection or get_connection(fail_silently=False)
+    sent = failed = 0
+    while True:
+        emails = claim_batch(batch_size, config['LEASE'])
+        if not emails:
+            return sent, failed
+        batch_sent, batch_failed = deliver(emails, connection, config)
+        sent += batch_sent
+        failed += batch_failed
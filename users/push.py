@@ -0,0 +1,282 @@
+"""Push notification fan-out to User.device_token
+
+Targets are streamed out of users_user in keyset-paginated chunks
+(WHERE id > <last id> ORDER BY id LIMIT n), so memory stays flat however
+many users match. Each chunk is split into provider-sized batches that are
+sent concurrently over one pooled aiohttp session.
+
+The provider speaks the multicast shape of FCM's HTTP API: a POST of
+{"registration_ids": [...], "notification": {...}, "data": {...}} answered
+with one result per token, {"message_id": ...} or {"error": ...}. Tokens the
+provider reports as unknown are cleared in bulk UPDATEs; transiently failed
+ones are sent again in later batches.
+"""
+import asyncio
+import time
+
+import aiohttp
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from customer.resilience import make_retry
+
+from .auth import invalidate_many
+
+User = get_user_model()
+
+# Fields the send_push command may filter on
+FILTER_FIELDS = {
+    'id', 'email', 'email_verified', 'is_active', 'is_newsletter_interested',
+    'date_joined', 'last_login', 'date_of_birth',
+}
+
+# Per-token errors: the token will never work again, or may on another try
+INVALID_ERRORS = {'NotRegistered', 'InvalidRegistration', 'MismatchSenderId'}
+RETRYABLE_ERRORS = {'Unavailable', 'InternalServerError'}
+
+
+def get_config():
+    """Return the push settings with defaults filled in"""
+    config = {
+        'URI': None,
+        'API_KEY': None,
+        'BATCH_SIZE': 500,
+        'CHUNK_SIZE': 5000,
+        'MAX_CONCURRENT': 16,
+        'CONNECT_TIMEOUT': 3.0,
+        'READ_TIMEOUT': 30.0,
+        'RETRY_ATTEMPTS': 3,
+        'RETRY_BACKOFF': 0.5,
+        'RETRY_MAX_BACKOFF': 30.0,
+        'RETRY_JITTER': 0.3,
+        'PRUNE_BATCH_SIZE': 1000,
+    }
+    config.update(getattr(settings, 'PUSH', {}))
+    return config
+
+
+class PushProviderError(Exception):
+    """A whole batch failed: connection error, timeout or non-2xx response"""
+
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class PushReport:
+    """Outcome counters of one dispatch()"""
+
+    def __init__(self):
+        self.targeted = 0
+        self.sent = 0
+        self.failed = 0
+        self.invalid = 0
+        self.pruned = 0
+        self.retried = 0
+        self.batches = 0
+        self.elapsed = 0.0
+
+    def as_dict(self):
+        return {
+            **{name: getattr(self, name) for name in (
+                'targeted', 'sent', 'failed', 'invalid', 'pruned', 'retried', 'batches')},
+            "elapsed": round(self.elapsed, 3),
+            "sends_per_second": round(self.sent / self.elapsed, 1) if self.elapsed else 0,
+        }
+
+
+def parse_filters(expressions):
+    """Turn "field[__lookup]=value" strings into filter() keyword arguments
+
+    Only FILTER_FIELDS can be used, so targeting cannot reach passwords or
+    related tables. true/false become booleans and __in values are split
+    on commas; Django converts the rest.
+    """
+    lookups = {}
+    for expression in expressions:
+        key, sep, value = expression.partition('=')
+        if not sep:
+            raise ValueError(f"Expected field=value, got {expression!r}")
+        field, _, lookup = key.partition('__')
+        if field not in FILTER_FIELDS or '__' in lookup:
+            raise ValueError(f"Cannot filter on {key!r}; use one of {', '.join(sorted(FILTER_FIELDS))}")
+        if lookup == 'in':
+            value = value.split(',')
+        elif value.lower() in ('true', 'false'):
+            value = value.lower() == 'true'
+        lookups[key] = value
+    return lookups
+
+
+def targets(filters=None):
+    """Users with a device token, matching filters (see parse_filters())"""
+    # > '' excludes both NULL and empty tokens in one predicate
+    return User.objects.filter(**(filters or {})).filter(device_token__gt='')
+
+
+def fetch_chunk(queryset, after, size):
+    """Up to size (id, device_token) pairs with id > after, in id order"""
+    return list(queryset.filter(pk__gt=after).order_by('pk').values_list('pk', 'device_token')[:size])
+
+
+def prune(pairs):
+    """Clear invalid device tokens with one UPDATE per call; returns rows changed
+
+    A row is only cleared if it still holds the reported token, so a token
+    the user replaced meanwhile survives.
+    """
+    if not pairs:
+        return 0
+    user_ids = [user_id for user_id, _ in pairs]
+    cleared = User.objects.filter(
+        pk__in=user_ids,
+        device_token__in=[token for _, token in pairs],
+    ).update(device_token=None)
+    invalidate_many(user_ids)
+    return cleared
+
+
+class Dispatcher:
+    """Sends one message to a stream of (user id, token) pairs"""
+
+    def __init__(self, session, payload, config):
+        self.session = session
+        self.payload = payload
+        self.config = config
+        self.retry = make_retry(
+            attempts=config['RETRY_ATTEMPTS'],
+            start_timeout=config['RETRY_BACKOFF'],
+            max_timeout=config['RETRY_MAX_BACKOFF'],
+            jitter=config['RETRY_JITTER'],
+        )
+        self.report = PushReport()
+        self.slots = asyncio.Semaphore(config['MAX_CONCURRENT'])
+        self.tasks = set()
+        self.invalid = []
+        self.retry_later = []
+
+    async def post(self, tokens):
+        headers = {'Authorization': f"key={self.config['API_KEY']}"} if self.config['API_KEY'] else {}
+        try:
+            async with self.session.post(
+                f"{self.config['URI']}/send",
+                json={**self.payload, "registration_ids": tokens},
+                headers=headers,
+            ) as response:
+                if response.status == 429 or response.status >= 500:
+                    retry_after = response.headers.get('Retry-After')
+                    raise PushProviderError(
+                        f"HTTP {response.status}",
+                        retryable=True,
+                        retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+                    )
+                if response.status >= 400:
+                    raise PushProviderError(f"HTTP {response.status}")
+                results = (await response.json(content_type=None))['results']
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise PushProviderError(str(e) or e.__class__.__name__, retryable=True) from e
+        except (ValueError, KeyError, TypeError) as e:
+            raise PushProviderError(f"Unusable response: {e}") from e
+        if len(results) != len(tokens):
+            raise PushProviderError("Result count does not match the batch")
+        return results
+
+    async def send_batch(self, batch, attempt=0):
+        """Send one batch, retrying whole-batch failures with backoff"""
+        try:
+            for retry in range(self.retry.attempts):
+                try:
+                    results = await self.post([token for _, token in batch])
+                    break
+                except PushProviderError as e:
+                    if not e.retryable or retry + 1 == self.retry.attempts:
+                        self.report.failed += len(batch)
+                        return
+                    await asyncio.sleep(e.retry_after or self.retry.get_timeout(retry))
+            self.report.batches += 1
+            for pair, result in zip(batch, results):
+                error = result.get('error')
+                if not error:
+                    self.report.sent += 1
+                elif error in INVALID_ERRORS:
+                    self.report.invalid += 1
+                    self.invalid.append(pair)
+                elif error in RETRYABLE_ERRORS and attempt + 1 < self.retry.attempts:
+                    self.report.retried += 1
+                    self.retry_later.append(pair)
+                else:
+                    self.report.failed += 1
+        finally:
+            self.slots.release()
+
+    async def submit(self, batch, attempt=0):
+        # Waiting for a slot also keeps the next chunk from being fetched early
+        await self.slots.acquire()
+        task = asyncio.create_task(self.send_batch(batch, attempt))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        if len(self.invalid) >= self.config['PRUNE_BATCH_SIZE']:
+            await self.flush_invalid()
+
+    async def flush_invalid(self):
+        pairs, self.invalid = self.invalid, []
+        self.report.pruned += await sync_to_async(prune)(pairs)
+
+    async def run(self, queryset):
+        batch_size = self.config['BATCH_SIZE']
+        start = time.perf_counter()
+        after = 0
+        while True:
+            chunk = await sync_to_async(fetch_chunk)(queryset, after, self.config['CHUNK_SIZE'])
+            if not chunk:
+                break
+            after = chunk[-1][0]
+            self.report.targeted += len(chunk)
+            for i in range(0, len(chunk), batch_size):
+                await self.submit(chunk[i:i + batch_size])
+        # Tokens that failed transiently go out again, in rounds, once every
+        # batch of the previous round has finished
+        attempt = 0
+        while self.tasks or self.retry_later:
+            await asyncio.gather(*list(self.tasks))
+            retries, self.retry_later = self.retry_later, []
+            if not retries:
+                continue
+            await asyncio.sleep(self.retry.get_timeout(attempt))
+            attempt += 1
+            for i in range(0, len(retries), batch_size):
+                await self.submit(retries[i:i + batch_size], attempt)
+        await self.flush_invalid()
+        self.report.elapsed = time.perf_counter() - start
+        return self.report
+
+
+def make_session(config):
+    connector = aiohttp.TCPConnector(limit=config['MAX_CONCURRENT'])
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(
+            sock_connect=config['CONNECT_TIMEOUT'],
+            sock_read=config['READ_TIMEOUT'],
+        ),
+    )
+
+
+async def adispatch(title, body, data=None, filters=None, **options):
+    """Send a notification to every targeted user's device; returns a PushReport
+
+    options override PUSH settings for this call, e.g. BATCH_SIZE.
+    """
+    config = {**get_config(), **options}
+    if not config['URI']:
+        raise PushProviderError("PUSH['URI'] is not configured")
+    payload = {"notification": {"title": title, "body": body}, "data": data or {}}
+    async with make_session(config) as session:
+        return await Dispatcher(session, payload, config).run(targets(filters))
+
+
+def dispatch(title, body, data=None, filters=None, **options):
+    """Sync variant of adispatch(), for commands and workers"""
+    return async_to_sync(adispatch)(title, body, data=data, filters=filters, **options)
@@ -27,6 +27,8 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             'first_name', 'last_name', 'email', 'phone_number',
             'date_of_birth', 'is_newsletter_interested', 'password', 'confirm_password'
         ]
+        # validate_email() checks uniqueness case-insensitively instead
+        extra_kwargs = {'email': {'validators': []}}
     
     def validate(self, data):
         if data.get('password') != data.get('confirm_password'):
@@ -34,7 +36,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return data
     
     def validate_email(self, value):
-        if User.objects.filter(email=value).exists():
+        if User.objects.by_email(value).exists():
             raise serializers.ValidationError("User with this email already exists")
         return value
     
@@ -1,3 +1,1237 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import importlib
+import importlib.util
+import io
+import json
+import os
+import re
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+
+from backends import checks, db, env, replicas, throttling
+from backends.sessions import DB_EXPIRY_KEY, SessionStore
+
+from .auth import from_snapshot, get_cache, invalidate, snapshot_key, take_snapshot
+from . import hashing, newsletter, outbox, push, views
+from .models import NewsletterCampaign, OneTimeToken, OutboxEmail, User
+from .tokens import consume_token, expired_reset_tokens, hash_token, issue_token
+
+FAST_HASHING = override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'POOL_WORKERS': 0},
+)
+
+TABLES = ('users_user', 'users_onetimetoken')
+
+# A Redis server that refuses connections, for the paths that must survive an outage
+UNREACHABLE_REDIS = override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:1/0',
+        'OPTIONS': {'CLIENT_CLASS': 'backends.cache.InstrumentedRedisClient'},
+    },
+    'localcache': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-unreachable'},
+})
+
+# The async views, which users.urls routes only when ASYNC_VIEWS is on
+urlpatterns = [
+    path('register/', views.AsyncRegisterUserView.as_view()),
+    path('login/', views.AsyncLoginView.as_view()),
+    path('verify-email/', views.AsyncVerifyEmailView.as_view()),
+    path('users/me/', views.AsyncUserMeView.as_view()),
+]
+
+
+def statements(queries):
+    """(verb, table, assigned columns, WHERE columns) of each statement on TABLES
+
+    Assigned columns are those of an UPDATE's SET clause, in order; WHERE
+    columns are sorted. Transaction control statements are left out.
+    """
+    result = []
+    for query in queries:
+        sql = query['sql']
+        if sql in ('BEGIN', 'COMMIT') or sql.startswith(('SAVEPOINT', 'RELEASE SAVEPOINT')):
+            continue
+        verb = sql.split(' ', 1)[0]
+        table = re.search(r'(?:FROM|UPDATE|INTO) "(\w+)"', sql).group(1)
+        if table not in TABLES:
+            continue
+        head, _, where = sql.partition(' WHERE ')
+        assigned = re.findall(r'"(\w+)" = ', head.partition(' SET ')[2]) if verb == 'UPDATE' else []
+        result.append((
+            verb,
+            table,
+            tuple(assigned),
+            tuple(sorted(set(re.findall(rf'"{table}"\."(\w+)"', where)))),
+        ))
+    return result
+
+
+class FreshLimiterMixin:
+    """Start each test with no rate limiter hits counted"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(throttling, '_limiter', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class LockFootprintMixin:
+    def assertNoRowLocks(self, queries):
+        # Only caught on databases that support SELECT ... FOR UPDATE (not SQLite)
+        for query in queries:
+            self.assertNotIn('FOR UPDATE', query['sql'])
+
+
+@FAST_HASHING
+class DirtyFieldsTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('dirty@example.com', 'Pass-word-123')
+        self.user = User.objects.get(pk=user.pk)
+
+    def test_save_writes_changed_columns_only(self):
+        self.user.first_name = 'Ada'
+        self.user.is_newsletter_interested = True
+        with CaptureQueriesContext(connection) as queries:
+            self.user.save()
+        self.assertEqual(statements(queries), [
+            ('UPDATE', 'users_user', ('first_name', 'is_newsletter_interested'), ('id',)),
+        ])
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, 'Ada')
+
+    def test_unchanged_save_is_skipped(self):
+        with self.assertNumQueries(0):
+            self.user.save()
+
+    def test_saved_fields_become_clean(self):
+        self.user.last_name = 'Lovelace'
+        self.user.save()
+        self.user.phone_number = '+10000000000'
+        self.user.save(update_fields=['phone_number'])
+        with self.assertNumQueries(0):
+            self.user.save()
+
+    def test_refresh_resets_tracking(self):
+        User.objects.filter(pk=self.user.pk).update(first_name='Grace')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.dirty_fields(), [])
+
+    def test_snapshot_users_are_tracked(self):
+        user = from_snapshot(take_snapshot(self.user))
+        user.device_token = 'token'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertEqual(statements(queries), [('UPDATE', 'users_user', ('device_token',), ('id',))])
+
+
+@FAST_HASHING
+class TokenTests(LockFootprintMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('token@example.com', 'Pass-word-123')
+
+    def test_reissue_is_one_update(self):
+        issue_token(self.user, OneTimeToken.VERIFY_EMAIL)
+        with CaptureQueriesContext(connection) as queries:
+            issue_token(self.user, OneTimeToken.VERIFY_EMAIL)
+        self.assertEqual(statements(queries), [
+            ('DELETE', 'users_onetimetoken', (), ('expires_at', 'purpose', 'token_hash')),
+            ('UPDATE', 'users_onetimetoken', ('token_hash', 'expires_at'), ('purpose', 'user_id')),
+        ])
+        self.assertNoRowLocks(queries)
+        self.assertEqual(OneTimeToken.objects.filter(user=self.user).count(), 1)
+
+    def test_consume_is_compare_and_delete(self):
+        code = issue_token(self.user, OneTimeToken.VERIFY_EMAIL)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(consume_token(OneTimeToken.VERIFY_EMAIL, code), self.user.pk)
+        self.assertEqual(statements(queries), [
+            ('SELECT', 'users_onetimetoken', (), ('expires_at', 'purpose', 'token_hash')),
+            ('DELETE', 'users_onetimetoken', (), ('id', 'token_hash')),
+        ])
+        self.assertNoRowLocks(queries)
+
+    def test_code_is_consumed_once(self):
+        code = issue_token(self.user, OneTimeToken.VERIFY_EMAIL)
+        self.assertEqual(consume_token(OneTimeToken.VERIFY_EMAIL, code), self.user.pk)
+        self.assertIsNone(consume_token(OneTimeToken.VERIFY_EMAIL, code))
+
+    def test_code_replaced_after_lookup_is_not_consumed(self):
+        code = issue_token(self.user, OneTimeToken.VERIFY_EMAIL)
+        delete = QuerySet.delete
+
+        def reissue_then_delete(queryset):
+            # Another request replaces the code between lookup and delete
+            with mock.patch.object(QuerySet, 'delete', delete):
+                issue_token(self.user, OneTimeToken.VERIFY_EMAIL)
+            return delete(queryset)
+
+        with mock.patch.object(QuerySet, 'delete', reissue_then_delete):
+            self.assertIsNone(consume_token(OneTimeToken.VERIFY_EMAIL, code))
+        self.assertTrue(OneTimeToken.objects.filter(user=self.user).exists())
+
+
+@FAST_HASHING
+class EndpointSQLTests(FreshLimiterMixin, LockFootprintMixin, TestCase):
+    """Statements each write endpoint sends for users and codes
+
+    Rows are only locked by single-row UPDATE and DELETE statements, which
+    compare the values they depend on instead of locking a prior SELECT.
+    """
+    password = 'Pass-word-123'
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('endpoint@example.com', self.password, email_verified=True)
+        # Ids are reused between tests; drop any snapshot left behind
+        invalidate(self.user.pk)
+
+    def post(self, url, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data, content_type='application/json')
+        self.assertNoRowLocks(queries)
+        return response, statements(queries)
+
+    def login(self):
+        self.client.force_login(self.user)
+        # Seeds the user's snapshot, as any earlier request would
+        self.client.get('/api/auth/users/me/')
+
+    def test_verify_email(self):
+        User.objects.filter(pk=self.user.pk).update(email_verified=False)
+        code = issue_token(self.user, OneTimeToken.VERIFY_EMAIL)
+        get_cache().set(snapshot_key(self.user.pk), take_snapshot(self.user))
+        with self.captureOnCommitCallbacks(execute=True):
+            response, sql = self.post('/api/auth/verify-email/', {"token": code})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sql, [
+            ('SELECT', 'users_onetimetoken', (), ('expires_at', 'purpose', 'token_hash')),
+            ('DELETE', 'users_onetimetoken', (), ('id', 'token_hash')),
+            ('UPDATE', 'users_user', ('email_verified',), ('email_verified', 'id')),
+        ])
+        self.assertTrue(User.objects.get(pk=self.user.pk).email_verified)
+        self.assertIsNone(get_cache().get(snapshot_key(self.user.pk)))
+
+    def test_verify_email_of_verified_user(self):
+        code = issue_token(self.user, OneTimeToken.VERIFY_EMAIL)
+        response, sql = self.post('/api/auth/verify-email/', {"token": code})
+        self.assertEqual(response.status_code, 400)
+        # The conditional UPDATE matches no row
+        self.assertEqual(sql[-1], ('UPDATE', 'users_user', ('email_verified',), ('email_verified', 'id')))
+
+    def test_verify_email_with_bad_code(self):
+        response, sql = self.post('/api/auth/verify-email/', {"token": "000000"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sql, [('SELECT', 'users_onetimetoken', (), ('expires_at', 'purpose', 'token_hash'))])
+
+    def test_password_reset_confirm(self):
+        code = issue_token(self.user, OneTimeToken.PASSWORD_RESET)
+        response, sql = self.post('/api/auth/password/reset-confirm/', {
+            "token": code, "new_password": "New-pass-word-1", "confirm_password": "New-pass-word-1",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sql, [
+            ('SELECT', 'users_onetimetoken', (), ('expires_at', 'purpose', 'token_hash')),
+            ('DELETE', 'users_onetimetoken', (), ('id', 'token_hash')),
+            ('UPDATE', 'users_user', ('password',), ('id',)),
+        ])
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password("New-pass-word-1"))
+
+    def test_update_device_token(self):
+        self.login()
+        response, sql = self.post('/api/auth/users/update_device_token/', {"device_token": "device-1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sql, [('UPDATE', 'users_user', ('device_token',), ('id',))])
+
+    def test_password_change(self):
+        self.login()
+        response, sql = self.post('/api/auth/password/change/', {
+            "current_password": self.password,
+            "new_password": "New-pass-word-1",
+            "confirm_password": "New-pass-word-1",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sql, [('UPDATE', 'users_user', ('password',), ('id',))])
+
+
+@FAST_HASHING
+class NewsletterTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(f'reader{i}@example.com', first_name=f'Reader{i}', is_newsletter_interested=True)
+            for i in range(5)
+        ]
+        User.objects.create_user('inactive@example.com', is_newsletter_interested=True, is_active=False)
+        User.objects.create_user('optout@example.com')
+        self.campaign = NewsletterCampaign.objects.create(subject="News", body="Hi {{ first_name }} & co")
+
+    def send(self, **options):
+        return newsletter.send_campaign(self.campaign, **{'RATE': 0, 'BATCH_SIZE': 2, 'CONNECTIONS': 1, **options})
+
+    def test_sends_to_opted_in_users(self):
+        campaign = self.send(CONNECTIONS=2)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            [user.email for user in self.users],
+        )
+        self.assertIn("Hi Reader0 & co", [message.body for message in mail.outbox])
+        self.assertEqual((campaign.status, campaign.sent, campaign.failed), (NewsletterCampaign.SENT, 5, 0))
+        self.assertEqual(campaign.last_user_id, self.users[-1].pk)
+        self.assertIsNone(campaign.heartbeat_at)
+
+    def test_resumes_after_last_checkpoint(self):
+        send_batch = newsletter.send_batch
+        calls = []
+
+        def fail_second_batch(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise ConnectionError("connection lost")
+            return send_batch(*args)
+
+        with mock.patch.object(newsletter, 'send_batch', fail_second_batch):
+            with self.assertRaises(ConnectionError):
+                self.send()
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.last_user_id, self.users[1].pk)
+        self.assertEqual(self.campaign.sent, 2)
+        self.assertEqual(self.campaign.last_error, "connection lost")
+        self.assertIsNone(self.campaign.heartbeat_at)
+
+        campaign = self.send()
+        self.assertEqual(sorted({message.to[0] for message in mail.outbox}), [user.email for user in self.users])
+        # At most the batch queued behind the failed one went out twice
+        self.assertLessEqual(len(mail.outbox), 5 + 2)
+        self.assertEqual((campaign.status, campaign.sent), (NewsletterCampaign.SENT, 5))
+
+    def test_campaign_held_by_another_run_is_not_sent(self):
+        NewsletterCampaign.objects.filter(pk=self.campaign.pk).update(
+            status=NewsletterCampaign.SENDING, heartbeat_at=timezone.now(),
+        )
+        with self.assertRaises(newsletter.CampaignBusy):
+            self.send()
+        self.assertEqual(mail.outbox, [])
+        # A run that stopped checkpointing is presumed dead
+        self.assertEqual(self.send(LEASE=0).sent, 5)
+
+    def test_sent_campaign_is_not_sent_again(self):
+        self.send()
+        with self.assertRaises(newsletter.CampaignBusy):
+            self.send()
+        self.assertEqual(len(mail.outbox), 5)
+
+
+class QueryPlanTests(TestCase):
+    """Hot lookups stay index searches
+
+    On PostgreSQL sequential scans are disabled for the plan, so one still
+    shows up only when no index can serve the query.
+    """
+
+    def plan(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+    def assertIndexSearch(self, queryset, index=None):
+        plan = self.plan(queryset)
+        # SQLite says "SCAN <table>" for full table or index scans
+        self.assertNotRegex(plan, r'\bSCAN \w+|Seq Scan', plan)
+        if index:
+            self.assertIn(index, plan)
+
+    def test_email_lookups(self):
+        self.assertIndexSearch(User.objects.by_email('Reader@Example.COM'), 'user_email_lower_uniq')
+        self.assertIndexSearch(User.objects.by_emails(['a@example.com', 'b@example.com']), 'user_email_lower_uniq')
+
+    def test_unverified_users(self):
+        self.assertIndexSearch(
+            User.objects.unverified_joined_before(timezone.now()).values_list('pk', flat=True)[:1000],
+            'user_unverified_idx',
+        )
+
+    def test_one_time_codes(self):
+        self.assertIndexSearch(OneTimeToken.objects.filter(
+            purpose=OneTimeToken.PASSWORD_RESET, token_hash=hash_token(OneTimeToken.PASSWORD_RESET, '123456'),
+            expires_at__gt=timezone.now(),
+        ))
+        # SQLite cannot match the partial index's purpose = 'password_reset'
+        # to a bound parameter and searches the (purpose, token_hash) index
+        self.assertIndexSearch(
+            expired_reset_tokens().values_list('pk', flat=True)[:1000],
+            'otp_reset_expiry_idx' if connection.vendor == 'postgresql' else None,
+        )
+
+
+@FAST_HASHING
+class EmailCaseTests(FreshLimiterMixin, TestCase):
+    password = 'Pass-word-123'
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('Reader@Example.com', self.password, email_verified=True)
+        invalidate(self.user.pk)
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json')
+
+    def test_stored_lowercase(self):
+        self.assertEqual(self.user.email, 'reader@example.com')
+
+    def test_registration_is_case_insensitive(self):
+        response = self.post('/api/auth/register/', {
+            "email": "READER@example.com", "first_name": "R", "last_name": "R",
+            "password": self.password, "confirm_password": self.password,
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.json())
+
+    def test_login_is_case_insensitive(self):
+        response = self.post('/api/auth/login/', {"email": "READER@Example.COM", "password": self.password})
+        self.assertEqual(response.status_code, 200)
+
+    def test_reset_request_is_case_insensitive(self):
+        self.post('/api/auth/password/reset-request/', {"email": "reader@EXAMPLE.com"})
+        self.assertTrue(OneTimeToken.objects.filter(user=self.user, purpose=OneTimeToken.PASSWORD_RESET).exists())
+
+    def test_purge_candidates(self):
+        old = timezone.now() - timedelta(days=30)
+        stale = User.objects.create_user('stale@example.com', date_joined=old)
+        User.objects.create_user('admin@example.com', date_joined=old, is_staff=True)
+        User.objects.filter(pk=self.user.pk).update(date_joined=old)
+        self.assertEqual(list(User.objects.unverified_joined_before(timezone.now() - timedelta(days=7))), [stale])
+
+    def test_backfill_lowercases_in_batches(self):
+        migration = importlib.import_module('users.migrations.0006_email_lower_index')
+        User.objects.filter(pk=self.user.pk).update(email='Reader@Example.com')
+        other = User.objects.create_user('other@example.com')
+        with mock.patch.object(migration, 'BATCH_SIZE', 1):
+            migration.normalize_emails(apps, connection.schema_editor())
+        self.assertEqual(
+            list(User.objects.order_by('pk').values_list('email', flat=True)),
+            ['reader@example.com', other.email],
+        )
+
+
+class SessionStoreTests(TestCase):
+    def saved_session(self):
+        session = SessionStore()
+        session['value'] = 1
+        session.save()
+        session = SessionStore(session.session_key)
+        session['value']
+        return session
+
+    def test_unchanged_session_only_touches_cache(self):
+        session = self.saved_session()
+        with self.assertNumQueries(0):
+            session.save()
+
+    def test_changed_session_is_written(self):
+        session = self.saved_session()
+        session['value'] = 2
+        session.save()
+        self.assertEqual(Session.objects.get(pk=session.session_key).get_decoded()['value'], 2)
+
+    def test_database_copy_refreshed_before_it_expires(self):
+        session = self.saved_session()
+        session._get_session()[DB_EXPIRY_KEY] = 0
+        with CaptureQueriesContext(connection) as queries:
+            session.save()
+        self.assertEqual([q['sql'].split(' ', 2)[:2] for q in queries if 'django_session' in q['sql']], [
+            ['UPDATE', '"django_session"'],
+        ])
+        self.assertGreater(Session.objects.get(pk=session.session_key).get_decoded()[DB_EXPIRY_KEY], 0)
+
+    def test_session_evicted_from_cache_is_saved_in_full(self):
+        session = self.saved_session()
+        session._cache.delete(session.cache_key)
+        session.save()
+        self.assertEqual(session._cache.get(session.cache_key)['value'], 1)
+
+
+@FAST_HASHING
+@UNREACHABLE_REDIS
+class UnreachableRedisTests(TestCase):
+    """Sessions and the endpoints using them work from the database alone"""
+    password = 'Pass-word-123'
+
+    def setUp(self):
+        self.user = User.objects.create_user('outage@example.com', self.password, email_verified=True)
+
+    def test_unchanged_session_saved_to_database(self):
+        with self.assertLogs('django.contrib.sessions', 'ERROR'):
+            session = SessionStore()
+            session['value'] = 1
+            session.save()
+            session = SessionStore(session.session_key)
+            self.assertEqual(session['value'], 1)
+            session.save()
+        self.assertTrue(Session.objects.filter(pk=session.session_key).exists())
+
+    async def test_unchanged_session_saved_to_database_async(self):
+        with self.assertLogs('django.contrib.sessions', 'ERROR'):
+            session = SessionStore()
+            await session.aset('value', 1)
+            await session.asave()
+            session = SessionStore(session.session_key)
+            self.assertEqual(await session.aget('value'), 1)
+            await session.asave()
+        self.assertTrue(await Session.objects.filter(pk=session.session_key).aexists())
+
+    def test_authenticated_requests(self):
+        self.client.force_login(self.user)
+        with self.assertLogs('django.contrib.sessions', 'ERROR'):
+            self.assertEqual(self.client.get('/api/auth/users/me/').status_code, 200)
+            response = self.client.post(
+                '/api/auth/users/update_device_token/', {"device_token": "device-1"}, content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 200)
+            response = self.client.post('/api/auth/password/change/', {
+                "current_password": self.password,
+                "new_password": "New-pass-word-1",
+                "confirm_password": "New-pass-word-1",
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+
+class FlakyConnection:
+    """Mail connection refusing the recipients in refuse"""
+
+    def __init__(self, refuse=()):
+        self.refuse = set(refuse)
+        self.sent = []
+        self.opened = 0
+
+    def open(self):
+        self.opened += 1
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0] in self.refuse:
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+            self.sent.append(message.to[0])
+        return len(messages)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.emails = [outbox.enqueue_mail("Code", "123456", [f"user{i}@example.com"]) for i in range(3)]
+
+    def test_delivers_due_emails(self):
+        connection = FlakyConnection()
+        self.assertEqual(outbox.drain(connection), (3, 0))
+        self.assertEqual(connection.sent, [f"user{i}@example.com" for i in range(3)])
+        self.assertEqual(
+            set(OutboxEmail.objects.values_list('status', 'attempts')), {(OutboxEmail.SENT, 1)},
+        )
+        self.assertEqual(outbox.drain(connection), (0, 0))
+
+    def test_failure_partway_does_not_resend_delivered(self):
+        connection = FlakyConnection(refuse=["user1@example.com"])
+        self.assertEqual(outbox.drain(connection), (2, 1))
+        self.assertEqual(connection.sent, ["user0@example.com", "user2@example.com"])
+        failed = OutboxEmail.objects.get(pk=self.emails[1].pk)
+        self.assertEqual((failed.status, failed.attempts), (OutboxEmail.PENDING, 1))
+        self.assertIn('No such user', failed.last_error)
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+
+        # Not due yet; then retried on its own once due
+        self.assertEqual(outbox.drain(connection), (0, 0))
+        OutboxEmail.objects.filter(pk=failed.pk).update(next_attempt_at=timezone.now())
+        connection.refuse.clear()
+        self.assertEqual(outbox.drain(connection), (1, 0))
+        self.assertEqual(connection.sent, ["user0@example.com", "user2@example.com", "user1@example.com"])
+
+    def test_sends_outside_transactions(self):
+        depth = len(connection.atomic_blocks)
+        depths = []
+        mail = FlakyConnection()
+        mail.send_messages = lambda messages: depths.append(len(connection.atomic_blocks))
+        outbox.drain(mail)
+        self.assertEqual(depths, [depth] * 3)
+
+    def test_crash_partway_keeps_delivered_marked(self):
+        mail = FlakyConnection()
+        send = mail.send_messages
+
+        def crash_on_second(messages):
+            if len(mail.sent) == 1:
+                raise KeyboardInterrupt
+            return send(messages)
+        mail.send_messages = crash_on_second
+        with self.assertRaises(KeyboardInterrupt):
+            outbox.drain(mail)
+        statuses = dict(OutboxEmail.objects.values_list('pk', 'status'))
+        self.assertEqual([statuses[email.pk] for email in self.emails], [OutboxEmail.SENT, OutboxEmail.PENDING, OutboxEmail.PENDING])
+
+        # Leased to the crashed worker until the lease runs out
+        mail = FlakyConnection()
+        self.assertEqual(outbox.drain(mail), (0, 0))
+        OutboxEmail.objects.filter(status=OutboxEmail.PENDING).update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.drain(mail), (2, 0))
+        self.assertEqual(mail.sent, ["user1@example.com", "user2@example.com"])
+
+    def test_gives_up_after_max_attempts(self):
+        connection = FlakyConnection(refuse=["user0@example.com"])
+        with self.settings(EMAIL_OUTBOX={'MAX_ATTEMPTS': 2, 'BACKOFF': 0}):
+            outbox.drain(connection)
+            outbox.drain(connection)
+        email = OutboxEmail.objects.get(pk=self.emails[0].pk)
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.FAILED, 2))
+
+
+class SlidingWindowTests(SimpleTestCase):
+    def test_previous_window_weighted_by_overlap(self):
+        wait = throttling.sliding_window_wait
+        self.assertEqual(wait(10, 60000, 0, 0, 0), 0)
+        # A full previous window blocks until enough of it has slid out
+        self.assertEqual(wait(10, 60000, 0, 0, 10), 6000)
+        self.assertEqual(wait(10, 60000, 30000, 0, 10), 0)
+        self.assertEqual(wait(10, 60000, 30000, 10, 0), 30000)
+
+    def test_local_limiter(self):
+        limiter = throttling.LocalLimiter(max_keys=10)
+        self.assertEqual([limiter.hit('k', 3, 1000, 5000) for _ in range(4)][:3], [0, 0, 0])
+        self.assertEqual(limiter.hit('k', 3, 1000, 5500), 500)
+        # Halfway into the next window half of the previous hits still count
+        self.assertEqual(limiter.hit('k', 3, 1000, 6500), 0)
+        self.assertGreater(limiter.hit('k', 3, 1000, 6500), 0)
+        self.assertEqual(limiter.hit('other', 3, 1000, 6500), 0)
+
+    def test_local_limiter_bounded(self):
+        limiter = throttling.LocalLimiter(max_keys=2)
+        for key in 'abc':
+            limiter.hit(key, 1, 1000, 0)
+        self.assertEqual(list(limiter._windows), ['b', 'c'])
+
+    def test_falls_back_to_local_counters(self):
+        limiter = throttling.RedisLimiter(throttling.get_config())
+        # The test cache is not Redis; the local limiter takes over for good
+        self.assertEqual([limiter.hit('k', 2, 60000) for _ in range(3)][:2], [0, 0])
+        self.assertEqual(limiter._down_until, float('inf'))
+
+    def test_retries_redis_after_an_error(self):
+        from redis.exceptions import ConnectionError
+
+        limiter = throttling.RedisLimiter({**throttling.get_config(), 'REDIS_RETRY_INTERVAL': 5})
+        script = mock.Mock(side_effect=ConnectionError)
+        with mock.patch.object(limiter, '_get_script', return_value=script):
+            self.assertEqual(limiter.hit('k', 2, 60000), 0)
+            self.assertEqual(limiter.hit('k', 2, 60000), 0)
+            self.assertEqual(script.call_count, 1)
+            limiter._down_until = 0
+            script.side_effect = None
+            script.return_value = 1234
+            self.assertEqual(limiter.hit('k', 2, 60000), 1234)
+
+
+@FAST_HASHING
+class CodeGuessThrottleTests(FreshLimiterMixin, TestCase):
+    def assertThrottledAfter(self, url, data, limit):
+        with self.assertLogs('django.request', 'WARNING'):
+            for _ in range(limit):
+                response = self.client.post(url, data, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+            response = self.client.post(url, data, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_verify_email(self):
+        self.assertThrottledAfter('/api/auth/verify-email/', {"token": "000000"}, 10)
+
+    def test_password_reset_confirm(self):
+        self.assertThrottledAfter('/api/auth/password/reset-confirm/', {
+            "token": "000000", "new_password": "New-pass-word-1", "confirm_password": "New-pass-word-1",
+        }, 10)
+
+    def test_spoofed_forwarded_for_shares_one_bucket(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            for i in range(11):
+                response = self.client.post(
+                    '/api/auth/verify-email/', {"token": "000000"},
+                    content_type='application/json', HTTP_X_FORWARDED_FOR=f"198.51.100.{i}",
+                )
+        self.assertEqual(response.status_code, 429)
+
+    def test_forwarded_for_read_num_proxies_back(self):
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}), \
+                self.assertLogs('django.request', 'WARNING'):
+            for i in range(11):
+                response = self.client.post(
+                    '/api/auth/verify-email/', {"token": "000000"},
+                    content_type='application/json', HTTP_X_FORWARDED_FOR=f"198.51.100.{i}, 203.0.113.7",
+                )
+            self.assertEqual(response.status_code, 429)
+            response = self.client.post(
+                '/api/auth/verify-email/', {"token": "000000"},
+                content_type='application/json', HTTP_X_FORWARDED_FOR="203.0.113.8",
+            )
+        self.assertEqual(response.status_code, 400)
+
+
+@FAST_HASHING
+class ImportUsersTests(TestCase):
+    def import_rows(self, *emails):
+        stdin = io.StringIO(''.join(
+            json.dumps({"first_name": "Im", "last_name": "Port", "email": email}) + "\n" for email in emails
+        ))
+        out = io.StringIO()
+        with mock.patch('sys.stdin', stdin):
+            call_command('import_users', '-', '--format', 'jsonl', '--workers', '0', stdout=out)
+        return out.getvalue()
+
+    def test_existing_emails_are_duplicates(self):
+        User.objects.create_user('taken@example.com')
+        output = self.import_rows('new@example.com', 'Taken@Example.com', 'new@example.com')
+        self.assertIn('1 created, 2 duplicates, 0 invalid', output)
+
+    def test_rows_skipped_on_conflict_are_not_created(self):
+        # As if the email was taken between the lookup and the insert
+        User.objects.create_user('racer@example.com')
+        with mock.patch('users.bulk.existing_emails', return_value=set()):
+            output = self.import_rows('racer@example.com', 'fresh@example.com')
+        self.assertIn('1 created, 1 duplicates, 0 invalid', output)
+        self.assertTrue(User.objects.filter(email='fresh@example.com').exists())
+
+
+@FAST_HASHING
+class UserETagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('etag@example.com', 'Pass-word-123', email_verified=True)
+        invalidate(self.user.pk)
+        self.client.force_login(self.user)
+
+    def test_not_modified_without_running_the_view(self):
+        response = self.client.get('/api/auth/users/me/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"user-'))
+        # The snapshot and session are cached: the 304 costs no queries
+        with self.assertNumQueries(0), mock.patch('users.views.UserSerializer') as serializer:
+            response = self.client.get('/api/auth/users/me/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        serializer.assert_not_called()
+
+    def test_saving_the_user_changes_the_etag(self):
+        etag = self.client.get('/api/auth/users/me/')['ETag']
+        self.user.first_name = 'Changed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.client.get('/api/auth/users/me/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['first_name'], 'Changed')
+
+    def test_anonymous_requests_get_no_etag(self):
+        self.client.logout()
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.get('/api/auth/users/me/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(response.has_header('ETag'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaRouterTests(SimpleTestCase):
+    """Routing decisions; SimpleTestCase, as TestCase runs every test inside atomic()"""
+    router = replicas.PrimaryReplicaRouter()
+
+    def serve(self, get_response, **cookies):
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies)
+        return replicas.ReadYourWritesMiddleware(get_response)(request)
+
+    def read_in_request(self, **cookies):
+        seen = []
+        self.serve(lambda request: seen.append(self.router.db_for_read(User)) or HttpResponse(), **cookies)
+        return seen[0]
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_request_reads_use_replica(self):
+        self.assertEqual(self.read_in_request(), 'replica_0')
+
+    def test_reads_after_a_write_use_primary(self):
+        def view(request):
+            self.assertEqual(self.router.db_for_read(User), 'replica_0')
+            self.assertEqual(self.router.db_for_write(User), 'default')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            return HttpResponse()
+
+        response = self.serve(view)
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+    def test_pinned_client_reads_from_primary(self):
+        self.assertEqual(self.read_in_request(**{replicas.PIN_COOKIE: '1'}), 'default')
+        response = self.serve(lambda request: HttpResponse(), **{replicas.PIN_COOKIE: '1'})
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+    def test_reads_in_atomic_block_use_primary(self):
+        def view(request):
+            with mock.patch.object(connection, 'in_atomic_block', True):
+                self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_read(User), 'replica_0')
+            return HttpResponse()
+
+        self.serve(view)
+
+    def test_use_primary(self):
+        def view(request):
+            with replicas.use_primary():
+                self.assertEqual(self.router.db_for_read(User), 'default')
+            return HttpResponse()
+
+        self.serve(view)
+
+
+@FAST_HASHING
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('metrics@example.com', 'Pass-word-123', email_verified=True)
+        invalidate(self.user.pk)
+        self.client.force_login(self.user)
+
+    def get_metrics(self, **headers):
+        with self.assertLogs('django.request', 'WARNING'):
+            return self.client.get('/metrics', **headers)
+
+    def test_server_timing(self):
+        response = self.client.get('/api/auth/users/me/')
+        self.assertEqual(response.status_code, 200)
+        components = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(components[-1], 'total')
+
+    @override_settings(INSTRUMENTATION={**settings.INSTRUMENTATION, 'METRICS_TOKEN': None})
+    def test_metrics_closed_without_token(self):
+        self.assertEqual(self.get_metrics().status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.get_metrics().status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        invalidate(self.user.pk)
+        self.client.force_login(User.objects.get(pk=self.user.pk))
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'singleflight_events_total', response.content)
+
+    @override_settings(INSTRUMENTATION={**settings.INSTRUMENTATION, 'METRICS_TOKEN': 'scrape-me'})
+    def test_metrics_token(self):
+        self.client.logout()
+        self.assertEqual(self.get_metrics().status_code, 403)
+        self.assertEqual(self.get_metrics(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me').status_code, 200)
+
+
+TINY_SCRYPT = override_settings(
+    PASSWORD_HASHERS=['users.hashers.TunedScryptPasswordHasher', 'django.contrib.auth.hashers.MD5PasswordHasher'],
+    PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'SCRYPT_WORK_FACTOR': 2 ** 4, 'POOL_QUEUE_TIMEOUT': 0.01},
+)
+
+
+@TINY_SCRYPT
+class HashingTests(TestCase):
+    """The process pool is stood in for by a thread pool, which runs the same calls in-process"""
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(1)
+        self.addCleanup(self.executor.shutdown)
+        self.submit = mock.Mock(wraps=self.executor.submit)
+        self.executor.submit = self.submit
+        self.slots = threading.BoundedSemaphore(2)
+        for name, value in (('_executor', self.executor), ('_slots', self.slots)):
+            patcher = mock.patch.object(hashing, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_hashes_in_the_pool(self):
+        encoded = hashing.make_password('Pass-word-123')
+        self.assertTrue(encoded.startswith('scrypt$'))
+        self.assertTrue(hashing.check_password(User(password=encoded), 'Pass-word-123'))
+        self.assertEqual([call.args[0] for call in self.submit.call_args_list], [hashing._make, hashing._verify])
+
+    async def test_async_hashes_in_the_pool(self):
+        encoded = await hashing.amake_password('Pass-word-123')
+        self.assertTrue(await hashing.acheck_password(User(password=encoded), 'Pass-word-123'))
+        self.assertEqual(self.submit.call_count, 2)
+
+    def test_inline_without_workers(self):
+        with self.settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'SCRYPT_WORK_FACTOR': 2 ** 4, 'POOL_WORKERS': 0}):
+            self.assertTrue(hashing.make_password('Pass-word-123').startswith('scrypt$'))
+        self.submit.assert_not_called()
+
+    def test_busy_when_no_slot_frees_up(self):
+        for _ in range(2):
+            self.slots.acquire()
+        with self.assertRaises(hashing.HashingBusy):
+            hashing.make_password('Pass-word-123')
+        with self.assertRaises(hashing.HashingBusy):
+            async_to_sync(hashing.amake_password)('Pass-word-123')
+        self.submit.assert_not_called()
+        self.slots.release()
+        hashing.make_password('Pass-word-123')
+
+    def test_login_answers_503_when_busy(self):
+        User.objects.create_user('busy@example.com', 'Pass-word-123', email_verified=True)
+        for _ in range(2):
+            self.slots.acquire()
+        with self.assertLogs('django.request', 'ERROR'), self.assertLogs('backends.requests'):
+            response = self.client.post(
+                '/api/auth/login/', {"email": "busy@example.com", "password": "Pass-word-123"},
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 503)
+
+    def test_outdated_hash_upgraded_on_login(self):
+        user = User.objects.create_user('old@example.com', email_verified=True)
+        User.objects.filter(pk=user.pk).update(password=hashers.make_password('Pass-word-123', hasher='md5'))
+        response = self.client.post(
+            '/api/auth/login/', {"email": "old@example.com", "password": "Pass-word-123"},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(User.objects.get(pk=user.pk).password.startswith('scrypt$16$'))
+
+    def test_hash_with_old_cost_upgraded(self):
+        user = User.objects.create_user('cost@example.com', 'Pass-word-123')
+        with self.settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'SCRYPT_WORK_FACTOR': 2 ** 5}):
+            self.assertTrue(hashing.check_password(user, 'Pass-word-123'))
+        self.assertTrue(User.objects.get(pk=user.pk).password.startswith('scrypt$32$'))
+        self.assertFalse(hashing.check_password(user, 'wrong'))
+
+    async def test_async_outdated_hash_upgraded(self):
+        user = await User.objects.acreate_user('aold@example.com')
+        user.password = hashers.make_password('Pass-word-123', hasher='md5')
+        await user.asave(update_fields=['password'])
+        self.assertTrue(await hashing.acheck_password(user, 'Pass-word-123'))
+        self.assertTrue((await User.objects.aget(pk=user.pk)).password.startswith('scrypt$'))
+
+
+class StubPushResponse:
+    def __init__(self, status, results=None, headers=None):
+        self.status = status
+        self.results = results
+        self.headers = headers or {}
+
+    async def json(self, content_type='application/json'):
+        return {"results": self.results}
+
+
+class StubPushSession:
+    """aiohttp session stand-in for the provider; answer(tokens) returns a StubPushResponse"""
+
+    def __init__(self, answer=None):
+        self.answer = answer or (lambda tokens: StubPushResponse(200, [{"message_id": token} for token in tokens]))
+        self.batches = []
+        self.in_flight = self.peak = 0
+
+    def post(self, url, json, headers):
+        return self._post(json['registration_ids'])
+
+    @contextlib.asynccontextmanager
+    async def _post(self, tokens):
+        self.batches.append(tokens)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            yield self.answer(tokens)
+        finally:
+            self.in_flight -= 1
+
+
+class PushTests(TestCase):
+    def setUp(self):
+        self.tokens = {}
+        for i in range(7):
+            user = User.objects.create_user(f'push{i}@example.com', device_token=f'token-{i}')
+            self.tokens[f'token-{i}'] = user.pk
+        User.objects.create_user('untokened@example.com')
+        User.objects.create_user('blank@example.com', device_token='')
+        self.config = {
+            **push.get_config(), 'URI': 'http://push.test', 'BATCH_SIZE': 2, 'CHUNK_SIZE': 3, 'MAX_CONCURRENT': 2,
+            'RETRY_BACKOFF': 0, 'RETRY_MAX_BACKOFF': 0, 'RETRY_JITTER': 0,
+        }
+
+    async def dispatch(self, session):
+        payload = {"notification": {"title": "Hi", "body": "There"}, "data": {}}
+        return await push.Dispatcher(session, payload, self.config).run(push.targets())
+
+    def sent(self, session):
+        return sorted(token for batch in session.batches for token in batch)
+
+    async def test_every_recipient_sent_once_in_keyset_chunks(self):
+        session = StubPushSession()
+        with mock.patch.object(push, 'fetch_chunk', wraps=push.fetch_chunk) as fetch_chunk:
+            report = await self.dispatch(session)
+        self.assertEqual(self.sent(session), sorted(self.tokens))
+        self.assertEqual([call.args[1] for call in fetch_chunk.call_args_list], [
+            0, self.tokens['token-2'], self.tokens['token-5'], self.tokens['token-6'],
+        ])
+        self.assertEqual((report.targeted, report.sent, report.failed), (7, 7, 0))
+
+    async def test_batches_sent_concurrently_up_to_the_limit(self):
+        session = StubPushSession()
+        report = await self.dispatch(session)
+        self.assertTrue(all(len(batch) <= 2 for batch in session.batches))
+        self.assertEqual(report.batches, len(session.batches))
+        self.assertEqual(session.peak, 2)
+
+    async def test_failed_batch_retried(self):
+        failures = []
+
+        def answer(tokens):
+            if 'token-0' in tokens and not failures:
+                failures.append(tokens)
+                return StubPushResponse(503, headers={'Retry-After': '0'})
+            return StubPushResponse(200, [{"message_id": token} for token in tokens])
+        session = StubPushSession(answer)
+        report = await self.dispatch(session)
+        self.assertEqual(len(failures), 1)
+        self.assertEqual((report.sent, report.failed), (7, 0))
+
+    async def test_unavailable_tokens_sent_again(self):
+        failed = set()
+
+        def answer(tokens):
+            results = []
+            for token in tokens:
+                if token == 'token-3' and token not in failed:
+                    failed.add(token)
+                    results.append({"error": "Unavailable"})
+                else:
+                    results.append({"message_id": token})
+            return StubPushResponse(200, results)
+        session = StubPushSession(answer)
+        report = await self.dispatch(session)
+        self.assertEqual((report.sent, report.retried, report.failed), (7, 1, 0))
+        self.assertEqual(session.batches[-1], ['token-3'])
+
+    async def test_client_error_not_retried(self):
+        session = StubPushSession(lambda tokens: StubPushResponse(400))
+        report = await self.dispatch(session)
+        # Chunks of 3 split into batches of at most 2, each sent once
+        self.assertEqual([len(batch) for batch in session.batches], [2, 1, 2, 1, 1])
+        self.assertEqual((report.sent, report.failed), (0, 7))
+
+    async def test_invalid_tokens_pruned(self):
+        def answer(tokens):
+            return StubPushResponse(200, [
+                {"error": "NotRegistered"} if token in ('token-1', 'token-4') else {"message_id": token} for token in tokens
+            ])
+        with mock.patch.object(push, 'invalidate_many') as invalidate_many:
+            report = await self.dispatch(StubPushSession(answer))
+        self.assertEqual((report.sent, report.invalid, report.pruned), (5, 2, 2))
+        invalidate_many.assert_called_once_with([self.tokens['token-1'], self.tokens['token-4']])
+        remaining = {token async for token in User.objects.filter(device_token__gt='').values_list('device_token', flat=True)}
+        self.assertEqual(remaining, set(self.tokens) - {'token-1', 'token-4'})
+
+    def test_prune_keeps_replaced_token(self):
+        user_id = self.tokens['token-0']
+        User.objects.filter(pk=user_id).update(device_token='token-new')
+        with mock.patch.object(push, 'invalidate_many') as invalidate_many:
+            self.assertEqual(push.prune([(user_id, 'token-0'), (self.tokens['token-1'], 'token-1')]), 1)
+        invalidate_many.assert_called_once_with([user_id, self.tokens['token-1']])
+        self.assertEqual(User.objects.get(pk=user_id).device_token, 'token-new')
+
+
+@FAST_HASHING
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewTests(FreshLimiterMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('async@example.com', 'Pass-word-123', email_verified=True)
+        invalidate(self.user.pk)
+        self.credentials = {"email": "async@example.com", "password": "Pass-word-123"}
+
+    async def test_login_accepts_every_parsed_content_type(self):
+        encoded = "email=async%40example.com&password=Pass-word-123"
+        for kwargs in (
+            {'data': json.dumps(self.credentials), 'content_type': 'application/json'},
+            {'data': encoded, 'content_type': 'application/x-www-form-urlencoded'},
+            {'data': self.credentials},
+        ):
+            response = await AsyncClient().post('/login/', **kwargs)
+            self.assertEqual(response.status_code, 200, kwargs)
+            self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    async def test_unsupported_media_type(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = await self.async_client.post('/login/', 'email=async@example.com', content_type='text/plain')
+        self.assertEqual(response.status_code, 415)
+        self.assertIn('text/plain', response.json()['detail'])
+
+    async def test_malformed_json(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = await self.async_client.post('/login/', '{"email": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+    async def test_csrf_enforced_for_session_user(self):
+        client = AsyncClient(enforce_csrf_checks=True)
+        await client.aforce_login(self.user)
+        with self.assertLogs('django.request', 'WARNING'):
+            response = await client.post('/login/', self.credentials, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('CSRF', response.json()['detail'])
+
+    def registration(self, email):
+        return {
+            "email": email, "first_name": "New", "last_name": "User",
+            "password": "Pass-word-123", "confirm_password": "Pass-word-123",
+        }
+
+    async def test_register_writes_user_and_email_together(self):
+        response = await self.async_client.post('/register/', self.registration('New@Example.com'), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        user = await User.objects.aget(email='new@example.com')
+        self.assertTrue(await sync_to_async(user.check_password)('Pass-word-123'))
+        self.assertTrue(await OutboxEmail.objects.filter(recipients=['new@example.com']).aexists())
+
+    async def test_register_rolled_back_when_email_not_queued(self):
+        with mock.patch('users.views.enqueue_mail', side_effect=RuntimeError("outbox down")), \
+                self.assertLogs('django.request', 'ERROR'), self.assertLogs('backends.requests'), \
+                self.assertRaises(RuntimeError):
+            await self.async_client.post('/register/', self.registration('new@example.com'), content_type='application/json')
+        self.assertFalse(await User.objects.filter(email='new@example.com').aexists())
+
+    async def test_login_required(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = await self.async_client.get('/users/me/')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {"detail": "Authentication credentials were not provided."})
+
+    async def test_busy_hashing_pool_sheds_load(self):
+        with mock.patch('users.hashing.acheck_password', side_effect=hashing.HashingBusy()), \
+                self.assertLogs('django.request', 'ERROR'), self.assertLogs('backends.requests'):
+            response = await self.async_client.post('/login/', self.credentials, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {"detail": hashing.HashingBusy.default_detail})
+
+    async def test_throttled(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            for _ in range(10):
+                response = await self.async_client.post('/verify-email/', {"token": "000000"}, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+            response = await self.async_client.post('/verify-email/', {"token": "000000"}, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+
+class MiddlewareCheckTests(SimpleTestCase):
+    @override_settings(SECURE_HSTS_SECONDS=0, SECURE_SSL_REDIRECT=False, X_FRAME_OPTIONS='DENY')
+    def test_subclasses_count_as_stock_middleware(self):
+        ids = {message.id for message in checks.check_middleware_subclasses(None)}
+        self.assertEqual(ids & {'security.W001', 'security.W002', 'security.W003'}, set())
+        self.assertLessEqual({'security.W004', 'security.W008'}, ids)
+
+    @override_settings(MIDDLEWARE=[])
+    def test_missing_middleware_reported(self):
+        ids = {message.id for message in checks.check_middleware_subclasses(None)}
+        self.assertLessEqual({'security.W001', 'security.W002', 'security.W003'}, ids)
+
+
+class StubPool:
+    max_size = 4
+
+    def get_stats(self):
+        return {'pool_size': 4, 'pool_available': 1, 'requests_num': 10, 'requests_queued': 2,
+                'requests_wait_ms': 30}
+
+
+class PoolStatsTests(TestCase):
+    def test_aliases_without_pool(self):
+        self.assertEqual(db.pool_stats(), {alias: None for alias in settings.DATABASES})
+
+    def test_pool_counters(self):
+        with mock.patch.object(connection, 'pool', StubPool(), create=True):
+            stats = db.pool_stats()['default']
+        self.assertEqual(stats['pool_size'], 4)
+        self.assertEqual(stats['checkouts'], 10)
+        self.assertEqual(stats['avg_wait_ms'], 15)
+        self.assertEqual(stats['saturation'], 0.75)
+
+    def test_endpoint_admin_only(self):
+        user = User.objects.create_user('pool@example.com', 'Pass-word-123')
+        self.client.force_login(user)
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.client.get('/api/db/stats/').status_code, 403)
+        User.objects.filter(pk=user.pk).update(is_staff=True)
+        invalidate(user.pk)
+        self.client.force_login(User.objects.get(pk=user.pk))
+        with mock.patch.object(connection, 'pool', StubPool(), create=True):
+            response = self.client.get('/api/db/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['default']['saturation'], 0.75)
+
+
+class FirstUseSettingsTests(SimpleTestCase):
+    def test_settings_import_without_optional_variables(self):
+        optional = ('SECRET_KEY', 'EMAIL_HOST', 'EMAIL_HOST_USER', 'AWS_STORAGE_BUCKET_NAME', 'AWS_ACCESS_KEY_ID')
+        environ = {name: value for name, value in os.environ.items() if name not in optional}
+        with mock.patch.dict(os.environ, environ, clear=True), mock.patch.object(env, 'load_dotenv'):
+            # A fresh copy of the module, next to the one already imported
+            spec = importlib.util.spec_from_file_location(
+                'backends.fresh_settings', os.path.join(os.path.dirname(env.__file__), 'settings.py'))
+            fresh = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(fresh)
+        self.assertIsNone(fresh.EMAIL_HOST)
+        self.assertEqual(fresh.AWS_STORAGE_BUCKET_NAME, '')
+
+    @override_settings(EMAIL_HOST='smtp.example.com', EMAIL_HOST_USER='')
+    def test_require_names_missing_settings(self):
+        env.require('EMAIL_HOST')
+        with self.assertRaisesMessage(ImproperlyConfigured, 'Set EMAIL_HOST_USER in'):
+            env.require('EMAIL_HOST', 'EMAIL_HOST_USER')
+
+    @override_settings(EMAIL_HOST=None, EMAIL_HOST_USER='')
+    def test_mail_checked_on_connect(self):
+        connection = mail.get_connection('backends.mail.EmailBackend')
+        with mock.patch('smtplib.SMTP') as smtp, \
+                self.assertRaisesMessage(ImproperlyConfigured, 'Set EMAIL_HOST, EMAIL_HOST_USER in'):
+            connection.open()
+        smtp.assert_not_called()
+
+    @override_settings(EMAIL_HOST='smtp.example.com', EMAIL_HOST_USER='outbox@example.com',
+                       EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False)
+    def test_mail_configured(self):
+        connection = mail.get_connection('backends.mail.EmailBackend')
+        with mock.patch('smtplib.SMTP') as smtp:
+            self.assertTrue(connection.open())
+        smtp.assert_called_once()
+
+    @override_settings(AWS_STORAGE_BUCKET_NAME='')
+    def test_storage_checked_when_created(self):
+        try:
+            from backends.storage import MediaStorage
+        except ImproperlyConfigured:
+            self.skipTest("boto3 is not installed")
+        with self.assertRaisesMessage(ImproperlyConfigured, 'Set AWS_STORAGE_BUCKET_NAME in'):
+            MediaStorage()
@@ -0,0 +1,89 @@
+import hashlib
+import hmac
+import random
+import string
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import OneTimeToken
+
+_random = random.SystemRandom()
+
+
+def generate_otp(length=6):
+    """Generate a numeric OTP of specified length"""
+    return ''.join(_random.choices(string.digits, k=length))
+
+
+def hash_token(purpose, token):
+    """Keyed hash of a code; the only form in which codes are stored"""
+    return hmac.new(
+        settings.SECRET_KEY.encode(),
+        f"{purpose}:{token}".encode(),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def issue_token(user, purpose, attempts=5):
+    """Create a fresh OTP for user and purpose and return the plain code
+
+    Any earlier code of the same user and purpose stops working. Codes are
+    unique per purpose among stored tokens, so a code identifies its user;
+    on the rare collision a new code is drawn.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.OTP_TOKEN_TTL)
+    for _ in range(attempts):
+        otp = generate_otp()
+        token_hash = hash_token(purpose, otp)
+        try:
+            with transaction.atomic():
+                # An expired token holding the same code must not block it
+                OneTimeToken.objects.filter(purpose=purpose, token_hash=token_hash, expires_at__lte=now).delete()
+                # Replacing the user's code is a single UPDATE; a concurrent
+                # first insert surfaces as IntegrityError and is retried
+                replaced = OneTimeToken.objects.filter(user=user, purpose=purpose).update(
+                    token_hash=token_hash, expires_at=expires_at,
+                )
+                if not replaced:
+                    OneTimeToken.objects.create(
+                        user=user, purpose=purpose, token_hash=token_hash, expires_at=expires_at,
+                    )
+            return otp
+        except IntegrityError:
+            continue
+    raise IntegrityError("Could not allocate a unique one-time token")
+
+
+def consume_token(purpose, token):
+    """Invalidate an unexpired code and return the id of the user owning it
+
+    Returns None for unknown or expired codes. The lookup goes through the
+    (purpose, token_hash) unique index and takes no lock; the code is then
+    deleted only if it is still the same, so of two requests racing with
+    one code exactly one gets the user.
+    """
+    token_hash = hash_token(purpose, token)
+    stored = (
+        OneTimeToken.objects
+        .filter(purpose=purpose, token_hash=token_hash, expires_at__gt=timezone.now())
+        .values_list('pk', 'user_id')
+        .first()
+    )
+    if stored is None:
+        return None
+    pk, user_id = stored
+    deleted, _ = OneTimeToken.objects.filter(pk=pk, token_hash=token_hash).delete()
+    return user_id if deleted else None
+
+
+def expired_reset_tokens():
+    """Password reset codes past their expiry, found through otp_reset_expiry_idx
+
+    Verification codes go when they are used or with their user; reset
+    codes that are never used stay behind until purged.
+    """
+    return OneTimeToken.objects.filter(purpose=OneTimeToken.PASSWORD_RESET, expires_at__lte=timezone.now())
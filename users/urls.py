@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
@@ -18,3 +19,12 @@ urlpatterns = [
     # User information
     path('', include(router.urls)),
 ]
+
+if settings.ASYNC_VIEWS:
+    # Matched before the sync views above
+    urlpatterns = [
+        path('register/', views.AsyncRegisterUserView.as_view(), name='register'),
+        path('verify-email/', views.AsyncVerifyEmailView.as_view(), name='verify-email'),
+        path('login/', views.AsyncLoginView.as_view(), name='login'),
+        path('users/me/', views.AsyncUserMeView.as_view(), name='user-me'),
+    ] + urlpatterns
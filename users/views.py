@@ -1,21 +1,22 @@
-from django.shortcuts import render
 from rest_framework import status, permissions, viewsets
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from django.contrib.auth import get_user_model, login, logout, authenticate, update_session_auth_hash
-from django.utils import timezone
-from datetime import timedelta
-import uuid
-import random
-import string
+from django.contrib.auth import get_user_model, login, logout, authenticate, update_session_auth_hash, aauthenticate, alogin
 from django.conf import settings
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.urls import reverse
+from django.db import transaction
+from django.http import JsonResponse
+from asgiref.sync import sync_to_async
 
+from . import hashing
+from .auth import invalidate_on_commit
+from backends.throttling import EmailThrottle, IPThrottle
+from backends.views import AsyncAPIView
+from .models import OneTimeToken
+from .outbox import enqueue_mail
+from .tokens import issue_token, consume_token
 from .serializers import (
     UserSerializer,
     UserRegistrationSerializer,
@@ -29,22 +30,21 @@ from .serializers import (
 
 User = get_user_model()
 
-def generate_otp(length=6):
-    """Generate a numeric OTP of specified length"""
-    return ''.join(random.choices(string.digits, k=length))
-
 class RegisterUserView(APIView):
     """Register a new user with email, phone, and other details"""
     permission_classes = [AllowAny]
     authentication_classes = []
+    throttle_classes = [IPThrottle]
+    throttle_scope = 'register'
     
     def post(self, request):
         serializer = UserRegistrationSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
-            
-            # Send verification email with OTP
-            self.send_verification_email(user)
+            with transaction.atomic():
+                user = serializer.save()
+                
+                # Queue verification email with OTP
+                self.send_verification_email(user)
             
             return Response({
                 "detail": "User registered successfully. Please check your email for verification OTP.",
@@ -54,12 +54,8 @@ class RegisterUserView(APIView):
     
     def send_verification_email(self, user):
         """Send verification email with OTP to the user"""
-        # Generate 6-digit OTP
-        otp = generate_otp()
-        
-        # Save OTP to user
-        user.email_verification_token = otp
-        user.save()
+        # Generate 6-digit OTP; only its hash is stored
+        otp = issue_token(user, OneTimeToken.VERIFY_EMAIL)
         
         subject = "Verify Your Email"
         message = f"""
@@ -74,50 +70,58 @@ class RegisterUserView(APIView):
         If you did not register for an account, please ignore this email.
         """
         
-        try:
-            print('aaya idhr')
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[user.email],
-                fail_silently=False,
-            )
-        except Exception as e:
-            # Log the error but don't fail the registration
-            print(f"Failed to send verification email: {str(e)}")
+        # Delivered by the send_outbox worker, so SMTP latency or outages
+        # never reach the request
+        enqueue_mail(
+            subject=subject,
+            message=message,
+            recipient_list=[user.email],
+        )
 
 class VerifyEmailView(APIView):
     """Verify user's email with OTP"""
     permission_classes = [AllowAny]
     authentication_classes = []
+    # Codes are 6 digits and identify their user, so guesses are capped tightly
+    throttle_classes = [IPThrottle]
+    throttle_scope = 'verify_email'
     
     def post(self, request):
         serializer = EmailVerificationSerializer(data=request.data)
         if serializer.is_valid():
             otp = serializer.validated_data['token']
             
-            try:
-                user = User.objects.get(email_verification_token=otp, email_verified=False)
-            except User.DoesNotExist:
+            if not self.verify(otp):
                 return Response(
                     {"detail": "Invalid or expired verification code"}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Mark email as verified and remove token
-            user.email_verified = True
-            user.email_verification_token = None
-            user.save()
-            
             return Response({"detail": "Email successfully verified"})
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    @staticmethod
+    @transaction.atomic
+    def verify(otp):
+        """Mark the owner of a verification code as verified; False for bad codes"""
+        # Looks the code up by its hash and invalidates it
+        user_id = consume_token(OneTimeToken.VERIFY_EMAIL, otp)
+        if user_id is None:
+            return False
+        
+        # Mark email as verified, unless a concurrent request already did
+        if not User.objects.filter(pk=user_id, email_verified=False).update(email_verified=True):
+            return False
+        invalidate_on_commit(user_id)
+        return True
 
 class LoginView(APIView):
     """Email and password based login"""
     permission_classes = [AllowAny]
     authentication_classes = [SessionAuthentication]
+    throttle_classes = [IPThrottle, EmailThrottle]
+    throttle_scope = 'login'
     
     def post(self, request):
         serializer = UserLoginSerializer(data=request.data)
@@ -150,12 +154,11 @@ class LoginView(APIView):
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    @transaction.atomic
     def resend_verification_email(self, user):
         """Resend verification email with OTP to the user"""
-        # Generate new OTP
-        otp = generate_otp()
-        user.email_verification_token = otp
-        user.save()
+        # Generate new OTP; the previous one stops working
+        otp = issue_token(user, OneTimeToken.VERIFY_EMAIL)
         
         subject = "Verify Your Email"
         message = f"""
@@ -170,17 +173,11 @@ class LoginView(APIView):
         If you did not register for an account, please ignore this email.
         """
         
-        try:
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[user.email],
-                fail_silently=False,
-            )
-        except Exception as e:
-            # Log the error but don't fail the request
-            print(f"Failed to send verification email: {str(e)}")
+        enqueue_mail(
+            subject=subject,
+            message=message,
+            recipient_list=[user.email],
+        )
 
 class LogoutView(APIView):
     """Log out the currently authenticated user"""
@@ -194,6 +191,8 @@ class PasswordResetRequestView(APIView):
     """Request password reset via email"""
     permission_classes = [AllowAny]
     authentication_classes = []
+    throttle_classes = [IPThrottle, EmailThrottle]
+    throttle_scope = 'password_reset'
     
     def post(self, request):
         serializer = PasswordResetRequestSerializer(data=request.data)
@@ -201,49 +200,48 @@ class PasswordResetRequestView(APIView):
             email = serializer.validated_data['email']
             
             try:
-                user = User.objects.get(email=email)
+                user = User.objects.by_email(email).get()
             except User.DoesNotExist:
                 # Don't reveal that the user doesn't exist
                 return Response({"detail": "Password reset code sent if account exists"})
             
-            # Generate OTP
-            otp = generate_otp()
-            user.password_reset_token = otp
-            user.save()
-            
-            subject = "Reset Your Password"
-            message = f"""
-            Hi {user.first_name},
-            
-            We received a request to reset your password. Use the following code to reset it:
-            
-            {otp}
-            
-            This code will expire in 24 hours.
-            
-            If you did not request a password reset, please ignore this email.
-            """
-            
-            try:
-                send_mail(
-                    subject=subject,
-                    message=message,
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=[user.email],
-                    fail_silently=False,
-                )
-            except Exception as e:
-                # Log the error but don't reveal it to the user
-                print(f"Failed to send password reset email: {str(e)}")
+            self.send_reset_email(user)
             
             return Response({"detail": "Password reset code sent if account exists"})
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    @transaction.atomic
+    def send_reset_email(self, user):
+        """Send password reset email with OTP to the user"""
+        # Generate OTP; any earlier reset code stops working
+        otp = issue_token(user, OneTimeToken.PASSWORD_RESET)
+        
+        subject = "Reset Your Password"
+        message = f"""
+        Hi {user.first_name},
+        
+        We received a request to reset your password. Use the following code to reset it:
+        
+        {otp}
+        
+        This code will expire in 24 hours.
+        
+        If you did not request a password reset, please ignore this email.
+        """
+        
+        enqueue_mail(
+            subject=subject,
+            message=message,
+            recipient_list=[user.email],
+        )
 
 class PasswordResetConfirmView(APIView):
     """Reset password using OTP"""
     permission_classes = [AllowAny]
     authentication_classes = []
+    throttle_classes = [IPThrottle]
+    throttle_scope = 'password_reset_confirm'
     
     def post(self, request):
         serializer = PasswordResetConfirmSerializer(data=request.data)
@@ -251,18 +249,18 @@ class PasswordResetConfirmView(APIView):
             otp = serializer.validated_data['token']
             new_password = serializer.validated_data['new_password']
             
-            try:
-                user = User.objects.get(password_reset_token=otp)
-            except User.DoesNotExist:
-                return Response(
-                    {"detail": "Invalid or expired code"}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Set new password and remove token
-            user.set_password(new_password)
-            user.password_reset_token = None
-            user.save()
+            with transaction.atomic():
+                # Looks the code up by its hash and invalidates it
+                user_id = consume_token(OneTimeToken.PASSWORD_RESET, otp)
+                if user_id is None:
+                    return Response(
+                        {"detail": "Invalid or expired code"}, 
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                
+                # Set new password
+                User.objects.filter(pk=user_id).update(password=hashing.make_password(new_password))
+                invalidate_on_commit(user_id)
             
             return Response({"detail": "Password reset successful"})
         
@@ -278,14 +276,14 @@ class PasswordChangeView(APIView):
             user = request.user
             
             # Check current password
-            if not user.check_password(serializer.validated_data['current_password']):
+            if not hashing.check_password(user, serializer.validated_data['current_password']):
                 return Response(
                     {"detail": "Current password is incorrect"}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
             # Set new password
-            user.set_password(serializer.validated_data['new_password'])
+            hashing.set_password(user, serializer.validated_data['new_password'])
             user.save()
             
             # Update session to prevent logout
@@ -317,4 +315,102 @@ class UserViewSet(viewsets.ModelViewSet):
             request.user.device_token = serializer.validated_data['device_token']
             request.user.save()
             return Response({"detail": "Device token updated successfully"})
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+# Async versions of the views above, routed instead of them when
+# ASYNC_VIEWS is on (ASGI deployments). They keep the same responses;
+# hashing waits on the process pool without holding a thread, and work
+# that needs a transaction runs as one sync_to_async call, since the
+# async ORM cannot open transactions.
+
+class AsyncRegisterUserView(AsyncAPIView):
+    """RegisterUserView for ASGI deployments"""
+    session_auth = False
+    throttle_classes = [IPThrottle]
+    throttle_scope = 'register'
+    
+    async def post(self, request):
+        serializer = UserRegistrationSerializer(data=request.data)
+        # The email uniqueness checks query the database
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        data = dict(serializer.validated_data)
+        data.pop('confirm_password')
+        # Hashed first, so the transaction below does not wait on the pool
+        data['password_hash'] = await hashing.amake_password(data.pop('password'))
+        user = await sync_to_async(self.register)(data)
+        
+        return JsonResponse({
+            "detail": "User registered successfully. Please check your email for verification OTP.",
+            "user": UserSerializer(user).data
+        }, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    @transaction.atomic
+    def register(data):
+        """Create the user and queue their verification email in one transaction"""
+        user = User.objects.create_user_hashed(**data)
+        RegisterUserView().send_verification_email(user)
+        return user
+
+class AsyncVerifyEmailView(AsyncAPIView):
+    """VerifyEmailView for ASGI deployments"""
+    session_auth = False
+    throttle_classes = [IPThrottle]
+    throttle_scope = 'verify_email'
+    
+    async def post(self, request):
+        serializer = EmailVerificationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not await sync_to_async(VerifyEmailView.verify)(serializer.validated_data['token']):
+            return JsonResponse(
+                {"detail": "Invalid or expired verification code"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return JsonResponse({"detail": "Email successfully verified"})
+
+class AsyncLoginView(AsyncAPIView):
+    """LoginView for ASGI deployments"""
+    throttle_classes = [IPThrottle, EmailThrottle]
+    throttle_scope = 'login'
+    
+    async def post(self, request):
+        serializer = UserLoginSerializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        user = await aauthenticate(
+            request,
+            username=serializer.validated_data['email'],
+            password=serializer.validated_data['password'],
+        )
+        if user is None:
+            return JsonResponse(
+                {"detail": "Invalid email or password"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        
+        if not user.email_verified:
+            await sync_to_async(LoginView().resend_verification_email)(user)
+            return JsonResponse(
+                {"detail": "Email not verified. Verification code has been resent to your email."},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        
+        await alogin(request, user)
+        
+        return JsonResponse({
+            "detail": "Login successful",
+            "user": UserSerializer(user).data
+        })
+
+class AsyncUserMeView(AsyncAPIView):
+    """UserViewSet.me for ASGI deployments"""
+    login_required = True
+    
+    async def get(self, request):
+        return JsonResponse(UserSerializer(request.user).data)